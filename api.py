@@ -1,38 +1,101 @@
-from fastapi import FastAPI, HTTPException  # Remove unused Depends
-from pydantic import BaseModel, EmailStr, constr, confloat, conint
-from typing import List, Optional  
-from invoice_generator import InvoiceGenerator  # Remove unused datetime.date
+from fastapi import (
+    FastAPI,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
+from datetime import date, datetime
+import io
+import os
+import time
+from sqlalchemy import func
+from invoice_generator import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvoiceGenerator
+from database import Session, Customer, CustomerSummary, init_db
+from pdf_generator import (
+    render_invoice_bytes,
+    render_invoice_file,
+    render_statement_bytes,
+)
+from schemas import (
+    CustomerCreate,
+    EmailBatchCreate,
+    InvoiceBulkCreate,
+    InvoiceCreate,
+    InvoiceStatusUpdate,
+    JobCreate,
+    PDFBatchCreate,
+    RecurringInvoiceCreate,
+)
+import concurrency
+import export
+import idempotency
+import importer
+import jobs
+import metrics
+import recurring
+from config import (
+    API_RENDER_WORKERS,
+    IMPORT_REJECTS_DIR,
+    JOB_UPLOAD_DIR,
+    JOB_WORKERS,
+)
+import reports
+import search
 import uvicorn
 
 
-
-app = FastAPI(title="Invoice Generator API", version="1.0.0")
-generator = InvoiceGenerator()
-
-
-class CustomerCreate(BaseModel):
-    name: constr(min_length=1, max_length=100)
-    email: EmailStr
-    address: Optional[str]
-    phone: Optional[str]
+@asynccontextmanager
+async def lifespan(app):
+    init_db()
+    workers = jobs.WorkerPool(JOB_WORKERS) if JOB_WORKERS else None
+    if workers:
+        workers.start()
+    yield
+    if workers:
+        workers.stop()
+    concurrency.shutdown()
 
 
-class InvoiceItemCreate(BaseModel):
-    description: constr(min_length=1, max_length=255)
-    quantity: conint(gt=0)
-    unit_price: confloat(gt=0)
+app = FastAPI(title="Invoice Generator API", version="1.0.0", lifespan=lifespan)
+generator = InvoiceGenerator()
 
 
-class InvoiceCreate(BaseModel):
-    customer_id: int
-    items: List[InvoiceItemCreate]
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep the series bounded
+        route = request.scope.get("route")
+        metrics.http_request_duration.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=str(status),
+        )
 
 
 @app.post("/customers/", response_model=dict)
 async def create_customer(customer: CustomerCreate):
     try:
-        customer_id = generator.create_customer(
-            customer.name, customer.email, customer.address, customer.phone
+        customer_id = await concurrency.run_db(
+            generator.create_customer,
+            customer.name,
+            customer.email,
+            customer.address,
+            customer.phone,
         )
         return {"id": customer_id, "message": "Customer created successfully"}
     except ValueError as e:
@@ -40,51 +103,397 @@ async def create_customer(customer: CustomerCreate):
 
 
 @app.post("/invoices/", response_model=dict)
-async def create_invoice(invoice: InvoiceCreate):
+async def create_invoice(
+    invoice: InvoiceCreate,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+):
     try:
         items = [dict(item) for item in invoice.items]
-        invoice_id = generator.create_invoice(invoice.customer_id, items)
+        invoice_id = await concurrency.run_db(
+            generator.create_invoice,
+            invoice.customer_id,
+            items,
+            idempotency_key=idempotency_key,
+        )
         return {"id": invoice_id, "message": "Invoice created successfully"}
+    except idempotency.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.get("/customers/")
-async def list_customers():
-    session = Session()
-    try:
-        customers = session.query(Customer).all()
-        return [{"id": c.id, "name": c.name, "email": c.email} for c in customers]
-    finally:
-        session.close()
+@app.post("/invoices/bulk", response_model=dict)
+async def create_invoices_bulk(payload: InvoiceBulkCreate):
+    invoices = [
+        {"customer_id": i.customer_id, "items": [dict(item) for item in i.items]}
+        for i in payload.invoices
+    ]
+    results = await concurrency.run_db(generator.create_invoices_bulk, invoices)
+    created = sum(1 for r in results if "id" in r)
+    return {"created": created, "failed": len(results) - created, "results": results}
 
 
-@app.get("/invoices/")
-async def list_invoices():
+def _list_customers():
     session = Session()
     try:
-        invoices = session.query(Invoice).all()
+        rows = session.query(
+            Customer.id,
+            Customer.name,
+            Customer.email,
+            # Coalesced in SQL so customers without a summary row still get
+            # amounts through the Money type
+            func.coalesce(CustomerSummary.invoice_count, 0).label("invoice_count"),
+            func.coalesce(CustomerSummary.total_billed, 0).label("total_billed"),
+            func.coalesce(CustomerSummary.outstanding, 0).label("outstanding"),
+        ).outerjoin(CustomerSummary, CustomerSummary.customer_id == Customer.id)
         return [
             {
-                "id": i.id,
-                "invoice_number": i.invoice_number,
-                "customer_name": i.customer.name,
-                "total_amount": i.total_amount,
-                "date": i.date,
+                "id": c.id,
+                "name": c.name,
+                "email": c.email,
+                "invoice_count": c.invoice_count,
+                "total_billed": c.total_billed,
+                "outstanding": c.outstanding,
             }
-            for i in invoices
+            for c in rows
         ]
     finally:
         session.close()
 
 
+@app.put("/invoices/{invoice_id}/status", response_model=dict)
+async def set_invoice_status(invoice_id: int, update: InvoiceStatusUpdate):
+    try:
+        await concurrency.run_db(
+            generator.set_invoice_status, invoice_id, update.status
+        )
+    except ValueError as e:
+        status_code = 404 if str(e) == "Invoice not found" else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
+    return {"id": invoice_id, "status": update.status}
+
+
+@app.get("/customers/")
+async def list_customers():
+    return await concurrency.run_db(_list_customers)
+
+
+@app.get("/invoices/")
+async def list_invoices(
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+    status: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    include_items: bool = False,
+    include_archived: bool = True,
+):
+    # Keyset pagination: pass the last id of a page as after_id for the next
+    return await concurrency.run_db(
+        generator.list_invoices,
+        after_id=after_id,
+        limit=limit,
+        status=status,
+        customer_id=customer_id,
+        date_from=date_from,
+        date_to=date_to,
+        include_items=include_items,
+        include_archived=include_archived,
+    )
+
+
+@app.get("/customers/{customer_id}")
+async def get_customer(customer_id: int):
+    try:
+        return await concurrency.run_db(generator.get_customer, customer_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/invoices/{invoice_id}")
+async def get_invoice(invoice_id: int):
+    try:
+        return await concurrency.run_db(generator.get_invoice, invoice_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @app.get("/invoices/{invoice_id}/pdf")
-async def generate_pdf(invoice_id: int):
+async def generate_pdf(invoice_id: int, persist: bool = True):
+    try:
+        filename, key, data, snapshot = await concurrency.run_db(
+            generator.prepare_pdf, invoice_id
+        )
+        if data is None:
+            # Only real renders take a slot; cached downloads never wait
+            async with concurrency.render_gate.slot():
+                data = await concurrency.run_render(render_invoice_bytes, *snapshot)
+            if persist:
+                await concurrency.run_db(generator.pdf_cache.put_bytes, key, data)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except concurrency.ServiceOverloaded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
+    return Response(
+        content=data,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="{filename}"'},
+    )
+
+
+@app.get("/customers/{customer_id}/statement")
+async def generate_statement(
+    customer_id: int,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    try:
+        async with concurrency.render_gate.slot():
+            filename, customer, invoices = await concurrency.run_db(
+                generator.prepare_statement, customer_id, date_from, date_to
+            )
+            data = await concurrency.run_render(
+                render_statement_bytes, customer, invoices, date_from, date_to
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except concurrency.ServiceOverloaded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
+    return Response(
+        content=data,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="{filename}"'},
+    )
+
+
+@app.post("/invoices/pdfs", response_model=dict)
+async def generate_pdfs(batch: PDFBatchCreate):
+    tasks = await concurrency.run_db(generator.prepare_pdf_files, batch.invoice_ids)
+    # Renders go through the shared render gate and process pool, at most
+    # ``workers`` of them at a time for this batch
+    limit = asyncio.Semaphore(batch.workers or API_RENDER_WORKERS)
+
+    async def render(invoice_id, task):
+        if isinstance(task, str):
+            return {"invoice_id": invoice_id, "error": task}
+        async with limit, concurrency.render_gate.slot():
+            try:
+                filename = await concurrency.run_render(render_invoice_file, *task)
+            except Exception as e:
+                return {"invoice_id": invoice_id, "error": str(e)}
+        return {"invoice_id": invoice_id, "filename": filename}
+
+    renders = [asyncio.ensure_future(render(*task)) for task in tasks]
+    try:
+        results = await asyncio.gather(*renders)
+    except concurrency.ServiceOverloaded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
+    finally:
+        for future in renders:
+            future.cancel()
+    generated = sum(1 for r in results if "filename" in r)
+    return {
+        "generated": generated,
+        "failed": len(results) - generated,
+        "results": results,
+    }
+
+
+@app.post("/invoices/send", response_model=dict, status_code=202)
+async def send_invoices(batch: EmailBatchCreate):
+    if not batch.invoice_ids:
+        raise HTTPException(status_code=400, detail="No invoices to send")
+    job_id = await concurrency.run_db(
+        jobs.submit, "email", {"invoice_ids": batch.invoice_ids}
+    )
+    return {"id": job_id, "status": "queued"}
+
+
+@app.post("/recurring-invoices/", response_model=dict)
+async def create_recurring_invoice(template: RecurringInvoiceCreate):
+    try:
+        template_id = await concurrency.run_db(
+            recurring.create_template,
+            template.customer_id,
+            [dict(item) for item in template.items],
+            template.cadence,
+            template.start_date,
+            template.end_date,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": template_id, "message": "Recurring invoice created successfully"}
+
+
+@app.get("/recurring-invoices/{template_id}")
+async def get_recurring_invoice(template_id: int):
+    try:
+        return await concurrency.run_db(recurring.get_template, template_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.delete("/recurring-invoices/{template_id}", response_model=dict)
+async def deactivate_recurring_invoice(template_id: int):
+    try:
+        await concurrency.run_db(recurring.deactivate, template_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"id": template_id, "active": False}
+
+
+@app.get("/reports/revenue/monthly")
+async def report_revenue_by_month(
+    year: Optional[int] = None, customer_id: Optional[int] = None
+):
+    return await concurrency.run_db(
+        reports.revenue_by_month, year=year, customer_id=customer_id
+    )
+
+
+@app.get("/reports/revenue/customers")
+async def report_revenue_by_customer(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = Query(100, gt=0, le=MAX_PAGE_SIZE),
+):
+    return await concurrency.run_db(
+        reports.revenue_by_customer, date_from=date_from, date_to=date_to, limit=limit
+    )
+
+
+@app.get("/reports/status")
+async def report_totals_by_status():
+    return await concurrency.run_db(reports.totals_by_status)
+
+
+@app.get("/reports/aging")
+async def report_aging(as_of: Optional[date] = None):
+    return await concurrency.run_db(reports.aging, as_of=as_of)
+
+
+@app.get("/search")
+async def search_records(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: Optional[str] = Query(None, pattern="^(customers|invoices)$"),
+    limit: int = Query(20, gt=0, le=search.MAX_SEARCH_RESULTS),
+    offset: int = Query(0, ge=0, le=search.SEARCH_CANDIDATES),
+):
+    try:
+        return await concurrency.run_db(
+            search.search, q, type=type, limit=limit, offset=offset
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/export/invoices")
+async def export_invoices(
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    after_id: Optional[int] = None,
+):
+    # Sync generators are iterated on a worker thread by StreamingResponse
+    iter_export, media_type = export.EXPORT_FORMATS[format]
+    return StreamingResponse(
+        iter_export(after_id),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="invoices.{format}"'},
+    )
+
+
+def _import_upload(kind, upload, fmt, chunk_size):
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    rejects_path = IMPORT_REJECTS_DIR / f"{kind}_{stamp}.rejects.jsonl"
+    stream = io.TextIOWrapper(upload.file, encoding="utf-8", newline="")
+    return importer.run_import(kind, stream, fmt, chunk_size, rejects_path)
+
+
+@app.post("/import", response_model=dict)
+async def import_records(
+    kind: str = Query(..., pattern="^(customers|invoices)$"),
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    chunk_size: int = Query(importer.IMPORT_CHUNK_SIZE, gt=0, le=10000),
+    file: UploadFile = File(...),
+):
+    return await concurrency.run_db(_import_upload, kind, file, format, chunk_size)
+
+
+@app.post("/jobs", response_model=dict, status_code=202)
+async def submit_job(job: JobCreate):
     try:
-        filename = generator.generate_pdf(invoice_id)
-        return {"filename": filename, "message": "PDF generated successfully"}
+        job_id = await concurrency.run_db(jobs.submit, job.kind, job.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": job_id, "status": "queued"}
+
+
+def _save_upload(kind, upload, fmt):
+    JOB_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    path = JOB_UPLOAD_DIR / f"{kind}_{stamp}.{fmt}"
+    with open(path, "wb") as output:
+        while chunk := upload.file.read(1024 * 1024):
+            output.write(chunk)
+    return str(path)
+
+
+@app.post("/jobs/import", response_model=dict, status_code=202)
+async def submit_import_job(
+    kind: str = Query(..., pattern="^(customers|invoices)$"),
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    chunk_size: int = Query(importer.IMPORT_CHUNK_SIZE, gt=0, le=10000),
+    file: UploadFile = File(...),
+):
+    path = await concurrency.run_db(_save_upload, kind, file, format)
+    params = {"kind": kind, "path": path, "format": format, "chunk_size": chunk_size}
+    job_id = await concurrency.run_db(jobs.submit, "import", params)
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    try:
+        return await concurrency.run_db(jobs.get_job, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: int):
+    try:
+        job = await concurrency.run_db(jobs.get_job, job_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    filename = (job["result"] or {}).get("filename")
+    if not filename or not os.path.exists(filename):
+        raise HTTPException(status_code=404, detail="Job has no result file")
+    return FileResponse(filename, filename=os.path.basename(filename))
+
+
+@app.get("/pdf-cache/stats")
+async def pdf_cache_stats():
+    return generator.pdf_cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/record-cache/stats")
+async def record_cache_stats():
+    return generator.records.stats()
 
 
 if __name__ == "__main__":
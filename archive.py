@@ -0,0 +1,170 @@
+"""Archival of old paid and cancelled invoices.
+
+:func:`archive_invoices` moves invoices and their items from the
+invoices/invoice_items tables to invoices_archive/invoice_items_archive,
+keeping their IDs and numbers, so the live tables and their indexes only
+hold the working set. InvoiceGenerator.get_invoice and list_invoices look in
+the archive too, and the reports and customer_summary.rebuild read both
+tables through :func:`all_invoices`.
+
+The invoices and invoice_items tables are created with AUTOINCREMENT, so
+SQLite never reuses the IDs of archived rows. Databases created before that
+keep plain rowids, where a new row gets ``max(id) + 1``; for them the invoice
+with the highest ID, and the one owning the highest item ID, are never
+archived. That only protects archived IDs while those rows exist: if the
+newest invoices are later deleted, e.g. with their customer, new invoices
+can reuse archived IDs. Such databases have to be rebuilt with AUTOINCREMENT
+tables (SQLite cannot add it to an existing table).
+
+Archiving does not change customer_summary: archived invoices still count
+toward their customer's figures. An archived invoice's own PDF can still be
+generated, but batch PDFs, statements, search and exports cover live
+invoices only.
+"""
+
+import argparse
+import logging
+import sys
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, union_all
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_STATUSES
+from database import (
+    Session,
+    ArchivedInvoice,
+    ArchivedInvoiceItem,
+    Invoice,
+    InvoiceItem,
+    init_db,
+)
+from record_cache import default_cache
+
+logger = logging.getLogger(__name__)
+
+INVOICE_COLUMNS = (
+    "id",
+    "invoice_number",
+    "date",
+    "due_date",
+    "customer_id",
+    "total_amount",
+    "status",
+    "notes",
+)
+ITEM_COLUMNS = ("id", "invoice_id", "description", "quantity", "unit_price", "total")
+
+
+def all_invoices():
+    """Return a subquery over live and archived invoices, for reports."""
+    columns = ("id", "customer_id", "date", "due_date", "status", "total_amount")
+    return union_all(
+        select(*(Invoice.__table__.c[name] for name in columns)),
+        select(*(ArchivedInvoice.__table__.c[name] for name in columns)),
+    ).subquery("all_invoices")
+
+
+def _move_batch(session, invoice_ids, archivable):
+    invoices = Invoice.__table__
+    items = InvoiceItem.__table__
+    archived = ArchivedInvoice.__table__
+    archived_items = ArchivedInvoiceItem.__table__
+    now = literal(datetime.now(), DateTime)
+
+    moved = (
+        session.execute(
+            insert(archived)
+            .from_select(
+                [*INVOICE_COLUMNS, "archived_at"],
+                select(*(invoices.c[name] for name in INVOICE_COLUMNS), now).where(
+                    invoices.c.id.in_(invoice_ids), archivable
+                ),
+            )
+            .returning(archived.c.id)
+        )
+        .scalars()
+        .all()
+    )
+    if not moved:
+        return moved
+    session.execute(
+        insert(archived_items).from_select(
+            list(ITEM_COLUMNS),
+            select(*(items.c[name] for name in ITEM_COLUMNS)).where(
+                items.c.invoice_id.in_(moved)
+            ),
+        )
+    )
+    session.execute(delete(items).where(items.c.invoice_id.in_(moved)))
+    session.execute(delete(invoices).where(invoices.c.id.in_(moved)))
+    return moved
+
+
+def archive_invoices(
+    older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, records=None
+):
+    """Move paid and cancelled invoices older than ``older_than_days`` days.
+
+    Invoices are moved ``batch_size`` at a time, one transaction per batch,
+    so the write lock is never held for long. Returns the number moved.
+    """
+    records = default_cache if records is None else records
+    cutoff = date.today() - timedelta(days=older_than_days)
+    invoices = Invoice.__table__
+    items = InvoiceItem.__table__
+    # Keep the rows holding the highest IDs, so their IDs are never reused
+    newest_invoice = select(func.max(invoices.c.id)).scalar_subquery()
+    newest_item_owner = (
+        select(items.c.invoice_id)
+        .where(items.c.id == select(func.max(items.c.id)).scalar_subquery())
+        .scalar_subquery()
+    )
+    archivable = (
+        invoices.c.status.in_(ARCHIVE_STATUSES)
+        & (invoices.c.date < cutoff)
+        & (invoices.c.id < newest_invoice)
+        & (invoices.c.id != func.coalesce(newest_item_owner, 0))
+    )
+
+    total = 0
+    last_id = 0
+    session = Session()
+    try:
+        while True:
+            # Keyset scan by ID, so each batch resumes where the last stopped
+            invoice_ids = session.scalars(
+                select(invoices.c.id)
+                .where(invoices.c.id > last_id, archivable)
+                .order_by(invoices.c.id)
+                .limit(batch_size)
+            ).all()
+            if not invoice_ids:
+                break
+            moved = _move_batch(session, invoice_ids, archivable)
+            session.commit()
+            records.invalidate(*(("invoice", invoice_id) for invoice_id in moved))
+            total += len(moved)
+            last_id = invoice_ids[-1]
+    finally:
+        session.close()
+    if total:
+        logger.info(f"Archived {total} invoices dated before {cutoff}")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Archive old paid and cancelled invoices."
+    )
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    moved = archive_invoices(args.older_than_days, args.batch_size)
+    print(f"Archived {moved} invoices")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import argparse
+import sys
+
+from database import Session, Invoice, init_db
+from invoice_generator import InvoiceGenerator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render invoice PDFs in parallel.")
+    parser.add_argument(
+        "invoice_ids", nargs="*", type=int, help="Invoice IDs to render"
+    )
+    parser.add_argument("--all", action="store_true", help="Render every invoice")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument("--output-dir", default=None, help="Directory for the PDFs")
+    parser.add_argument(
+        "--combined", metavar="FILE", help="Write all invoices into one PDF at FILE"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    init_db()
+
+    invoice_ids = args.invoice_ids
+    if args.all:
+        session = Session()
+        try:
+            invoice_ids = [
+                row[0] for row in session.query(Invoice.id).order_by(Invoice.id)
+            ]
+        finally:
+            session.close()
+    if not invoice_ids:
+        print("No invoices to render.")
+        return 0
+
+    generator = InvoiceGenerator()
+    if args.combined:
+        try:
+            filename = generator.generate_combined_pdf(invoice_ids, args.combined)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Rendered {len(invoice_ids)} invoices into {filename}.")
+        return 0
+
+    total = len(invoice_ids)
+    failed = 0
+    for done, result in enumerate(
+        generator.iter_generate_pdfs(invoice_ids, args.workers, args.output_dir), 1
+    ):
+        if "error" in result:
+            failed += 1
+            print(f"[{done}/{total}] Invoice {result['invoice_id']}: {result['error']}")
+        else:
+            print(f"[{done}/{total}] {result['filename']}")
+
+    print(f"\nRendered {total - failed} of {total} PDFs ({failed} failed).")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
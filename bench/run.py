@@ -0,0 +1,221 @@
+"""Benchmark invoice creation, listing and PDF rendering.
+
+Run from the repository root::
+
+    python -m bench.run --customers 100 --invoices 1000 --items 5 \
+        --output results.json [--baseline previous.json]
+
+Each run uses a fresh SQLite database in a temporary directory unless
+``--database-url`` is given, and writes JSON results that can be passed back
+as ``--baseline`` to flag regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Invoice Generator benchmarks")
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--invoices", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=5, help="Items per invoice")
+    parser.add_argument("--pdfs", type=int, default=50, help="Invoices to render")
+    parser.add_argument("--list-rounds", type=int, default=5)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--output", default=None, help="Write JSON results here")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown against the baseline before failing (0.2 = 20%%)",
+    )
+    return parser.parse_args(argv)
+
+
+class Timer:
+    """Collect per-operation timings for one benchmark."""
+
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self._start)
+
+    def summary(self, count=None):
+        """Summarise the samples; ``count`` is the number of operations timed.
+
+        When one sample covers several operations (a bulk call), every figure
+        is reported per operation so the rows stay comparable.
+        """
+        total = sum(self.samples)
+        count = count or len(self.samples)
+        per_sample = count / len(self.samples)
+        ordered = [sample / per_sample for sample in sorted(self.samples)]
+        return {
+            "count": count,
+            "seconds": round(total, 6),
+            "ops_per_sec": round(count / total, 2) if total else None,
+            "mean_ms": round(total / count * 1000, 4) if count else None,
+            "p50_ms": round(statistics.median(ordered) * 1000, 4),
+            "p95_ms": (
+                round(ordered[int(len(ordered) * 0.95) - 1] * 1000, 4)
+                if len(ordered) >= 20
+                else round(ordered[-1] * 1000, 4)
+            ),
+        }
+
+
+def invoice_items(count):
+    return [
+        {"description": f"Item {n}", "quantity": n + 1, "unit_price": 9.99}
+        for n in range(count)
+    ]
+
+
+def run(args):
+    # Imported here so DATABASE_URL is set before the engine is created
+    from fastapi.testclient import TestClient
+
+    import api
+    from database import init_db
+    from invoice_generator import InvoiceGenerator
+    from pdf_cache import PDFCache
+    from pdf_generator import render_invoice_bytes
+
+    init_db()
+    cache_dir = tempfile.TemporaryDirectory()
+    generator = InvoiceGenerator(pdf_cache=PDFCache(cache_dir.name))
+    results = {}
+
+    timer = Timer()
+    customer_ids = []
+    for n in range(args.customers):
+        with timer:
+            customer_ids.append(
+                generator.create_customer(
+                    f"Customer {n}", f"customer{n}@example.com", "1 Bench St", "555"
+                )
+            )
+    results["create_customer"] = timer.summary()
+
+    items = invoice_items(args.items)
+    timer = Timer()
+    invoice_ids = []
+    for n in range(args.invoices):
+        with timer:
+            invoice_ids.append(
+                generator.create_invoice(customer_ids[n % len(customer_ids)], items)
+            )
+    results["create_invoice"] = timer.summary()
+
+    timer = Timer()
+    bulk = [
+        {"customer_id": customer_ids[n % len(customer_ids)], "items": items}
+        for n in range(args.invoices)
+    ]
+    with timer:
+        generator.create_invoices_bulk(bulk)
+    results["create_invoices_bulk"] = timer.summary(count=args.invoices)
+
+    client = TestClient(api.app)
+    timer = Timer()
+    for _ in range(args.list_rounds):
+        with timer:
+            client.get("/customers/").raise_for_status()
+    results["api_list_customers"] = timer.summary()
+
+    timer = Timer()
+    for _ in range(args.list_rounds):
+        after_id = None
+        while True:
+            params = {"limit": 100}
+            if after_id is not None:
+                params["after_id"] = after_id
+            with timer:
+                response = client.get("/invoices/", params=params)
+                response.raise_for_status()
+            page = response.json()
+            if len(page) < 100:
+                break
+            after_id = page[-1]["id"]
+    results["api_list_invoices_page"] = timer.summary()
+
+    timer = Timer()
+    for invoice_id in invoice_ids[: args.pdfs]:
+        _, _, _, snapshot = generator.prepare_pdf(invoice_id)
+        with timer:
+            render_invoice_bytes(*snapshot)
+    if timer.samples:
+        results["render_invoice_pdf"] = timer.summary()
+
+    cache_dir.cleanup()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput against a baseline and return the regressed benchmarks."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("ops_per_sec") or not result["ops_per_sec"]:
+            continue
+        ratio = result["ops_per_sec"] / previous["ops_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<26} {ratio:6.2f}x baseline{flag}", file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite:///{os.path.join(workdir.name, 'bench.db')}"
+    )
+
+    results = run(args)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "customers": args.customers,
+            "invoices": args.invoices,
+            "items": args.items,
+            "pdfs": args.pdfs,
+            "list_rounds": args.list_rounds,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
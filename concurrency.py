@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+import anyio
+import anyio.to_thread
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceOverloaded(Exception):
+    """Raised when more work is queued than the configured limit allows."""
+
+
+class RenderGate:
+    """Limit concurrent PDF renders and reject callers once the queue is full.
+
+    The semaphore is created on first use in the running event loop, and
+    again if the app is later served from another loop.
+    """
+
+    def __init__(self, concurrency, queue_limit):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.pending >= self.concurrency + self.queue_limit:
+            raise ServiceOverloaded("Too many PDF renders queued, retry later")
+        semaphore = self._get_semaphore()
+        self.pending += 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self.pending -= 1
+
+
+db_limiter = anyio.CapacityLimiter(config.API_DB_CONCURRENCY)
+render_gate = RenderGate(config.API_RENDER_WORKERS, config.API_RENDER_QUEUE_LIMIT)
+_render_pool = None
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database call on the bounded DB thread pool."""
+    return await anyio.to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=db_limiter
+    )
+
+
+async def run_render(func, *args):
+    """Run a CPU-bound render on the shared process pool."""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=config.API_RENDER_WORKERS)
+    loop = asyncio.get_running_loop()
+    result, observations = await loop.run_in_executor(
+        _render_pool, metrics.collect, func, *args
+    )
+    # Stage timings were recorded in the worker process; copy them here
+    metrics.replay(observations)
+    return result
+
+
+def shutdown():
+    """Stop the render process pool."""
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True)
+        _render_pool = None
+        logger.info("Render process pool shut down")
@@ -1,24 +1,96 @@
+import os
 from pathlib import Path
 
 # Base directory of the project
 BASE_DIR = Path(__file__).resolve().parent
 
 # Database
-DATABASE_URL = "sqlite:///invoice_system.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///invoice_system.db")
+
+# Applied to every new SQLite connection. WAL lets readers run alongside a
+# writer and busy_timeout makes writers wait instead of failing with
+# "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # milliseconds
+    "cache_size": -64000,  # negative values are KiB, so 64 MB
+    "mmap_size": 268435456,  # 256 MB
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+# Connection pool sizing for server databases such as PostgreSQL
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 30
 
 # PDF Configuration
 PDF_OUTPUT_DIR = BASE_DIR / "pdfs"
 if not PDF_OUTPUT_DIR.exists():
     PDF_OUTPUT_DIR.mkdir(parents=True)
 
+# Customer statements (many invoices in one PDF) are written here
+STATEMENT_OUTPUT_DIR = PDF_OUTPUT_DIR / "statements"
+
+# PDF rendering backend: "canvas" draws simple one-page invoices directly on a
+# canvas and falls back to "platypus" (flow layout) for anything longer
+PDF_RENDERER = "canvas"
+
+# Rendered PDFs are cached by a hash of their inputs and evicted by size/age
+PDF_CACHE_DIR = PDF_OUTPUT_DIR / "cache"
+PDF_CACHE_MAX_BYTES = 512 * 1024 * 1024
+PDF_CACHE_MAX_AGE_DAYS = 30
+
+# Customer and invoice lookups are cached in-process; entries are dropped on
+# writes through InvoiceGenerator and expire after RECORD_CACHE_TTL seconds
+RECORD_CACHE_MAX_ENTRIES = 10000
+RECORD_CACHE_TTL = 60
+
+# API concurrency: blocking DB calls run on a bounded thread pool and PDF
+# renders on a process pool; renders beyond the queue limit are rejected
+API_DB_CONCURRENCY = 20
+API_RENDER_WORKERS = os.cpu_count() or 1
+API_RENDER_QUEUE_LIMIT = 64
+
+# Background jobs are queued in the database and run by worker processes that
+# the API starts alongside itself (0 disables them; run `python jobs.py`
+# instead). A worker records a heartbeat on its running job every
+# JOB_HEARTBEAT_INTERVAL seconds; a running job whose heartbeat is older than
+# JOB_STALE_AFTER seconds, e.g. because its worker crashed, is queued again,
+# unless it has already been claimed JOB_MAX_ATTEMPTS times; then it fails.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = 1.0  # seconds between queue checks when idle
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_AFTER = 600
+JOB_MAX_ATTEMPTS = 3
+JOB_OUTPUT_DIR = BASE_DIR / "jobs"
+JOB_UPLOAD_DIR = JOB_OUTPUT_DIR / "uploads"  # files queued by POST /jobs/import
+
 # Application settings
 INVOICE_DUE_DAYS = 30
+
+# Invoice statuses, and which of them count as billed and as still owed
+INVOICE_STATUSES = ("draft", "sent", "paid", "cancelled")
+REVENUE_STATUSES = ("sent", "paid")
+OUTSTANDING_STATUSES = ("sent",)
+
+# Invoice numbers are sequential per prefix ({year} is the invoice year) and
+# each process reserves them from the database in blocks of this size
+INVOICE_NUMBER_PREFIX = "INV-{year}-"
+INVOICE_NUMBER_DIGITS = 6
+INVOICE_NUMBER_BLOCK_SIZE = 100
 COMPANY_NAME = "Your Company Name"
 COMPANY_ADDRESS = "Your Company Address"
 COMPANY_PHONE = "Your Company Phone"
 COMPANY_EMAIL = "your@email.com"
 COMPANY_WEBSITE = "www.yourcompany.com"
 
+# Rejected records from API imports are written here
+IMPORT_REJECTS_DIR = BASE_DIR / "imports"
+if not IMPORT_REJECTS_DIR.exists():
+    IMPORT_REJECTS_DIR.mkdir(parents=True)
+
 # Logging Configuration
 LOG_DIR = BASE_DIR / "logs"
 if not LOG_DIR.exists():
@@ -47,9 +119,43 @@ LOGGING_CONFIG = {
     },
 }
 
+# Paid and cancelled invoices dated more than ARCHIVE_AFTER_DAYS ago can be
+# moved to the archive tables by archive.py, ARCHIVE_BATCH_SIZE per transaction
+ARCHIVE_STATUSES = ("paid", "cancelled")
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+
+# Recurring invoices: idle job workers bill due templates every
+# RECURRING_INTERVAL seconds, RECURRING_BATCH_SIZE templates per transaction.
+# After downtime each template catches up at most RECURRING_MAX_CATCH_UP
+# missed periods per batch; RECURRING_QUEUE_PDFS also queues their PDFs.
+RECURRING_INTERVAL = 5 * 60
+RECURRING_BATCH_SIZE = 500
+RECURRING_MAX_CATCH_UP = 24
+RECURRING_QUEUE_PDFS = False
+
+# Idempotency-Key headers on POST /invoices/ are remembered for at least
+# IDEMPOTENCY_KEY_TTL seconds; job workers purge older keys every
+# IDEMPOTENCY_PURGE_INTERVAL seconds, IDEMPOTENCY_PURGE_BATCH_SIZE at a time
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_PURGE_INTERVAL = 60 * 60
+IDEMPOTENCY_PURGE_BATCH_SIZE = 10000
+
 # Email Configuration (if needed)
 EMAIL_HOST = "smtp.yourserver.com"
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = "your@email.com"
 EMAIL_HOST_PASSWORD = "your-password"
+EMAIL_FROM = COMPANY_EMAIL
+EMAIL_TIMEOUT = 30  # seconds
+
+# Invoice delivery: each worker keeps one SMTP connection open, sends are
+# limited to EMAIL_RATE_LIMIT messages per second across all workers, and
+# failed sends are retried with exponential backoff (EMAIL_RETRY_BACKOFF,
+# doubled per attempt). Delivered invoices are marked sent in batches.
+EMAIL_WORKERS = 4
+EMAIL_RATE_LIMIT = 10.0
+EMAIL_MAX_RETRIES = 3
+EMAIL_RETRY_BACKOFF = 1.0
+EMAIL_STATUS_BATCH_SIZE = 100
@@ -0,0 +1,189 @@
+"""Incremental maintenance of the customer_summary table.
+
+Every ORM flush that adds, removes or changes an Invoice applies the
+difference to the affected customers' rows in the same transaction, and
+bulk code paths that bypass the ORM call :func:`apply_deltas` themselves.
+:func:`rebuild` recomputes the whole table from the live and archived
+invoices; archive.py moves invoices without touching their customers' rows.
+"""
+
+import logging
+from collections import defaultdict
+
+from sqlalchemy import case, delete, func, insert, inspect, select, update
+
+from archive import all_invoices
+from config import OUTSTANDING_STATUSES, REVENUE_STATUSES
+from database import Session, Customer, CustomerSummary, Invoice
+from money import from_cents, to_cents
+
+logger = logging.getLogger(__name__)
+
+
+def invoice_contribution(status, total_amount):
+    """Return ``(billed_cents, outstanding_cents)`` an invoice adds to its customer."""
+    cents = to_cents(total_amount or 0)
+    return (
+        cents if status in REVENUE_STATUSES else 0,
+        cents if status in OUTSTANDING_STATUSES else 0,
+    )
+
+
+class SummaryDeltas:
+    """Accumulate per-customer changes to apply in one statement."""
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, customer_id, status, total_amount, sign=1):
+        if customer_id is None:
+            return
+        billed, outstanding = invoice_contribution(status, total_amount)
+        delta = self._deltas[customer_id]
+        delta[0] += sign
+        delta[1] += sign * billed
+        delta[2] += sign * outstanding
+
+    def discard(self, customer_id):
+        self._deltas.pop(customer_id, None)
+
+    def rows(self):
+        return [
+            {
+                "customer_id": customer_id,
+                "invoice_count": count,
+                "total_billed": billed,
+                "outstanding": outstanding,
+            }
+            for customer_id, (count, billed, outstanding) in self._deltas.items()
+            if count or billed or outstanding
+        ]
+
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` (a SummaryDeltas) to customer_summary, creating rows as needed.
+
+    Amounts in the rows are integer cents and are written to the underlying
+    integer columns directly.
+    """
+    rows = deltas.rows()
+    if not rows:
+        return
+    table = CustomerSummary.__table__
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.customer_id],
+            set_={
+                name: table.c[name] + stmt.excluded[name]
+                for name in ("invoice_count", "total_billed", "outstanding")
+            },
+        )
+        connection.execute(stmt, _as_money(rows))
+        return
+
+    for row in _as_money(rows):
+        result = connection.execute(
+            update(table)
+            .where(table.c.customer_id == row["customer_id"])
+            .values(
+                invoice_count=table.c.invoice_count + row["invoice_count"],
+                total_billed=table.c.total_billed + row["total_billed"],
+                outstanding=table.c.outstanding + row["outstanding"],
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table), row)
+
+
+def _as_money(rows):
+    # Bound through the Money type, so convert cents back to currency units
+    return [
+        dict(
+            row,
+            total_billed=from_cents(row["total_billed"]),
+            outstanding=from_cents(row["outstanding"]),
+        )
+        for row in rows
+    ]
+
+
+def _previous(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+def track_invoice_changes(session, flush_context):
+    """after_flush hook applying invoice inserts, updates and deletes."""
+    deltas = SummaryDeltas()
+    for obj in session.new:
+        if isinstance(obj, Invoice):
+            deltas.add(obj.customer_id, obj.status, obj.total_amount)
+    for obj in session.deleted:
+        if isinstance(obj, Invoice):
+            state = inspect(obj)
+            deltas.add(
+                _previous(state, "customer_id"),
+                _previous(state, "status"),
+                _previous(state, "total_amount"),
+                sign=-1,
+            )
+    for obj in session.dirty:
+        if not isinstance(obj, Invoice):
+            continue
+        state = inspect(obj)
+        names = ("customer_id", "status", "total_amount")
+        if not any(state.attrs[name].history.has_changes() for name in names):
+            continue
+        deltas.add(*(_previous(state, name) for name in names), sign=-1)
+        deltas.add(obj.customer_id, obj.status, obj.total_amount)
+    for obj in session.deleted:
+        # A deleted customer's summary row goes with it
+        if isinstance(obj, Customer):
+            deltas.discard(obj.id)
+    apply_deltas(session.connection(), deltas)
+
+
+def rebuild(session=None):
+    """Recompute customer_summary from all invoices in one transaction.
+
+    Archived invoices count too, as they did before they were archived. With
+    a ``session``, the rebuild joins its transaction and the caller commits.
+    """
+    own_session = session is None
+    session = session or Session()
+    try:
+        table = CustomerSummary.__table__
+        invoices = all_invoices().c
+        amount = invoices.total_amount
+        status = invoices.status
+        totals = select(
+            invoices.customer_id,
+            func.count(),
+            func.sum(case((status.in_(REVENUE_STATUSES), amount), else_=0)),
+            func.sum(case((status.in_(OUTSTANDING_STATUSES), amount), else_=0)),
+        ).group_by(invoices.customer_id)
+        session.execute(delete(table))
+        result = session.execute(
+            insert(table).from_select(
+                ["customer_id", "invoice_count", "total_billed", "outstanding"],
+                totals,
+            )
+        )
+        if own_session:
+            session.commit()
+        logger.info(f"Rebuilt customer summaries for {result.rowcount} customers")
+        return result.rowcount
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if own_session:
+            session.close()
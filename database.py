@@ -1,110 +1,529 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, event
+from sqlalchemy import (
+    create_engine,
+    Boolean,
+    Column,
+    Integer,
+    String,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    JSON,
+    event,
+    inspect,
+    text,
+)
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, scoped_session, sessionmaker
+from sqlalchemy.orm import column_property, relationship, scoped_session, sessionmaker
 from datetime import datetime
 import logging
+import time
+
+from config import (
+    DATABASE_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    SQLITE_PRAGMAS,
+)
+from money import Money, to_decimal
+import metrics
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
 # Create the declarative base
 Base = declarative_base()
 
-# Configure the database engine with better connection handling
-engine = create_engine(
-    'sqlite:///invoice_system.db',
-    echo=False,  # Set to True for debugging SQL output
-    pool_pre_ping=True,  # Enable automatic reconnection
-    pool_recycle=3600,  # Recycle connections after 1 hour
-    connect_args={'check_same_thread': False}  # Required for SQLite
-)
 
-# Create thread-safe session factory
-Session = scoped_session(sessionmaker(
-    bind=engine,
-    autocommit=False,
-    autoflush=False
-))
-
-# SQLite Foreign Key Support
-@event.listens_for(engine, 'connect')
+def create_db_engine(url=DATABASE_URL):
+    """Create an engine tuned for the database behind ``url``.
+
+    SQLite connections get the pragmas from ``config.SQLITE_PRAGMAS``; other
+    databases get a sized connection pool.
+    """
+    url = make_url(url)
+    options = {
+        "echo": False,  # Set to True for debugging SQL output
+        "pool_pre_ping": True,  # Enable automatic reconnection
+        "pool_recycle": 3600,  # Recycle connections after 1 hour
+    }
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}  # Required for SQLite
+    else:
+        options["pool_size"] = DB_POOL_SIZE
+        options["max_overflow"] = DB_MAX_OVERFLOW
+        options["pool_timeout"] = DB_POOL_TIMEOUT
+
+    db_engine = create_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(db_engine, "connect", set_sqlite_pragma)
+    event.listen(db_engine, "before_cursor_execute", start_query_timer)
+    event.listen(db_engine, "after_cursor_execute", record_query_time)
+    event.listen(db_engine, "handle_error", record_query_error)
+    return db_engine
+
+
+# Query metrics: statement count and duration by type (SELECT, INSERT, ...)
+def _operation(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement else ""
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    metrics.db_query_duration.observe(elapsed, operation=_operation(statement))
+
+
+def record_query_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+    metrics.db_query_errors.inc(operation=_operation(exception_context.statement))
+
+
+# SQLite performance and foreign key settings
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
     cursor.close()
 
+
+def engine_settings(db_engine=None):
+    """Return the effective engine settings, read back from the database."""
+    db_engine = db_engine or engine
+    settings = {"url": db_engine.url.render_as_string(hide_password=True)}
+    if db_engine.dialect.name == "sqlite":
+        with db_engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                settings[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    else:
+        settings["pool_size"] = db_engine.pool.size()
+        settings["max_overflow"] = DB_MAX_OVERFLOW
+    return settings
+
+
+engine = create_db_engine()
+
+# Create thread-safe session factory
+Session = scoped_session(sessionmaker(bind=engine, autocommit=False, autoflush=False))
+
+
 class Customer(Base):
-    __tablename__ = 'customers'
-    
+    __tablename__ = "customers"
+
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False, index=True)
     email = Column(String(255), unique=True)
     address = Column(String(255))
     phone = Column(String(20))
     created_at = Column(Date, default=datetime.now().date(), nullable=False)
-    invoices = relationship("Invoice", back_populates="customer", cascade="all, delete-orphan")
+    invoices = relationship(
+        "Invoice", back_populates="customer", cascade="all, delete-orphan"
+    )
 
     def __repr__(self):
         return f"<Customer(id={self.id}, name='{self.name}', email='{self.email}')>"
 
+
 class Invoice(Base):
-    __tablename__ = 'invoices'
-    
+    __tablename__ = "invoices"
+
     id = Column(Integer, primary_key=True)
     invoice_number = Column(String(50), unique=True, nullable=False, index=True)
     date = Column(Date, default=datetime.now().date(), nullable=False)
     due_date = Column(Date)
-    customer_id = Column(Integer, ForeignKey('customers.id', ondelete='CASCADE'), nullable=False)
-    total_amount = Column(Float, default=0.0, nullable=False)
-    status = Column(String(20), default='draft', nullable=False)  # draft, sent, paid, cancelled
+    # active_history keeps the previous values of these columns available to
+    # the flush hook that maintains customer_summary
+    customer_id = column_property(
+        Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False),
+        active_history=True,
+    )
+    total_amount = column_property(
+        Column(Money, default=0, nullable=False),  # stored in cents
+        active_history=True,
+    )
+    status = column_property(
+        Column(
+            String(20), default="draft", nullable=False
+        ),  # draft, sent, paid, cancelled
+        active_history=True,
+    )
     notes = Column(String(500))
-    
+
     customer = relationship("Customer", back_populates="invoices")
-    items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
+    items = relationship(
+        "InvoiceItem", back_populates="invoice", cascade="all, delete-orphan"
+    )
+
+    # Covering indexes for the reports: per-customer revenue over a date range,
+    # and outstanding/aging figures by status and due date. AUTOINCREMENT
+    # keeps SQLite from reusing the ID of an invoice moved to the archive.
+    __table_args__ = (
+        Index("ix_invoices_customer_id_date", "customer_id", "date", "total_amount"),
+        Index("ix_invoices_status_due_date", "status", "due_date", "total_amount"),
+        {"sqlite_autoincrement": True},
+    )
 
     def __repr__(self):
         return f"<Invoice(id={self.id}, number='{self.invoice_number}', total={self.total_amount})>"
 
     def calculate_total(self):
         """Calculate total amount from items."""
-        self.total_amount = sum(item.total for item in self.items)
+        self.total_amount = sum(
+            (to_decimal(item.total) for item in self.items), to_decimal(0)
+        )
+
 
 class InvoiceItem(Base):
-    __tablename__ = 'invoice_items'
-    
+    __tablename__ = "invoice_items"
+
     id = Column(Integer, primary_key=True)
-    invoice_id = Column(Integer, ForeignKey('invoices.id', ondelete='CASCADE'), nullable=False)
+    invoice_id = Column(
+        Integer,
+        ForeignKey("invoices.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
     description = Column(String(255), nullable=False)
     quantity = Column(Integer, nullable=False)
-    unit_price = Column(Float, nullable=False)
-    total = Column(Float, nullable=False)
-    
+    unit_price = Column(Money, nullable=False)  # stored in cents
+    total = Column(Money, nullable=False)  # stored in cents
+
     invoice = relationship("Invoice", back_populates="items")
 
+    # Item IDs are kept in the archive too, so they must not be reused either
+    __table_args__ = {"sqlite_autoincrement": True}
+
     def __repr__(self):
         return f"<InvoiceItem(id={self.id}, description='{self.description}', total={self.total})>"
 
     def calculate_total(self):
         """Calculate total from quantity and unit price."""
-        self.total = self.quantity * self.unit_price
+        self.total = to_decimal(self.unit_price) * self.quantity
+
+
+class ArchivedInvoice(Base):
+    """A paid or cancelled invoice moved out of invoices by archive.py.
+
+    IDs and numbers are kept, so the invoice can still be found by either.
+    """
+
+    __tablename__ = "invoices_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    invoice_number = Column(String(50), unique=True, nullable=False)
+    date = Column(Date, nullable=False)
+    due_date = Column(Date)
+    customer_id = Column(
+        Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+    )
+    total_amount = Column(Money, nullable=False)  # stored in cents
+    status = Column(String(20), nullable=False)  # paid, cancelled
+    notes = Column(String(500))
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    customer = relationship("Customer", viewonly=True)
+    items = relationship(
+        "ArchivedInvoiceItem",
+        cascade="all, delete-orphan",
+        order_by="ArchivedInvoiceItem.id",
+    )
+
+    # Same covering index as invoices, for the revenue reports
+    __table_args__ = (
+        Index(
+            "ix_invoices_archive_customer_id_date",
+            "customer_id",
+            "date",
+            "total_amount",
+        ),
+    )
+
+    def __repr__(self):
+        return f"<ArchivedInvoice(id={self.id}, number='{self.invoice_number}', total={self.total_amount})>"
+
+
+class ArchivedInvoiceItem(Base):
+    __tablename__ = "invoice_items_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    invoice_id = Column(
+        Integer,
+        ForeignKey("invoices_archive.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    description = Column(String(255), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Money, nullable=False)  # stored in cents
+    total = Column(Money, nullable=False)  # stored in cents
+
+    def __repr__(self):
+        return f"<ArchivedInvoiceItem(id={self.id}, description='{self.description}', total={self.total})>"
+
+
+class CustomerSummary(Base):
+    """Per-customer invoice figures, kept up to date by customer_summary.py."""
+
+    __tablename__ = "customer_summary"
+
+    customer_id = Column(
+        Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True
+    )
+    invoice_count = Column(Integer, default=0, nullable=False)
+    total_billed = Column(Money, default=0, nullable=False)  # stored in cents
+    outstanding = Column(Money, default=0, nullable=False)  # stored in cents
+
+    def __repr__(self):
+        return (
+            f"<CustomerSummary(customer_id={self.customer_id}, "
+            f"invoice_count={self.invoice_count}, outstanding={self.outstanding})>"
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def update_customer_summaries(session, flush_context):
+    """Apply flushed invoice changes to customer_summary in the same transaction."""
+    # Imported here because customer_summary imports these models
+    from customer_summary import track_invoice_changes
+
+    track_invoice_changes(session, flush_context)
+
+
+class InvoiceNumberSequence(Base):
+    __tablename__ = "invoice_number_sequences"
+
+    prefix = Column(String(50), primary_key=True)
+    next_value = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<InvoiceNumberSequence(prefix='{self.prefix}', next_value={self.next_value})>"
+
+
+class Job(Base):
+    """A unit of background work, queued and run by jobs.py."""
+
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(
+        String(20), nullable=False
+    )  # pdf, pdfs, statement, email, export, import, recurring, archive
+    params = Column(JSON, nullable=False)
+    status = Column(
+        String(20), default="queued", nullable=False
+    )  # queued, running, done, failed
+    result = Column(JSON)
+    error = Column(String(500))
+    attempts = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)  # last sign of life from the running worker
+    finished_at = Column(DateTime)
+
+    # Workers claim the oldest queued job
+    __table_args__ = (Index("ix_jobs_status_id", "status", "id"),)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind='{self.kind}', status='{self.status}')>"
+
+
+class RecurringInvoice(Base):
+    """An invoice billed to a customer every period, by recurring.py."""
+
+    __tablename__ = "recurring_invoices"
+
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(
+        Integer,
+        ForeignKey("customers.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    items = Column(
+        JSON, nullable=False
+    )  # [{description, quantity, unit_price}], prices as strings
+    cadence = Column(String(20), nullable=False)  # weekly, monthly, quarterly, yearly
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date)
+    # Periods are counted from start_date, so monthly runs on the 31st fall
+    # on each month's last day instead of drifting
+    periods_billed = Column(Integer, default=0, nullable=False)
+    next_run = Column(Date, nullable=False)
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    # The scheduler selects active templates due on or before today
+    __table_args__ = (
+        Index("ix_recurring_invoices_active_next_run", "active", "next_run"),
+    )
+
+    def __repr__(self):
+        return (
+            f"<RecurringInvoice(id={self.id}, customer_id={self.customer_id}, "
+            f"cadence='{self.cadence}', next_run={self.next_run})>"
+        )
+
+
+class IdempotencyKey(Base):
+    """The invoice created by a request sent with an Idempotency-Key header."""
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body
+    # Not a foreign key: the key must keep answering retries even if the
+    # invoice is later moved or deleted
+    invoice_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key='{self.key}', invoice_id={self.invoice_id})>"
+
+
+# Full-text search (SQLite only): FTS5 tables over customers, invoice numbers
+# and item descriptions. Triggers on the source tables only record changed
+# row IDs in search_pending, because writing to FTS5 from a trigger flushes
+# its buffer on every row and made bulk inserts several times slower.
+# sync_search_index() then re-indexes the pending rows with set-based
+# statements; search.py calls it before each query.
+SEARCH_COLUMNS = {
+    "customers_fts": ("customers", ("name", "email", "address")),
+    "invoices_fts": ("invoices", ("invoice_number",)),
+    "invoice_items_fts": ("invoice_items", ("description", "invoice_id")),
+}
+SEARCH_UNINDEXED = {"invoice_id"}
+
+
+def _search_ddl(name, source, columns):
+    definitions = ", ".join(
+        f"{c} UNINDEXED" if c in SEARCH_UNINDEXED else c for c in columns
+    )
+    pending = (
+        f"INSERT OR IGNORE INTO search_pending (tbl, row_id) "
+        f"VALUES ('{name}', {{row}}.id);"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({definitions}, prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {source} "
+        f"BEGIN {pending.format(row='new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {', '.join(columns)} "
+        f"ON {source} BEGIN {pending.format(row='new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {source} "
+        f"BEGIN {pending.format(row='old')} END",
+    ]
+
+
+def create_search_index(target, connection, **kw):
+    """Create the FTS5 tables and triggers, indexing existing rows in new tables."""
+    if connection.dialect.name != "sqlite":
+        return
+    existing = {
+        row[0]
+        for row in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS search_pending ("
+        "tbl VARCHAR(30) NOT NULL, row_id INTEGER NOT NULL, "
+        "PRIMARY KEY (tbl, row_id)) WITHOUT ROWID"
+    )
+    for name, (source, columns) in SEARCH_COLUMNS.items():
+        for statement in _search_ddl(name, source, columns):
+            connection.exec_driver_sql(statement)
+        if name not in existing:
+            connection.exec_driver_sql(
+                f"INSERT INTO {name} (rowid, {', '.join(columns)}) "
+                f"SELECT id, {', '.join(columns)} FROM {source}"
+            )
+
+
+def sync_search_index(connection, batch_size=None):
+    """Re-index rows changed since the last sync. Returns the number of rows.
+
+    With ``batch_size`` at most that many rows per table are indexed, so
+    callers can commit in between and not hold the write lock for long.
+    Nothing is written (and no lock taken) when nothing changed.
+    """
+    if connection.dialect.name != "sqlite":
+        return 0
+    if (
+        connection.exec_driver_sql("SELECT 1 FROM search_pending LIMIT 1").first()
+        is None
+    ):
+        return 0
+    limit = f" ORDER BY row_id LIMIT {int(batch_size)}" if batch_size else ""
+    synced = 0
+    for name, (source, columns) in SEARCH_COLUMNS.items():
+        pending = f"SELECT row_id FROM search_pending WHERE tbl = '{name}'{limit}"
+        connection.exec_driver_sql(f"DELETE FROM {name} WHERE rowid IN ({pending})")
+        connection.exec_driver_sql(
+            f"INSERT INTO {name} (rowid, {', '.join(columns)}) "
+            f"SELECT id, {', '.join(columns)} FROM {source} WHERE id IN ({pending})"
+        )
+        synced += connection.exec_driver_sql(
+            f"DELETE FROM search_pending WHERE tbl = '{name}' AND row_id IN ({pending})"
+        ).rowcount
+    return synced
+
+
+def drop_search_index(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    for name in SEARCH_COLUMNS:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+    connection.exec_driver_sql("DROP TABLE IF EXISTS search_pending")
+
+
+event.listen(Base.metadata, "after_create", create_search_index)
+event.listen(Base.metadata, "before_drop", drop_search_index)
+
 
 def get_session():
     """Get a new session."""
     return Session()
 
+
 def init_db():
     """Initialize the database by creating all tables."""
     try:
         Base.metadata.create_all(engine)
+        # create_all skips existing tables, so add nullable columns and
+        # indexes introduced since
+        with engine.begin() as conn:
+            inspector = inspect(conn)
+            for table in Base.metadata.sorted_tables:
+                existing = {
+                    column["name"] for column in inspector.get_columns(table.name)
+                }
+                for column in table.columns:
+                    if column.name not in existing and column.nullable:
+                        column_type = column.type.compile(engine.dialect)
+                        conn.execute(
+                            text(
+                                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                            )
+                        )
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
         logger.info("Database initialized successfully")
+        logger.info(f"Database settings: {engine_settings()}")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
         raise
 
+
 def clear_database():
     """Clear all data from the database."""
     try:
@@ -115,6 +534,7 @@ def clear_database():
         logger.error(f"Error clearing database: {str(e)}")
         raise
 
+
 def cleanup_db():
     """Clean up database resources."""
     try:
@@ -125,5 +545,6 @@ def cleanup_db():
         logger.error(f"Error cleaning up database resources: {str(e)}")
         raise
 
-if __name__ == '__main__':
+
+if __name__ == "__main__":
     init_db()
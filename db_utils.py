@@ -1,35 +1,37 @@
-from database import Session, Customer, Invoice  # Remove unused InvoiceItem
+from database import Session, Customer
+from invoice_generator import InvoiceGenerator
 from sqlalchemy import text
 
+
 def print_table_contents():
     session = Session()
     try:
         # Print Customers
         print("\n=== Customers ===")
-        customers = session.query(Customer).all()
+        customers = session.query(Customer.id, Customer.name, Customer.email).yield_per(
+            1000
+        )
         for customer in customers:
             print(f"ID: {customer.id}, Name: {customer.name}, Email: {customer.email}")
+    finally:
+        session.close()
 
-        # Print Invoices
-        print("\n=== Invoices ===")
-        invoices = session.query(Invoice).all()
-        for invoice in invoices:
+    # Print Invoices, a page at a time with their items fetched per page
+    print("\n=== Invoices ===")
+    for invoice in InvoiceGenerator().iter_invoices(page_size=1000, include_items=True):
+        print(
+            f"ID: {invoice['id']}, Number: {invoice['invoice_number']}, "
+            f"Customer: {invoice['customer_name']}, Total: ${invoice['total_amount']:.2f}"
+        )
+
+        # Print Invoice Items
+        print("  Items:")
+        for item in invoice["items"]:
             print(
-                f"ID: {invoice.id}, Number: {invoice.invoice_number}, "
-                f"Customer: {invoice.customer.name}, Total: ${invoice.total_amount:.2f}"
+                f"    - {item['quantity']}x {item['description']} "
+                f"@ ${item['unit_price']:.2f} = ${item['total']:.2f}"
             )
 
-            # Print Invoice Items
-            print("  Items:")
-            for item in invoice.items:
-                print(
-                    f"    - {item.quantity}x {item.description} "
-                    f"@ ${item.unit_price:.2f} = ${item.total:.2f}"
-                )
-
-    finally:
-        session.close()
-
 
 def run_custom_query(query):
     session = Session()
@@ -0,0 +1,296 @@
+"""Email delivery of invoice PDFs.
+
+:class:`InvoiceMailer` renders each invoice (through the PDF cache) while a
+pool of workers sends the previous ones, each worker over its own SMTP
+connection that stays open between messages. Only drafts are sent. Sends
+are rate limited across the workers, transient failures are retried with
+exponential backoff, and delivered invoices are marked ``sent`` in batches.
+"""
+
+import asyncio
+import logging
+import smtplib
+import ssl
+import time
+from email.message import EmailMessage
+from email.utils import make_msgid
+
+import config
+import metrics
+from database import Session, ArchivedInvoice, Customer, Invoice
+from invoice_generator import InvoiceGenerator
+
+logger = logging.getLogger(__name__)
+
+# Invoices in other statuses were already sent, paid or cancelled
+DELIVERABLE_STATUSES = ("draft",)
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` acquisitions per second on average.
+
+    A rate of zero or less disables the limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SMTPConnection:
+    """An SMTP connection opened on first use and reused for later messages.
+
+    Arguments default to the ``EMAIL_*`` settings in config.py; pass an
+    empty ``username`` to skip authentication.
+    """
+
+    def __init__(
+        self,
+        host=None,
+        port=None,
+        use_tls=None,
+        username=None,
+        password=None,
+        timeout=None,
+    ):
+        self.host = config.EMAIL_HOST if host is None else host
+        self.port = config.EMAIL_PORT if port is None else port
+        self.use_tls = config.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.username = config.EMAIL_HOST_USER if username is None else username
+        self.password = config.EMAIL_HOST_PASSWORD if password is None else password
+        self.timeout = config.EMAIL_TIMEOUT if timeout is None else timeout
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+
+    def send(self, message):
+        if self._smtp is None:
+            self._connect()
+        try:
+            self._smtp.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed an idle connection; reconnect once
+            self.close()
+            self._connect()
+            self._smtp.send_message(message)
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+def is_permanent(error):
+    """Return whether retrying a send that raised ``error`` cannot succeed."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class InvoiceMailer:
+    """Send invoice PDFs to their customers."""
+
+    def __init__(
+        self,
+        generator=None,
+        connection_factory=SMTPConnection,
+        workers=None,
+        rate_limit=None,
+        max_retries=None,
+        retry_backoff=None,
+        batch_size=None,
+    ):
+        self.generator = generator or InvoiceGenerator()
+        self.connection_factory = connection_factory
+        self.workers = max(config.EMAIL_WORKERS if workers is None else workers, 1)
+        self.rate_limit = config.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+        self.max_retries = (
+            config.EMAIL_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.retry_backoff = (
+            config.EMAIL_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        )
+        self.batch_size = max(
+            config.EMAIL_STATUS_BATCH_SIZE if batch_size is None else batch_size, 1
+        )
+
+    async def deliver(self, invoice_ids):
+        """Email each draft invoice to its customer.
+
+        Returns one result per invoice, in order: ``{"id", "email"}`` for a
+        delivered invoice, ``{"id", "skipped"}`` for one that is not a draft
+        or ``{"id", "error"}``. Delivered invoices are marked ``sent``.
+
+        Invoices are marked ``batch_size`` at a time, so if the process dies
+        mid-run up to one batch of delivered invoices is still ``draft`` and
+        would be emailed again by a rerun; the email job is therefore never
+        requeued automatically (see jobs.NO_RETRY_KINDS).
+        """
+        recipients = await asyncio.to_thread(_load_recipients, invoice_ids)
+        results = {}
+        deliverable = []
+        for invoice_id in invoice_ids:
+            if invoice_id in results:
+                continue
+            recipient = recipients.get(invoice_id)
+            if recipient is None:
+                results[invoice_id] = {"id": invoice_id, "error": "Invoice not found"}
+            elif recipient[2] not in DELIVERABLE_STATUSES:
+                results[invoice_id] = {
+                    "id": invoice_id,
+                    "skipped": f"Invoice is already {recipient[2]}",
+                }
+            elif not recipient[1]:
+                results[invoice_id] = {
+                    "id": invoice_id,
+                    "error": "Customer has no email address",
+                }
+            else:
+                results[invoice_id] = None
+                deliverable.append(invoice_id)
+
+        limiter = RateLimiter(self.rate_limit)
+        # Bounded so rendering stays only a little ahead of sending
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        delivered = []
+
+        async def produce():
+            for invoice_id in deliverable:
+                try:
+                    invoice_number, email, _ = recipients[invoice_id]
+                    message = await asyncio.to_thread(
+                        self.build_message, invoice_id, invoice_number, email
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Error preparing email for invoice {invoice_id}: {str(e)}"
+                    )
+                    results[invoice_id] = {"id": invoice_id, "error": str(e)}
+                    continue
+                await queue.put((invoice_id, message))
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        async def work():
+            connection = self.connection_factory()
+            try:
+                while (item := await queue.get()) is not None:
+                    invoice_id, message = item
+                    error = await self._send(connection, limiter, message)
+                    if error is not None:
+                        results[invoice_id] = {"id": invoice_id, "error": error}
+                        continue
+                    results[invoice_id] = {"id": invoice_id, "email": message["To"]}
+                    delivered.append(invoice_id)
+                    if len(delivered) >= self.batch_size:
+                        batch = delivered[:]
+                        del delivered[:]
+                        await asyncio.to_thread(
+                            self.generator.mark_invoices_sent, batch
+                        )
+            finally:
+                await asyncio.to_thread(connection.close)
+
+        try:
+            await asyncio.gather(produce(), *(work() for _ in range(self.workers)))
+        finally:
+            # Record what was delivered even if the run was interrupted
+            if delivered:
+                await asyncio.to_thread(self.generator.mark_invoices_sent, delivered)
+        return [results[invoice_id] for invoice_id in invoice_ids]
+
+    def build_message(self, invoice_id, invoice_number, email):
+        filename, data = self.generator.generate_pdf_bytes(invoice_id)
+        message = EmailMessage()
+        message["From"] = config.EMAIL_FROM
+        message["To"] = email
+        message["Subject"] = f"Invoice {invoice_number} from {config.COMPANY_NAME}"
+        message["Message-ID"] = make_msgid()
+        message.set_content(
+            f"Please find attached invoice {invoice_number}.\n\n{config.COMPANY_NAME}\n"
+        )
+        message.add_attachment(
+            data, maintype="application", subtype="pdf", filename=filename
+        )
+        return message
+
+    async def _send(self, connection, limiter, message):
+        """Send ``message``, retrying transient failures; return an error or None."""
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            try:
+                with metrics.timed("email_send"):
+                    await asyncio.to_thread(connection.send, message)
+                metrics.email_deliveries.inc(result="sent")
+                return None
+            except (smtplib.SMTPException, OSError) as e:
+                if is_permanent(e) or attempt >= self.max_retries:
+                    metrics.email_deliveries.inc(result="failed")
+                    logger.error(f"Error emailing {message['To']}: {str(e)}")
+                    return str(e)
+                metrics.email_deliveries.inc(result="retried")
+                # The connection may be unusable after an error; start afresh
+                await asyncio.to_thread(connection.close)
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
+                attempt += 1
+
+
+def _load_recipients(invoice_ids):
+    """Return ``{invoice_id: (invoice_number, email, status)}`` for existing
+    invoices, live or archived."""
+    session = Session()
+    try:
+        recipients = {}
+        # Archived invoices are never drafts; they are found to be skipped
+        for model in (ArchivedInvoice, Invoice):
+            rows = (
+                session.query(
+                    model.id, model.invoice_number, Customer.email, model.status
+                )
+                .join(Customer, Customer.id == model.customer_id)
+                .filter(model.id.in_(set(invoice_ids)))
+            )
+            recipients.update(
+                (row.id, (row.invoice_number, row.email, row.status)) for row in rows
+            )
+        return recipients
+    finally:
+        session.close()
+
+
+def deliver_invoices(invoice_ids, **kwargs):
+    """Email invoices from synchronous code; see :meth:`InvoiceMailer.deliver`."""
+    return asyncio.run(InvoiceMailer(**kwargs).deliver(invoice_ids))
@@ -0,0 +1,132 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import groupby
+
+from sqlalchemy import select
+
+from database import Session, Customer, Invoice, InvoiceItem, init_db
+
+# Rows fetched per round trip and rows written per yielded chunk
+EXPORT_BATCH_SIZE = 1000
+
+INVOICE_COLUMNS = [
+    "invoice_id",
+    "invoice_number",
+    "customer_id",
+    "customer_name",
+    "date",
+    "due_date",
+    "status",
+    "total_amount",
+]
+ITEM_COLUMNS = ["item_id", "description", "quantity", "unit_price", "total"]
+CSV_COLUMNS = INVOICE_COLUMNS + ITEM_COLUMNS
+
+
+def iter_rows(after_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield one flat dict per invoice item, ordered by invoice and item ID.
+
+    Results are streamed from a server-side cursor in batches of
+    ``batch_size``, so memory use does not grow with the table. Invoices
+    without items yield one row with empty item fields. Pass the last fully
+    exported ``invoice_id`` as ``after_id`` to resume.
+    """
+    query = (
+        select(
+            Invoice.id.label("invoice_id"),
+            Invoice.invoice_number,
+            Invoice.customer_id,
+            Customer.name.label("customer_name"),
+            Invoice.date,
+            Invoice.due_date,
+            Invoice.status,
+            Invoice.total_amount,
+            InvoiceItem.id.label("item_id"),
+            InvoiceItem.description,
+            InvoiceItem.quantity,
+            InvoiceItem.unit_price,
+            InvoiceItem.total,
+        )
+        .join(Customer, Invoice.customer_id == Customer.id)
+        .outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+        .order_by(Invoice.id, InvoiceItem.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    if after_id is not None:
+        query = query.where(Invoice.id > after_id)
+
+    session = Session()
+    try:
+        for row in session.execute(query):
+            yield row._asdict()
+    finally:
+        session.close()
+
+
+def iter_csv(after_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the export as CSV text, one item per line, in chunks."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for count, row in enumerate(iter_rows(after_id, batch_size), 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(after_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the export as JSON Lines, one invoice with nested items per line."""
+    lines = []
+    rows = iter_rows(after_id, batch_size)
+    for _, invoice_rows in groupby(rows, key=lambda row: row["invoice_id"]):
+        invoice_rows = list(invoice_rows)
+        record = {name: invoice_rows[0][name] for name in INVOICE_COLUMNS}
+        record["items"] = [
+            {name: row[name] for name in ITEM_COLUMNS}
+            for row in invoice_rows
+            if row["item_id"] is not None
+        ]
+        # Dates and Decimal amounts are written as strings to stay exact
+        lines.append(json.dumps(record, default=str) + "\n")
+        if len(lines) >= batch_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export invoices and items.")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument(
+        "--after-id", type=int, default=None, help="Resume after this invoice ID"
+    )
+    parser.add_argument("--output", default=None, help="File to write (default stdout)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    iter_export, _ = EXPORT_FORMATS[args.format]
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in iter_export(args.after_id):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
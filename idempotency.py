@@ -0,0 +1,79 @@
+"""Idempotency keys for invoice creation.
+
+A client that retries ``POST /invoices/`` with the same ``Idempotency-Key``
+header gets back the invoice its first attempt created instead of a
+duplicate. InvoiceGenerator.create_invoice writes the key in the same
+transaction as the invoice and answers retries with one primary-key lookup.
+Keys are kept for at least ``IDEMPOTENCY_KEY_TTL`` seconds; :func:`purge`
+removes older ones.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from config import IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_PURGE_BATCH_SIZE
+from database import Session, IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyReused(ValueError):
+    """Raised when a key is sent again with a different request."""
+
+
+def request_hash(payload):
+    """Return a stable SHA-256 hex digest of a JSON-like request payload."""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def lookup(session, key, payload_hash):
+    """Return the invoice ID recorded for ``key``, or None if it is new.
+
+    Raises IdempotencyKeyReused if the key was first used for a different
+    request.
+    """
+    row = session.get(IdempotencyKey, key)
+    if row is None:
+        return None
+    if row.request_hash != payload_hash:
+        raise IdempotencyKeyReused(
+            "Idempotency-Key was already used for a different request"
+        )
+    return row.invoice_id
+
+
+def purge(older_than=IDEMPOTENCY_KEY_TTL, batch_size=IDEMPOTENCY_PURGE_BATCH_SIZE):
+    """Delete keys created more than ``older_than`` seconds ago.
+
+    Keys are deleted ``batch_size`` at a time, one transaction per batch, so
+    a large backlog never holds the write lock for long. Returns the number
+    of keys deleted.
+    """
+    cutoff = datetime.now() - timedelta(seconds=older_than)
+    expired = (
+        select(IdempotencyKey.key)
+        .where(IdempotencyKey.created_at < cutoff)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    total = 0
+    session = Session()
+    try:
+        while True:
+            deleted = session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))
+            ).rowcount
+            session.commit()
+            total += deleted
+            if deleted < batch_size:
+                break
+    finally:
+        session.close()
+    if total:
+        logger.info(f"Purged {total} expired idempotency keys")
+    return total
@@ -0,0 +1,277 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+from itertools import groupby, islice
+from pathlib import Path
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from database import Session, Customer, init_db
+from invoice_generator import InvoiceGenerator
+from schemas import CustomerCreate, InvoiceCreate
+
+logger = logging.getLogger(__name__)
+
+# Records validated, deduplicated and inserted per transaction
+IMPORT_CHUNK_SIZE = 1000
+
+IMPORT_KINDS = ("customers", "invoices")
+IMPORT_FORMATS = ("csv", "jsonl")
+
+
+class RejectWriter:
+    """Write rejected records, one JSON object per line, to a side file."""
+
+    def __init__(self, output=None):
+        self.output = output
+        self.count = 0
+
+    def reject(self, line, record, error):
+        self.count += 1
+        if self.output is not None:
+            entry = {"line": line, "error": error, "record": record}
+            self.output.write(json.dumps(entry, default=str) + "\n")
+
+
+def read_records(stream, fmt):
+    """Yield ``(line, record, error)`` for each record in a text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty CSV cells mean "not given"
+            yield reader.line_num, {k: (v or None) for k, v in row.items()}, None
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, line.rstrip("\n"), f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, record, "Record must be a JSON object"
+            continue
+        yield line_number, record, None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _validation_message(error):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}"
+        for e in error.errors()
+    )
+
+
+def import_customers(stream, fmt="csv", chunk_size=IMPORT_CHUNK_SIZE, rejects=None):
+    """Stream customers from CSV or JSONL into the database.
+
+    Each chunk is validated with ``CustomerCreate``, checked for emails that
+    already exist with one query, and inserted with one executemany insert.
+    If the insert still fails, e.g. because another writer added one of the
+    emails meanwhile, the chunk is retried row by row. Rejected records go to
+    ``rejects`` (a RejectWriter). Returns counts of imported and rejected
+    records.
+    """
+    rejects = rejects or RejectWriter()
+    imported = 0
+    session = Session()
+    try:
+        for chunk in _chunks(read_records(stream, fmt), chunk_size):
+            valid = []
+            for line, record, error in chunk:
+                if error:
+                    rejects.reject(line, record, error)
+                    continue
+                record.setdefault("address", None)
+                record.setdefault("phone", None)
+                try:
+                    customer = CustomerCreate.model_validate(record)
+                except ValidationError as e:
+                    rejects.reject(line, record, _validation_message(e))
+                    continue
+                valid.append((line, record, customer))
+
+            emails = {customer.email for _, _, customer in valid}
+            taken = set(
+                session.scalars(
+                    select(Customer.email).where(Customer.email.in_(emails))
+                )
+            )
+            rows = []
+            for line, record, customer in valid:
+                if customer.email in taken:
+                    rejects.reject(line, record, "Email already exists")
+                    continue
+                taken.add(customer.email)
+                rows.append((line, record, customer.model_dump()))
+
+            if not rows:
+                continue
+            try:
+                session.execute(insert(Customer), [row for _, _, row in rows])
+                session.commit()
+                imported += len(rows)
+            except IntegrityError as e:
+                session.rollback()
+                logger.warning(
+                    f"Customer chunk failed, inserting rows singly: {e.orig}"
+                )
+                imported += _insert_customers_singly(session, rows, rejects)
+        return {"imported": imported, "rejected": rejects.count}
+    finally:
+        session.close()
+
+
+def _insert_customers_singly(session, rows, rejects):
+    """Insert ``(line, record, row)`` customers one per transaction.
+
+    Rows that still fail are rejected. Returns the number inserted.
+    """
+    imported = 0
+    for line, record, row in rows:
+        try:
+            session.execute(insert(Customer), row)
+            session.commit()
+            imported += 1
+        except IntegrityError:
+            session.rollback()
+            rejects.reject(line, record, "Email already exists")
+    return imported
+
+
+def _invoice_records(stream, fmt):
+    """Yield one ``(line, record, error)`` per invoice.
+
+    JSONL records are ``{"customer_id": ..., "items": [...]}``. CSV rows hold
+    one item each (``customer_id, invoice_ref, description, quantity,
+    unit_price``); consecutive rows sharing an ``invoice_ref`` form one
+    invoice, and rows without one are single-item invoices.
+    """
+    if fmt == "jsonl":
+        yield from read_records(stream, fmt)
+        return
+
+    def key(entry):
+        line, record, _ = entry
+        ref = record.get("invoice_ref")
+        return (record.get("customer_id"), ref) if ref else line
+
+    for _, group in groupby(read_records(stream, fmt), key=key):
+        group = list(group)
+        first_line, first, _ = group[0]
+        items = [
+            {
+                name: record.get(name)
+                for name in ("description", "quantity", "unit_price")
+            }
+            for _, record, _ in group
+        ]
+        yield first_line, {
+            "customer_id": first.get("customer_id"),
+            "items": items,
+        }, None
+
+
+def import_invoices(
+    stream, fmt="jsonl", chunk_size=IMPORT_CHUNK_SIZE, rejects=None, generator=None
+):
+    """Stream invoices from CSV or JSONL through ``create_invoices_bulk``.
+
+    Each chunk is validated with ``InvoiceCreate`` and then created in bulk,
+    which checks customer IDs with one query. Rejected records go to
+    ``rejects``. Returns counts of imported and rejected records.
+    """
+    rejects = rejects or RejectWriter()
+    generator = generator or InvoiceGenerator()
+    imported = 0
+    for chunk in _chunks(_invoice_records(stream, fmt), chunk_size):
+        valid = []
+        for line, record, error in chunk:
+            if error:
+                rejects.reject(line, record, error)
+                continue
+            try:
+                invoice = InvoiceCreate.model_validate(record)
+            except ValidationError as e:
+                rejects.reject(line, record, _validation_message(e))
+                continue
+            valid.append((line, record, invoice.model_dump()))
+
+        results = generator.create_invoices_bulk(
+            [invoice for _, _, invoice in valid], chunk_size=chunk_size
+        )
+        for (line, record, _), result in zip(valid, results):
+            if "error" in result:
+                rejects.reject(line, record, result["error"])
+            else:
+                imported += 1
+    return {"imported": imported, "rejected": rejects.count}
+
+
+IMPORTERS = {"customers": import_customers, "invoices": import_invoices}
+
+
+def run_import(kind, stream, fmt, chunk_size=IMPORT_CHUNK_SIZE, rejects_path=None):
+    """Import ``stream`` and write rejects to ``rejects_path`` when given.
+
+    The rejects file is removed again if nothing was rejected.
+    """
+    if rejects_path is None:
+        return IMPORTERS[kind](stream, fmt, chunk_size)
+
+    rejects_path = Path(rejects_path)
+    with open(rejects_path, "w") as output:
+        report = IMPORTERS[kind](stream, fmt, chunk_size, RejectWriter(output))
+    if report["rejected"]:
+        report["rejects_file"] = str(rejects_path)
+    else:
+        rejects_path.unlink()
+    logger.info(f"Imported {kind}: {report}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import customers or invoices.")
+    parser.add_argument("kind", choices=IMPORT_KINDS)
+    parser.add_argument("path", help="CSV or JSONL file to import")
+    parser.add_argument(
+        "--format", choices=IMPORT_FORMATS, default=None, help="Default: from suffix"
+    )
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument(
+        "--rejects",
+        default=None,
+        help="Rejected records file (default: <path>.rejects.jsonl)",
+    )
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    rejects_path = args.rejects or f"{args.path}.rejects.jsonl"
+    init_db()
+    with io.open(args.path, newline="", encoding="utf-8") as stream:
+        report = run_import(
+            kind=args.kind,
+            stream=stream,
+            fmt=fmt,
+            chunk_size=args.chunk_size,
+            rejects_path=rejects_path,
+        )
+    print(f"Imported {report['imported']} {args.kind}, rejected {report['rejected']}.")
+    if report.get("rejects_file"):
+        print(f"Rejected records written to {report['rejects_file']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
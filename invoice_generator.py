@@ -1,12 +1,115 @@
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+
+from config import (
+    ARCHIVE_STATUSES,
+    INVOICE_STATUSES,
+    PDF_OUTPUT_DIR,
+    STATEMENT_OUTPUT_DIR,
+)
+from database import (
+    Session,
+    ArchivedInvoice,
+    ArchivedInvoiceItem,
+    Customer,
+    IdempotencyKey,
+    Invoice,
+    InvoiceItem,
+)
+import customer_summary
+import idempotency
+import totals
+from invoice_numbers import default_allocator
+from money import from_cents, to_cents
+from pdf_cache import cache_key, default_cache
+from record_cache import CustomerRecord, InvoiceRecord
+from record_cache import default_cache as default_record_cache
+from pdf_generator import (
+    render_invoice_bytes,
+    render_invoice_file,
+    render_invoices,
+    render_statement,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of invoices written per transaction by create_invoices_bulk
+BULK_CHUNK_SIZE = 1000
+
+# Number of invoices loaded from the database at a time by generate_pdfs
+PDF_BATCH_LOAD_SIZE = 500
+
+# Default and maximum page sizes for list_invoices
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _customer_snapshot(customer):
+    """Copy a customer into a plain picklable object."""
+    return SimpleNamespace(
+        id=customer.id,
+        name=customer.name,
+        email=customer.email,
+        address=customer.address,
+        phone=customer.phone,
+    )
+
+
+def _invoice_snapshot(invoice):
+    """Copy an invoice, its items and customer into plain picklable objects."""
+    return (
+        SimpleNamespace(
+            id=invoice.id,
+            invoice_number=invoice.invoice_number,
+            date=invoice.date,
+            due_date=invoice.due_date,
+            total_amount=invoice.total_amount,
+            status=invoice.status,
+            notes=invoice.notes,
+            items=[
+                SimpleNamespace(
+                    description=item.description,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price,
+                    total=item.total,
+                )
+                for item in invoice.items
+            ],
+        ),
+        _customer_snapshot(invoice.customer),
+    )
+
+
+def _get_invoice(session, invoice_id):
+    """Return a live invoice, or an archived one, with its items loaded."""
+    invoice = session.get(
+        Invoice, invoice_id, options=[selectinload(Invoice.items)]
+    ) or session.get(
+        ArchivedInvoice,
+        invoice_id,
+        options=[selectinload(ArchivedInvoice.items)],
+    )
+    if not invoice:
+        raise ValueError("Invoice not found")
+    return invoice
+
 
 class InvoiceGenerator:
+    def __init__(self, pdf_cache=None, numbers=None, records=None):
+        self.pdf_cache = pdf_cache or default_cache
+        self.numbers = numbers or default_allocator
+        self.records = records or default_record_cache
+
     def create_customer(self, name, email, address, phone):
         """Create a new customer."""
         if not name:
@@ -28,17 +131,32 @@ class InvoiceGenerator:
         finally:
             session.close()
 
-    def create_invoice(self, customer_id, items):
-        """Create a new invoice with items."""
+    def create_invoice(self, customer_id, items, idempotency_key=None):
+        """Create a new invoice with items.
+
+        With an ``idempotency_key``, a repeated call with the same arguments
+        returns the invoice the first call created instead of a new one; see
+        idempotency.py.
+        """
+        if idempotency_key is not None:
+            payload_hash = idempotency.request_hash(
+                {"customer_id": customer_id, "items": items}
+            )
+            session = Session()
+            try:
+                invoice_id = idempotency.lookup(session, idempotency_key, payload_hash)
+            finally:
+                session.close()
+            if invoice_id is not None:
+                return invoice_id
+
+        # Verify customer exists (raises ValueError if not)
+        self.get_customer(customer_id)
+
         session = Session()
         try:
-            # Verify customer exists
-            customer = session.get(Customer, customer_id)
-            if not customer:
-                raise ValueError("Customer not found")
-
-            # Generate unique invoice number
-            invoice_number = f"INV-{uuid.uuid4().hex[:8].upper()}"
+            # Take the next sequential invoice number
+            invoice_number = self.numbers.next_number()
 
             # Create invoice
             invoice = Invoice(
@@ -50,7 +168,7 @@ class InvoiceGenerator:
             )
 
             # Add items to invoice
-            total_amount = 0
+            total_amount = from_cents(0)
             for item_data in items:
                 item = InvoiceItem(
                     description=item_data["description"],
@@ -64,46 +182,602 @@ class InvoiceGenerator:
             invoice.total_amount = total_amount
 
             session.add(invoice)
-            session.commit()
+            if idempotency_key is not None:
+                # Record the key in the same transaction as the invoice
+                session.flush()
+                session.add(
+                    IdempotencyKey(
+                        key=idempotency_key,
+                        request_hash=payload_hash,
+                        invoice_id=invoice.id,
+                    )
+                )
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                if idempotency_key is not None:
+                    # A concurrent request with the same key committed first
+                    invoice_id = idempotency.lookup(
+                        session, idempotency_key, payload_hash
+                    )
+                    if invoice_id is not None:
+                        return invoice_id
+                if session.get(Customer, customer_id) is None:
+                    # Deleted since the (possibly cached) check above
+                    self.records.invalidate(("customer", customer_id))
+                    raise ValueError("Customer not found")
+                raise
             # Get the ID before closing the session
             invoice_id = invoice.id
             return invoice_id
         finally:
             session.close()
 
-    def get_invoice(self, invoice_id):
-        """Retrieve an invoice by ID."""
+    def create_invoices_bulk(
+        self, invoices, chunk_size=BULK_CHUNK_SIZE, before_commit=None
+    ):
+        """Create many invoices at once.
+
+        ``invoices`` is a sequence of dicts with ``customer_id`` and ``items``
+        keys, as accepted by :meth:`create_invoice`, and optionally the
+        invoice ``date`` (today by default). Customer IDs are checked
+        with one query per chunk, invoices and items are written with
+        executemany inserts and each chunk is committed in its own
+        transaction. Returns one result dict per input row, in order, holding
+        either the new invoice ``id`` or an ``error`` message.
+
+        ``before_commit(session, indexes)``, if given, is called before each
+        chunk is committed, with the input indexes of the rows being inserted,
+        so related writes share its transaction; if it raises, the chunk is
+        rolled back.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        results = [None] * len(invoices)
+        session = Session()
+        try:
+            for start in range(0, len(invoices), chunk_size):
+                chunk = list(enumerate(invoices[start : start + chunk_size], start))
+                self._create_invoice_chunk(session, chunk, results, before_commit)
+            return results
+        finally:
+            session.close()
+
+    def _create_invoice_chunk(self, session, chunk, results, before_commit=None):
+        """Validate and insert one chunk of bulk invoices in one transaction."""
+        customer_ids = {
+            data.get("customer_id") for _, data in chunk if isinstance(data, dict)
+        }
+        existing = {
+            row[0]
+            for row in session.query(Customer.id).filter(Customer.id.in_(customer_ids))
+        }
+
+        today = datetime.now().date()
+        valid = []
+        invoice_rows = []
+        item_rows = []
+        for index, data in chunk:
+            try:
+                if not isinstance(data, dict):
+                    raise ValueError("Invoice data must be a mapping")
+                if data.get("customer_id") not in existing:
+                    raise ValueError("Customer not found")
+                invoice_date = data.get("date") or today
+                if not isinstance(invoice_date, date):
+                    raise ValueError("Invoice date must be a date")
+                lines = [
+                    {
+                        "description": item["description"],
+                        "quantity": item["quantity"],
+                        "unit_price": to_cents(item["unit_price"]),
+                    }
+                    for item in data.get("items", [])
+                ]
+                if not all(type(line["quantity"]) is int for line in lines):
+                    raise TypeError("quantity must be an integer")
+            except (KeyError, TypeError, ArithmeticError) as e:
+                results[index] = {"index": index, "error": f"Invalid item data: {e}"}
+                continue
+            except ValueError as e:
+                results[index] = {"index": index, "error": str(e)}
+                continue
+
+            valid.append(index)
+            item_rows.append(lines)
+            invoice_rows.append(
+                {
+                    "customer_id": data["customer_id"],
+                    "date": invoice_date,
+                    "due_date": invoice_date + timedelta(days=30),
+                    "status": "draft",
+                }
+            )
+
+        if not invoice_rows:
+            return
+
+        # Line and invoice totals for the whole chunk, in integer cents
+        quantities = [line["quantity"] for lines in item_rows for line in lines]
+        unit_prices = [line["unit_price"] for lines in item_rows for line in lines]
+        line_cents = totals.line_totals(quantities, unit_prices)
+        invoice_cents = totals.invoice_totals(
+            line_cents, [len(lines) for lines in item_rows]
+        )
+        for row, cents in zip(invoice_rows, invoice_cents):
+            row["total_amount"] = from_cents(cents)
+        position = 0
+        for lines in item_rows:
+            for line in lines:
+                line["unit_price"] = from_cents(line["unit_price"])
+                line["total"] = from_cents(line_cents[position])
+                position += 1
+
+        # Numbers are sequential per invoice year
+        rows_by_year = defaultdict(list)
+        for row in invoice_rows:
+            rows_by_year[row["date"].year].append(row)
+        for rows in rows_by_year.values():
+            numbers = self.numbers.take(len(rows), rows[0]["date"])
+            for row, number in zip(rows, numbers):
+                row["invoice_number"] = number
+
+        try:
+            invoice_ids = session.scalars(
+                insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True),
+                invoice_rows,
+            ).all()
+            flat_items = [
+                dict(line, invoice_id=invoice_id)
+                for invoice_id, lines in zip(invoice_ids, item_rows)
+                for line in lines
+            ]
+            if flat_items:
+                session.execute(insert(InvoiceItem), flat_items)
+            # Core inserts skip the ORM flush hook, so update summaries here
+            deltas = customer_summary.SummaryDeltas()
+            for row in invoice_rows:
+                deltas.add(row["customer_id"], row["status"], row["total_amount"])
+            customer_summary.apply_deltas(session.connection(), deltas)
+            if before_commit is not None:
+                before_commit(session, valid)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Bulk invoice chunk failed: {str(e)}")
+            for index in valid:
+                results[index] = {"index": index, "error": "Chunk insert failed"}
+            return
+
+        for index, invoice_id in zip(valid, invoice_ids):
+            results[index] = {"index": index, "id": invoice_id}
+
+    def set_invoice_status(self, invoice_id, status):
+        """Change an invoice's status, e.g. from ``draft`` to ``sent``."""
+        if status not in INVOICE_STATUSES:
+            raise ValueError(f"Invalid status: {status}")
+
         session = Session()
         try:
             invoice = session.get(Invoice, invoice_id)
             if not invoice:
                 raise ValueError("Invoice not found")
-            return invoice
+            invoice.status = status
+            session.commit()
+        finally:
+            session.close()
+        self.records.invalidate(("invoice", invoice_id))
+
+    def mark_invoices_sent(self, invoice_ids):
+        """Mark the given draft invoices as ``sent`` in one statement.
+
+        Invoices that are not drafts keep their status. The customer summary
+        is updated in the same transaction. Returns the number changed.
+        """
+        if not invoice_ids:
+            return 0
+        table = Invoice.__table__
+        session = Session()
+        try:
+            changed = session.execute(
+                update(table)
+                .where(table.c.id.in_(invoice_ids), table.c.status == "draft")
+                .values(status="sent")
+                .returning(table.c.id, table.c.customer_id, table.c.total_amount)
+            ).all()
+            deltas = customer_summary.SummaryDeltas()
+            for _, customer_id, total_amount in changed:
+                deltas.add(customer_id, "draft", total_amount, sign=-1)
+                deltas.add(customer_id, "sent", total_amount)
+            customer_summary.apply_deltas(session.connection(), deltas)
+            session.commit()
         finally:
             session.close()
+        self.records.invalidate(*(("invoice", row[0]) for row in changed))
+        return len(changed)
+
+    def get_invoice(self, invoice_id):
+        """Retrieve an invoice by ID as a read-only InvoiceRecord.
+
+        Records are served from ``self.records`` when cached.
+        """
+        return self.records.get(
+            ("invoice", invoice_id), lambda: self._load_invoice(invoice_id)
+        )
 
     def get_customer(self, customer_id):
-        """Retrieve a customer by ID."""
+        """Retrieve a customer by ID as a read-only CustomerRecord.
+
+        Records are served from ``self.records`` when cached.
+        """
+        return self.records.get(
+            ("customer", customer_id), lambda: self._load_customer(customer_id)
+        )
+
+    def _load_invoice(self, invoice_id):
+        session = Session()
+        try:
+            return InvoiceRecord.from_model(_get_invoice(session, invoice_id))
+        finally:
+            session.close()
+
+    def _load_customer(self, customer_id):
         session = Session()
         try:
             customer = session.get(Customer, customer_id)
             if not customer:
                 raise ValueError("Customer not found")
-            return customer
+            return CustomerRecord.from_model(customer)
+        finally:
+            session.close()
+
+    def list_invoices(
+        self,
+        after_id=None,
+        limit=DEFAULT_PAGE_SIZE,
+        status=None,
+        customer_id=None,
+        date_from=None,
+        date_to=None,
+        include_items=False,
+        include_archived=True,
+    ):
+        """Return one page of invoices as plain dicts, ordered by ID.
+
+        Pages are keyset paginated: pass the last ``id`` of the previous page
+        as ``after_id`` to get the next one. Customer names are fetched in the
+        same query and, with ``include_items``, all items for the page in one
+        more query, so nothing is lazily loaded per invoice.
+
+        Archived invoices are included unless ``include_archived`` is false
+        or ``status`` rules them out; the archive is then read with the same
+        query and the two pages are merged by ID.
+        """
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        sources = [(Invoice, InvoiceItem)]
+        if include_archived and (status is None or status in ARCHIVE_STATUSES):
+            sources.append((ArchivedInvoice, ArchivedInvoiceItem))
+
+        session = Session()
+        try:
+            rows = []
+            for model, item_model in sources:
+                query = (
+                    session.query(
+                        model.id,
+                        model.invoice_number,
+                        model.customer_id,
+                        Customer.name,
+                        model.date,
+                        model.due_date,
+                        model.status,
+                        model.total_amount,
+                    )
+                    .join(Customer, model.customer_id == Customer.id)
+                    .order_by(model.id)
+                )
+                if after_id is not None:
+                    query = query.filter(model.id > after_id)
+                if status is not None:
+                    query = query.filter(model.status == status)
+                if customer_id is not None:
+                    query = query.filter(model.customer_id == customer_id)
+                if date_from is not None:
+                    query = query.filter(model.date >= date_from)
+                if date_to is not None:
+                    query = query.filter(model.date <= date_to)
+                rows += [(row, item_model) for row in query.limit(limit)]
+            if len(sources) > 1:
+                rows.sort(key=lambda r: r[0].id)
+                del rows[limit:]
+
+            invoices = [
+                {
+                    "id": row.id,
+                    "invoice_number": row.invoice_number,
+                    "customer_id": row.customer_id,
+                    "customer_name": row.name,
+                    "date": row.date,
+                    "due_date": row.due_date,
+                    "status": row.status,
+                    "total_amount": row.total_amount,
+                }
+                for row, _ in rows
+            ]
+
+            if include_items and invoices:
+                by_id = {invoice["id"]: invoice for invoice in invoices}
+                for invoice in invoices:
+                    invoice["items"] = []
+                for _, item_model in sources:
+                    ids = [row.id for row, model in rows if model is item_model]
+                    if not ids:
+                        continue
+                    item_rows = (
+                        session.query(
+                            item_model.invoice_id,
+                            item_model.description,
+                            item_model.quantity,
+                            item_model.unit_price,
+                            item_model.total,
+                        )
+                        .filter(item_model.invoice_id.in_(ids))
+                        .order_by(item_model.id)
+                    )
+                    for row in item_rows:
+                        by_id[row.invoice_id]["items"].append(
+                            {
+                                "description": row.description,
+                                "quantity": row.quantity,
+                                "unit_price": row.unit_price,
+                                "total": row.total,
+                            }
+                        )
+            return invoices
         finally:
             session.close()
 
+    def iter_invoices(self, page_size=DEFAULT_PAGE_SIZE, **filters):
+        """Yield every matching invoice, fetching one keyset page at a time."""
+        after_id = None
+        while True:
+            page = self.list_invoices(after_id=after_id, limit=page_size, **filters)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_id = page[-1]["id"]
+
     def generate_pdf(self, invoice_id):
-        """Generate PDF for an invoice."""
+        """Generate PDF for an invoice.
+
+        Rendered files are cached by a hash of their inputs, so an unchanged
+        invoice returns the existing file instead of being rendered again.
+        """
         session = Session()
         try:
-            invoice = session.get(Invoice, invoice_id)
-            if not invoice:
-                raise ValueError("Invoice not found")
+            invoice = _get_invoice(session, invoice_id)
+
+            customer = invoice.customer
+            key = cache_key(invoice, customer)
+            path = self.pdf_cache.get(key)
+            if path is None:
+                path = self.pdf_cache.put(
+                    key,
+                    lambda filename: render_invoice_file(invoice, customer, filename),
+                )
+            return str(path)
+        finally:
+            session.close()
+
+    def generate_pdf_bytes(self, invoice_id, persist=True):
+        """Render an invoice in memory and return ``(filename, pdf_bytes)``.
+
+        A cached copy is returned when one exists. Otherwise the PDF is
+        rendered into a buffer and, if ``persist`` is set, also stored in the
+        cache so later downloads skip rendering.
+        """
+        filename, key, data, snapshot = self.prepare_pdf(invoice_id)
+        if data is None:
+            data = render_invoice_bytes(*snapshot)
+            if persist:
+                self.pdf_cache.put_bytes(key, data)
+        return filename, data
+
+    def prepare_pdf(self, invoice_id):
+        """Load what is needed to serve an invoice PDF.
+
+        Returns ``(filename, cache_key, cached_bytes, snapshot)``. When the PDF
+        is cached ``cached_bytes`` holds it and ``snapshot`` is None;
+        otherwise ``snapshot`` is an ``(invoice, customer)`` pair of plain
+        objects that can be rendered in another thread or process.
+        """
+        session = Session()
+        try:
+            invoice = _get_invoice(session, invoice_id)
 
             filename = f"invoice_{invoice.invoice_number}.pdf"
-            pdf_generator = PDFGenerator(filename)
-            pdf_generator.generate_invoice(invoice, invoice.customer)
-            return filename
+            key = cache_key(invoice, invoice.customer)
+            path = self.pdf_cache.get(key)
+            if path is not None:
+                return filename, key, path.read_bytes(), None
+            return filename, key, None, _invoice_snapshot(invoice)
+        finally:
+            session.close()
+
+    def iter_generate_pdfs(self, invoice_ids, workers=None, output_dir=None):
+        """Render PDFs for many invoices, yielding results as they finish.
+
+        Invoices are loaded in batches of ``PDF_BATCH_LOAD_SIZE`` with their
+        customer and items, copied into plain objects and rendered on a pool
+        of ``workers`` processes (defaults to the CPU count; ``1`` renders in
+        this process). Each yielded dict holds the ``invoice_id`` and either
+        the ``filename`` written or an ``error`` message. Results arrive in
+        completion order, not input order.
+        """
+        invoice_ids = list(dict.fromkeys(invoice_ids))
+        workers = workers or os.cpu_count() or 1
+        output_dir = Path(output_dir or PDF_OUTPUT_DIR)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        if workers == 1:
+            for invoice_id, task in self._iter_pdf_tasks(invoice_ids, output_dir):
+                yield self._run_pdf_task(invoice_id, task)
+            return
+
+        # Keep a bounded number of renders in flight so memory stays flat
+        max_pending = workers * 4
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for invoice_id, task in self._iter_pdf_tasks(invoice_ids, output_dir):
+                if isinstance(task, str):
+                    yield {"invoice_id": invoice_id, "error": task}
+                    continue
+                pending[executor.submit(render_invoice_file, *task)] = invoice_id
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._pdf_result(pending.pop(future), future)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._pdf_result(pending.pop(future), future)
+
+    def generate_pdfs(self, invoice_ids, workers=None, output_dir=None):
+        """Render PDFs for many invoices and return the results in input order.
+
+        Each invoice is rendered, and reported, once even if listed twice.
+        """
+        invoice_ids = list(dict.fromkeys(invoice_ids))
+        results = {
+            r["invoice_id"]: r
+            for r in self.iter_generate_pdfs(invoice_ids, workers, output_dir)
+        }
+        return [results[invoice_id] for invoice_id in invoice_ids]
+
+    def prepare_pdf_files(self, invoice_ids, output_dir=None):
+        """Load invoices for rendering to files elsewhere, e.g. in the API.
+
+        Returns ``(invoice_id, task)`` pairs in input order, where ``task`` is
+        the ``render_invoice_file`` arguments or an error message.
+        """
+        output_dir = Path(output_dir or PDF_OUTPUT_DIR)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return list(self._iter_pdf_tasks(invoice_ids, output_dir))
+
+    def generate_combined_pdf(self, invoice_ids, filename):
+        """Render several invoices into a single PDF at ``filename``.
+
+        The invoices, their customers and items are fetched in one query and
+        laid out in one pass, one invoice per page in ``invoice_ids`` order.
+        """
+        session = Session()
+        try:
+            invoices = {
+                invoice.id: invoice
+                for invoice in session.query(Invoice)
+                .options(joinedload(Invoice.customer), joinedload(Invoice.items))
+                .filter(Invoice.id.in_(invoice_ids))
+            }
+            missing = [i for i in invoice_ids if i not in invoices]
+            if missing:
+                raise ValueError(f"Invoice not found: {missing[0]}")
+            snapshots = [_invoice_snapshot(invoices[i]) for i in invoice_ids]
+        finally:
+            session.close()
+
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        return str(render_invoices(filename, snapshots))
+
+    def prepare_statement(self, customer_id, date_from=None, date_to=None):
+        """Load a customer and their invoices for a statement.
+
+        Returns ``(filename, customer, invoices)`` as plain objects ready for
+        ``pdf_generator.render_statement``. All invoices in the period and
+        their items are fetched in a single query, ordered by date.
+        """
+        session = Session()
+        try:
+            customer = session.get(Customer, customer_id)
+            if not customer:
+                raise ValueError("Customer not found")
+
+            query = (
+                session.query(Invoice)
+                .options(joinedload(Invoice.items))
+                .filter(Invoice.customer_id == customer_id)
+                .order_by(Invoice.date, Invoice.id)
+            )
+            if date_from is not None:
+                query = query.filter(Invoice.date >= date_from)
+            if date_to is not None:
+                query = query.filter(Invoice.date <= date_to)
+            invoices = [_invoice_snapshot(invoice)[0] for invoice in query]
+
+            filename = (
+                f"statement_{customer_id}_{date_from or 'start'}_{date_to or 'all'}.pdf"
+            )
+            return filename, _customer_snapshot(customer), invoices
+        finally:
+            session.close()
+
+    def generate_statement(
+        self, customer_id, date_from=None, date_to=None, output_dir=None
+    ):
+        """Render a customer's statement for a period and return the filename.
+
+        The statement opens with a summary of every invoice dated within
+        ``date_from``..``date_to`` (both optional, inclusive) followed by each
+        invoice in full, all in one PDF.
+        """
+        filename, customer, invoices = self.prepare_statement(
+            customer_id, date_from, date_to
+        )
+        output_dir = Path(output_dir or STATEMENT_OUTPUT_DIR)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = str(output_dir / filename)
+        render_statement(path, customer, invoices, date_from, date_to)
+        return path
+
+    def _iter_pdf_tasks(self, invoice_ids, output_dir):
+        """Yield ``(invoice_id, task)`` pairs, where task is render args or an error."""
+        session = Session()
+        try:
+            for start in range(0, len(invoice_ids), PDF_BATCH_LOAD_SIZE):
+                batch = invoice_ids[start : start + PDF_BATCH_LOAD_SIZE]
+                invoices = {
+                    invoice.id: invoice
+                    for invoice in session.query(Invoice)
+                    .options(joinedload(Invoice.customer), selectinload(Invoice.items))
+                    .filter(Invoice.id.in_(batch))
+                }
+                for invoice_id in batch:
+                    invoice = invoices.get(invoice_id)
+                    if invoice is None:
+                        yield invoice_id, "Invoice not found"
+                        continue
+                    invoice_data, customer_data = _invoice_snapshot(invoice)
+                    filename = str(output_dir / f"invoice_{invoice.invoice_number}.pdf")
+                    yield invoice_id, (invoice_data, customer_data, filename)
+                session.expunge_all()
         finally:
             session.close()
+
+    def _run_pdf_task(self, invoice_id, task):
+        if isinstance(task, str):
+            return {"invoice_id": invoice_id, "error": task}
+        try:
+            return {"invoice_id": invoice_id, "filename": render_invoice_file(*task)}
+        except Exception as e:
+            logger.error(f"PDF generation failed for invoice {invoice_id}: {str(e)}")
+            return {"invoice_id": invoice_id, "error": str(e)}
+
+    def _pdf_result(self, invoice_id, future):
+        try:
+            return {"invoice_id": invoice_id, "filename": future.result()}
+        except Exception as e:
+            logger.error(f"PDF generation failed for invoice {invoice_id}: {str(e)}")
+            return {"invoice_id": invoice_id, "error": str(e)}
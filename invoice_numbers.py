@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from config import (
+    INVOICE_NUMBER_BLOCK_SIZE,
+    INVOICE_NUMBER_DIGITS,
+    INVOICE_NUMBER_PREFIX,
+)
+from database import InvoiceNumberSequence, engine
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceNumberAllocator:
+    """Hand out sequential invoice numbers using hi/lo block allocation.
+
+    Each process reserves a block of ``block_size`` numbers per prefix with a
+    single atomic update of the ``invoice_number_sequences`` row and then
+    serves numbers from memory, so workers never hand out the same number and
+    invoice inserts never need a retry. Numbers left in a block when a
+    process exits are skipped, leaving gaps but no duplicates.
+    """
+
+    def __init__(
+        self,
+        block_size=INVOICE_NUMBER_BLOCK_SIZE,
+        prefix=INVOICE_NUMBER_PREFIX,
+        digits=INVOICE_NUMBER_DIGITS,
+        db_engine=None,
+    ):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.block_size = block_size
+        self.prefix = prefix
+        self.digits = digits
+        self.engine = db_engine or engine
+        self._lock = threading.Lock()
+        self._blocks = {}  # prefix -> [next, end)
+        self._pid = os.getpid()
+
+    def next_number(self, on_date=None):
+        return self.take(1, on_date)[0]
+
+    def take(self, count, on_date=None):
+        """Return ``count`` consecutive-where-possible invoice numbers."""
+        prefix = self.prefix.format(year=(on_date or datetime.now().date()).year)
+        values = []
+        with metrics.timed("invoice_number"), self._lock:
+            if self._pid != os.getpid():
+                # Blocks inherited from a parent process belong to the parent
+                self._blocks.clear()
+                self._pid = os.getpid()
+            while len(values) < count:
+                block = self._blocks.get(prefix)
+                if not block or block[0] >= block[1]:
+                    size = max(self.block_size, count - len(values))
+                    with metrics.timed("invoice_number_reserve"):
+                        block = self._blocks[prefix] = self._reserve(prefix, size)
+                end = min(block[1], block[0] + count - len(values))
+                values.extend(range(block[0], end))
+                block[0] = end
+        return [f"{prefix}{value:0{self.digits}d}" for value in values]
+
+    def reset(self):
+        """Forget reserved blocks, e.g. after the database was recreated."""
+        with self._lock:
+            self._blocks.clear()
+
+    def _reserve(self, prefix, size):
+        """Atomically reserve ``size`` numbers for ``prefix`` and return [start, end)."""
+        table = InvoiceNumberSequence.__table__
+        bump = (
+            update(table)
+            .where(table.c.prefix == prefix)
+            .values(next_value=table.c.next_value + size)
+            .returning(table.c.next_value)
+        )
+        for _ in range(2):
+            with self.engine.begin() as conn:
+                end = conn.execute(bump).scalar()
+                if end is not None:
+                    return [end - size, end]
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(
+                        insert(table).values(prefix=prefix, next_value=1 + size)
+                    )
+                logger.info(f"Started invoice number sequence {prefix}")
+                return [1, 1 + size]
+            except IntegrityError:
+                # Another process created the row first; bump it instead
+                continue
+        raise RuntimeError(f"Could not reserve invoice numbers for {prefix}")
+
+
+# Shared by every InvoiceGenerator in the process
+default_allocator = InvoiceNumberAllocator()
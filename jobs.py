@@ -0,0 +1,442 @@
+import argparse
+import io
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import func, select, update
+
+import archive
+import config
+import delivery
+import export
+import idempotency
+import importer
+import recurring
+import search
+from database import Session, Job, init_db
+from invoice_generator import InvoiceGenerator
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+# Job kind -> handler(job_id, **params) returning a JSON-serialisable result
+HANDLERS = {}
+
+# Kinds whose stale jobs fail instead of being requeued, as running them
+# again could repeat side effects, e.g. emails already sent
+NO_RETRY_KINDS = set()
+
+_generator = None
+
+
+def handler(kind, retry=True):
+    """Register a function as the handler for jobs of ``kind``.
+
+    With ``retry=False``, a job of this kind left stale by a dead worker is
+    marked failed rather than queued again.
+    """
+
+    def register(func):
+        HANDLERS[kind] = func
+        if not retry:
+            NO_RETRY_KINDS.add(kind)
+        return func
+
+    return register
+
+
+def _get_generator():
+    global _generator
+    if _generator is None:
+        _generator = InvoiceGenerator()
+    return _generator
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+@handler("pdf")
+def render_pdf(job_id, invoice_id):
+    return {"filename": _get_generator().generate_pdf(invoice_id)}
+
+
+@handler("pdfs")
+def render_pdfs(job_id, invoice_ids):
+    # Worker processes are daemonic and cannot start a pool of their own, so
+    # a batch renders sequentially; run more workers for more throughput
+    results = _get_generator().generate_pdfs(invoice_ids, 1)
+    generated = sum(1 for r in results if "filename" in r)
+    return {
+        "generated": generated,
+        "failed": len(results) - generated,
+        "results": results,
+    }
+
+
+@handler("statement")
+def render_statement(job_id, customer_id, date_from=None, date_to=None):
+    filename = _get_generator().generate_statement(
+        customer_id, _parse_date(date_from), _parse_date(date_to)
+    )
+    return {"filename": filename}
+
+
+@handler("email", retry=False)
+def email_invoices(job_id, invoice_ids):
+    results = delivery.deliver_invoices(invoice_ids, generator=_get_generator())
+    sent = sum(1 for r in results if "email" in r)
+    skipped = sum(1 for r in results if "skipped" in r)
+    return {
+        "sent": sent,
+        "skipped": skipped,
+        "failed": len(results) - sent - skipped,
+        "results": results,
+    }
+
+
+@handler("export")
+def export_invoices(job_id, format="csv", after_id=None):
+    iter_export, _ = export.EXPORT_FORMATS[format]
+    output_dir = config.JOB_OUTPUT_DIR / "exports"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    filename = output_dir / f"invoices_{job_id}.{format}"
+    with open(filename, "w", newline="") as output:
+        for chunk in iter_export(after_id):
+            output.write(chunk)
+    return {"filename": str(filename)}
+
+
+@handler("import")
+def import_records(job_id, kind, path, format="csv", chunk_size=None):
+    # Only files saved by POST /jobs/import are read, and then deleted
+    path = Path(path).resolve()
+    if not path.is_relative_to(config.JOB_UPLOAD_DIR.resolve()):
+        raise ValueError("Import file is not an upload")
+    rejects_path = path.with_name(f"{path.name}.rejects.jsonl")
+    try:
+        with io.open(path, newline="", encoding="utf-8") as stream:
+            return importer.run_import(
+                kind,
+                stream,
+                format,
+                chunk_size or importer.IMPORT_CHUNK_SIZE,
+                rejects_path,
+            )
+    finally:
+        path.unlink(missing_ok=True)
+
+
+@handler("archive")
+def archive_invoices(job_id, older_than_days=config.ARCHIVE_AFTER_DAYS):
+    return {"archived": archive.archive_invoices(older_than_days)}
+
+
+@handler("recurring")
+def bill_recurring(job_id, as_of=None, queue_pdfs=config.RECURRING_QUEUE_PDFS):
+    return recurring.run_due(
+        _parse_date(as_of),
+        generator=_get_generator(),
+        on_created=_queue_pdfs if queue_pdfs else None,
+    )
+
+
+def _queue_pdfs(invoice_ids):
+    submit("pdfs", {"invoice_ids": invoice_ids})
+
+
+def submit(kind, params=None):
+    """Queue a job and return its ID."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    session = Session()
+    try:
+        job = Job(kind=kind, params=params or {})
+        session.add(job)
+        session.commit()
+        return job.id
+    finally:
+        session.close()
+
+
+def get_job(job_id):
+    """Return a job's status and result as a dict."""
+    session = Session()
+    try:
+        job = session.get(Job, job_id)
+        if not job:
+            raise ValueError("Job not found")
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "params": job.params,
+            "result": job.result,
+            "error": job.error,
+            "attempts": job.attempts,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "heartbeat_at": job.heartbeat_at,
+            "finished_at": job.finished_at,
+        }
+    finally:
+        session.close()
+
+
+def claim():
+    """Mark the oldest queued job as running and return ``(id, kind, params)``.
+
+    The select and update happen in one statement, so two workers can never
+    claim the same job. Returns None when the queue is empty.
+    """
+    now = datetime.now()
+    oldest = (
+        select(Job.id)
+        .where(Job.status == "queued")
+        .order_by(Job.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Job)
+        .where(Job.id == oldest, Job.status == "queued")
+        .values(
+            status="running",
+            started_at=now,
+            heartbeat_at=now,
+            attempts=Job.attempts + 1,
+        )
+        .returning(Job.id, Job.kind, Job.params)
+    )
+    session = Session()
+    try:
+        row = session.execute(stmt).first()
+        session.commit()
+        return tuple(row) if row else None
+    finally:
+        session.close()
+
+
+def _finish(job_id, status, result=None, error=None):
+    session = Session()
+    try:
+        session.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(
+                status=status,
+                result=result,
+                error=error,
+                finished_at=datetime.now(),
+            )
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def _heartbeat(job_id, stop_event, interval):
+    while not stop_event.wait(interval):
+        session = Session()
+        try:
+            session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "running")
+                .values(heartbeat_at=datetime.now())
+            )
+            session.commit()
+        except Exception as e:
+            logger.error(f"Heartbeat for job {job_id} failed: {str(e)}")
+        finally:
+            session.close()
+
+
+def run_job(job_id, kind, params, heartbeat_interval=config.JOB_HEARTBEAT_INTERVAL):
+    """Run a claimed job and record its result or error.
+
+    While the handler runs, a thread refreshes the job's heartbeat every
+    ``heartbeat_interval`` seconds, so requeue_stale leaves it alone.
+    """
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat,
+        args=(job_id, stop_heartbeat, heartbeat_interval),
+        name=f"job-{job_id}-heartbeat",
+        daemon=True,
+    )
+    heartbeat.start()
+    try:
+        result = HANDLERS[kind](job_id, **params)
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {str(e)}")
+        _finish(job_id, "failed", error=str(e)[:500])
+        return False
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    _finish(job_id, "done", result=result)
+    return True
+
+
+def run_once():
+    """Run the next queued job, if any. Returns whether a job was run."""
+    job = claim()
+    if job is None:
+        return False
+    run_job(*job)
+    return True
+
+
+def run_worker(stop_event=None, poll_interval=config.JOB_POLL_INTERVAL, scheduler=True):
+    """Run jobs until ``stop_event`` is set, sleeping while the queue is empty.
+
+    A ``scheduler`` worker also bills due recurring invoices while idle; a
+    pool makes only one of its workers the scheduler.
+    """
+    next_purge = next_billing = next_requeue = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        try:
+            if run_once():
+                continue
+            if scheduler and time.monotonic() >= next_billing:
+                # Idle: bill due recurring invoices, then check the queue
+                # again for any PDF jobs that queued
+                next_billing = time.monotonic() + config.RECURRING_INTERVAL
+                bill_recurring(None)
+                continue
+            # Idle: index rows written since the last search, so searches
+            # after a bulk load do not have to
+            search.sync()
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + config.IDEMPOTENCY_PURGE_INTERVAL
+                idempotency.purge()
+            if time.monotonic() >= next_requeue:
+                # Pick up jobs left running by a worker that died since
+                next_requeue = time.monotonic() + config.JOB_STALE_AFTER
+                requeue_stale()
+        except Exception as e:
+            logger.error(f"Job worker error: {str(e)}")
+        if stop_event is None:
+            time.sleep(poll_interval)
+        else:
+            stop_event.wait(poll_interval)
+
+
+def requeue_stale(
+    older_than=config.JOB_STALE_AFTER, max_attempts=config.JOB_MAX_ATTEMPTS
+):
+    """Queue running jobs again whose worker has not been heard from for
+    ``older_than`` seconds, e.g. because it crashed.
+
+    Jobs whose heartbeat is still fresh are left running. A stale job that
+    was already claimed ``max_attempts`` times, e.g. one that crashes its
+    worker every time, is marked failed instead, as is any stale job of a
+    kind in NO_RETRY_KINDS. Returns the number requeued.
+    """
+    cutoff = datetime.now() - timedelta(seconds=older_than)
+    stale = (
+        Job.status == "running",
+        func.coalesce(Job.heartbeat_at, Job.started_at) < cutoff,
+    )
+    session = Session()
+    try:
+        failed = session.execute(
+            update(Job)
+            .where(*stale, Job.kind.in_(NO_RETRY_KINDS))
+            .values(
+                status="failed",
+                error="Worker stopped responding; this kind of job is not retried",
+                finished_at=datetime.now(),
+            )
+        ).rowcount
+        failed += session.execute(
+            update(Job)
+            .where(*stale, Job.attempts >= max_attempts)
+            .values(
+                status="failed",
+                error=f"Worker stopped responding; gave up after {max_attempts} attempts",
+                finished_at=datetime.now(),
+            )
+        ).rowcount
+        count = session.execute(
+            update(Job)
+            .where(*stale)
+            .values(status="queued", started_at=None, heartbeat_at=None)
+        ).rowcount
+        session.commit()
+        if failed:
+            logger.error(f"Failed {failed} stale jobs out of attempts")
+        if count:
+            logger.info(f"Requeued {count} stale jobs")
+        return count
+    finally:
+        session.close()
+
+
+def _worker_main(stop_event, scheduler):
+    try:
+        run_worker(stop_event, scheduler=scheduler)
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    """Job worker processes, started and stopped together."""
+
+    def __init__(self, workers=config.JOB_WORKERS):
+        self.workers = workers
+        # Spawned rather than forked so no engine or session state is shared
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._processes = []
+
+    def start(self):
+        requeue_stale()
+        for n in range(self.workers):
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self._stop, n == 0),
+                name=f"job-worker-{n}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info(f"Started {self.workers} job workers")
+
+    def stop(self, timeout=30):
+        """Let running jobs finish, then stop the workers."""
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        logger.info("Job workers stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run background job workers.")
+    parser.add_argument("--workers", type=int, default=config.JOB_WORKERS)
+    args = parser.parse_args(argv)
+
+    init_db()
+    pool = WorkerPool(max(args.workers, 1))
+    pool.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
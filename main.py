@@ -1,11 +1,12 @@
 from invoice_generator import InvoiceGenerator
-from database import init_db, Session, Customer, Invoice
+from database import init_db, Session, Customer
 import logging
 import sys
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
 def print_menu():
     print("\n=== Invoice Generator System ===")
     print("1. Add Customer")
@@ -16,6 +17,7 @@ def print_menu():
     print("6. Exit")
     print("==============================")
 
+
 def get_customer_input():
     print("\nEnter Customer Details:")
     name = input("Name: ")
@@ -24,6 +26,7 @@ def get_customer_input():
     phone = input("Phone: ")
     return name, email, address, phone
 
+
 def list_customers():
     session = Session()
     try:
@@ -31,7 +34,7 @@ def list_customers():
         if not customers:
             print("\nNo customers found in the database.")
             return False
-        
+
         print("\nAvailable Customers:")
         print("ID  | Name                 | Email")
         print("-" * 50)
@@ -41,6 +44,23 @@ def list_customers():
     finally:
         session.close()
 
+
+def list_invoices(generator):
+    """Print every invoice, one keyset page at a time."""
+    found = False
+    for invoice in generator.iter_invoices():
+        if not found:
+            print("\nInvoices:")
+            print("ID  | Invoice Number    | Customer Name        | Total Amount")
+            print("-" * 65)
+            found = True
+        print(
+            f"{invoice['id']:<3} | {invoice['invoice_number']:<16} | "
+            f"{invoice['customer_name'][:18]:<18} | ${invoice['total_amount']:,.2f}"
+        )
+    return found
+
+
 def get_invoice_items():
     items = []
     while True:
@@ -48,35 +68,38 @@ def get_invoice_items():
         description = input("Description (or press enter to finish): ")
         if not description:
             break
-            
+
         try:
             quantity = int(input("Quantity: "))
             if quantity <= 0:
                 print("Quantity must be greater than 0")
                 continue
-                
+
             unit_price = float(input("Unit Price: $"))
             if unit_price <= 0:
                 print("Price must be greater than 0")
                 continue
-                
-            items.append({
-                'description': description,
-                'quantity': quantity,
-                'unit_price': unit_price
-            })
+
+            items.append(
+                {
+                    "description": description,
+                    "quantity": quantity,
+                    "unit_price": unit_price,
+                }
+            )
             print(f"Item added: {quantity} x {description} at ${unit_price:.2f} each")
-            
+
             add_more = input("\nAdd another item? (y/n): ").lower()
-            if add_more != 'y':
+            if add_more != "y":
                 break
-                
+
         except ValueError:
             print("Invalid input. Please enter numbers for quantity and price.")
             continue
-            
+
     return items
 
+
 def main():
     init_db()
     generator = InvoiceGenerator()
@@ -86,29 +109,31 @@ def main():
         choice = input("Enter your choice (1-6): ")
 
         try:
-            if choice == '1':
+            if choice == "1":
                 # Add Customer
                 name, email, address, phone = get_customer_input()
                 customer_id = generator.create_customer(name, email, address, phone)
                 print(f"\nCustomer created successfully! ID: {customer_id}")
 
-            elif choice == '2':
+            elif choice == "2":
                 # Create Invoice
                 if not list_customers():
                     print("Please add a customer first.")
                     continue
-                    
+
                 try:
-                    customer_id = int(input("\nEnter Customer ID from the list above: "))
+                    customer_id = int(
+                        input("\nEnter Customer ID from the list above: ")
+                    )
                 except ValueError:
                     print("Invalid input. Please enter a number.")
                     continue
-                
+
                 items = get_invoice_items()
                 if not items:
                     print("\nNo items added. Invoice creation cancelled.")
                     continue
-                    
+
                 try:
                     invoice_id = generator.create_invoice(customer_id, items)
                     print(f"\nInvoice created successfully! ID: {invoice_id}")
@@ -116,23 +141,12 @@ def main():
                 except ValueError as e:
                     print(f"\nError: {str(e)}")
 
-            elif choice == '3':
+            elif choice == "3":
                 # Generate PDF
-                session = Session()
-                invoices = session.query(Invoice).all()
-                session.close()
-                
-                if not invoices:
+                if not list_invoices(generator):
                     print("\nNo invoices found. Create an invoice first.")
                     continue
-                    
-                print("\nAvailable Invoices:")
-                print("ID  | Invoice Number    | Customer Name        | Total Amount")
-                print("-" * 65)
-                for invoice in invoices:
-                    print(f"{invoice.id:<3} | {invoice.invoice_number:<16} | "
-                          f"{invoice.customer.name[:18]:<18} | ${invoice.total_amount:,.2f}")
-                
+
                 try:
                     invoice_id = int(input("\nEnter Invoice ID from the list above: "))
                     filename = generator.generate_pdf(invoice_id)
@@ -140,26 +154,16 @@ def main():
                 except ValueError as e:
                     print(f"\nError: {str(e)}")
 
-            elif choice == '4':
+            elif choice == "4":
                 # List Customers
                 list_customers()
 
-            elif choice == '5':
+            elif choice == "5":
                 # List Invoices
-                session = Session()
-                invoices = session.query(Invoice).all()
-                if not invoices:
+                if not list_invoices(generator):
                     print("\nNo invoices found.")
-                else:
-                    print("\nInvoices:")
-                    print("ID  | Invoice Number    | Customer Name        | Total Amount")
-                    print("-" * 65)
-                    for invoice in invoices:
-                        print(f"{invoice.id:<3} | {invoice.invoice_number:<16} | "
-                              f"{invoice.customer.name[:18]:<18} | ${invoice.total_amount:,.2f}")
-                session.close()
-
-            elif choice == '6':
+
+            elif choice == "6":
                 print("\nGoodbye!")
                 break
 
@@ -172,7 +176,8 @@ def main():
             print(f"\nAn error occurred: {str(e)}")
             logger.exception("An error occurred")
 
-if __name__ == '__main__':
+
+if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
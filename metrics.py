@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from sub-millisecond queries to slow batch requests
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Observations made while collect() runs, so work done in a worker process
+# can be replayed into the parent's registry
+_capture = threading.local()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [
+                (self.name + _format_labels(self.label_names, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        captured = getattr(_capture, "observations", None)
+        if captured is not None:
+            captured.append((self.name, labels, value))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        samples = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, [("le", bound)])
+                samples.append((f"{self.name}_bucket{labels}", cumulative))
+            labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+            samples.append((f"{self.name}_bucket{labels}", values[-1]))
+            labels = _format_labels(self.label_names, key)
+            samples.append((f"{self.name}_sum{labels}", values[-2]))
+            samples.append((f"{self.name}_count{labels}", values[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "API request latency by route",
+        labels=("method", "route", "status"),
+    )
+)
+db_query_duration = REGISTRY.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Database statement execution time by statement type",
+        labels=("operation",),
+    )
+)
+db_query_errors = REGISTRY.register(
+    Counter(
+        "db_query_errors_total",
+        "Database statements that raised an error",
+        labels=("operation",),
+    )
+)
+stage_duration = REGISTRY.register(
+    Histogram(
+        "stage_duration_seconds",
+        "Time spent in invoice numbering and PDF rendering stages",
+        labels=("stage",),
+    )
+)
+email_deliveries = REGISTRY.register(
+    Counter(
+        "email_deliveries_total",
+        "Invoice email send attempts by outcome",
+        labels=("result",),
+    )
+)
+
+
+def timed(stage):
+    """Time a block as one of the ``stage_duration_seconds`` stages."""
+    return stage_duration.time(stage=stage)
+
+
+def collect(func, *args):
+    """Call ``func(*args)`` and return ``(result, observations)``.
+
+    Used to run work in another process: pass the observations back and
+    :func:`replay` them so they show up in this process's registry.
+    """
+    _capture.observations = []
+    try:
+        return func(*args), _capture.observations
+    finally:
+        _capture.observations = None
+
+
+def replay(observations):
+    for name, labels, value in observations:
+        REGISTRY.get(name).observe(value, **labels)
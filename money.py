@@ -0,0 +1,57 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+
+CENT = Decimal("0.01")
+
+
+def to_decimal(value):
+    """Convert a money value to a Decimal rounded half-up to the cent.
+
+    Floats go through their shortest repr, so ``0.1`` becomes exactly
+    ``Decimal("0.10")`` rather than the binary approximation.
+    """
+    if isinstance(value, float):
+        value = repr(value)
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(value):
+    """Convert a money value to integer minor units."""
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        # Fast path for floats that already have at most two decimal places
+        cents = round(value * 100)
+        if abs(value * 100 - cents) < 1e-6:
+            return cents
+    elif isinstance(value, Decimal) and value.as_tuple().exponent >= -2:
+        return int(value.scaleb(2))
+    return int(to_decimal(value) * 100)
+
+
+def from_cents(cents):
+    """Convert integer minor units back to a two-place Decimal."""
+    return Decimal(cents).scaleb(-2)
+
+
+class Money(TypeDecorator):
+    """Amount stored exactly as an integer number of cents.
+
+    Accepts Decimal, int, float or numeric strings on the way in and always
+    returns a Decimal with two places.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_cents(value)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import config
+import metrics
+from pdf_generator import TEMPLATE_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(invoice, customer):
+    """Return a hash of everything that affects how an invoice renders.
+
+    Status and notes are not drawn, so sending or paying an invoice keeps
+    its cached PDF.
+    """
+    payload = {
+        "template_version": TEMPLATE_VERSION,
+        "renderer": config.PDF_RENDERER,
+        "company": [
+            config.COMPANY_NAME,
+            config.COMPANY_ADDRESS,
+            config.COMPANY_PHONE,
+            config.COMPANY_EMAIL,
+            config.COMPANY_WEBSITE,
+        ],
+        "invoice": [
+            invoice.invoice_number,
+            invoice.date,
+            invoice.due_date,
+            invoice.total_amount,
+        ],
+        "items": [
+            [item.description, item.quantity, item.unit_price, item.total]
+            for item in invoice.items
+        ],
+        "customer": [customer.name, customer.email, customer.address, customer.phone],
+    }
+    encoded = json.dumps(payload, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class PDFCache:
+    """Content-addressed store of rendered PDFs with size and age eviction."""
+
+    def __init__(self, directory=None, max_bytes=None, max_age_days=None):
+        self.directory = Path(directory or config.PDF_CACHE_DIR)
+        self.max_bytes = config.PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        max_age_days = (
+            config.PDF_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        )
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> [size, last_used], loaded lazily
+        self._total_bytes = 0
+
+    def path_for(self, key):
+        return self.directory / f"{key}.pdf"
+
+    def get(self, key):
+        """Return the cached path for ``key`` or None, counting the hit/miss."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            path = self.path_for(key)
+            now = time.time()
+            if entry and now - entry[1] <= self.max_age:
+                try:
+                    # Another process may have evicted the file; that's a miss
+                    os.utime(path, (now, now))
+                except FileNotFoundError:
+                    pass
+                else:
+                    entry[1] = now
+                    self.hits += 1
+                    return path
+            if entry:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, render):
+        """Render into the cache with ``render(filename)`` and return the path.
+
+        The file is written under a temporary name and moved into place so
+        concurrent readers never see a partial PDF.
+        """
+        path = self.path_for(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            render(str(tmp_path))
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        with self._lock:
+            self._load()
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            size = path.stat().st_size
+            self._entries[key] = [size, time.time()]
+            self._total_bytes += size
+            self._evict(keep=key)
+        return path
+
+    def put_bytes(self, key, data):
+        """Store already rendered PDF bytes and return the cached path."""
+        with metrics.timed("pdf_cache_write"):
+            return self.put(key, lambda filename: Path(filename).write_bytes(data))
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._load()
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _load(self):
+        """Index the files already on disk the first time the cache is used."""
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self._total_bytes = 0
+        if not self.directory.exists():
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                self._entries[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+                self._total_bytes += stat.st_size
+
+    def _evict(self, keep):
+        """Drop expired entries, then least recently used ones until under size."""
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e[1] > self.max_age]:
+            self._remove(key)
+            self.evictions += 1
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        try:
+            self.path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cached PDF {key}: {str(e)}")
+
+
+# Shared by every InvoiceGenerator in the process
+default_cache = PDFCache()
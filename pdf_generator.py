@@ -1,10 +1,103 @@
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import (
+    PageBreak,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+    Table,
+    TableStyle,
+)
 from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+
+import config
+import metrics
+
+# Bump whenever the rendered layout changes so cached PDFs are invalidated
+TEMPLATE_VERSION = 2
+
+
+class InvoiceTemplate:
+    """Everything about an invoice layout that does not depend on the invoice.
+
+    The stylesheet, table style, column widths and company header are built
+    once and shared by every render in the process (see :func:`get_template`).
+    """
+
+    def __init__(self):
+        self.styles = getSampleStyleSheet()
+        self.col_widths = [4 * inch, inch, 1.2 * inch, 1.2 * inch]
+        self.table_style = TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                ("FONTSIZE", (0, 0), (-1, 0), 14),
+                ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+                ("BACKGROUND", (0, -1), (-1, -1), colors.beige),
+                ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
+                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+                ("FONTSIZE", (0, 1), (-1, -1), 12),
+                ("ALIGN", (-1, 0), (-1, -1), "RIGHT"),
+                ("GRID", (0, 0), (-1, -2), 1, colors.black),
+            ]
+        )
+        # Statements list invoices above two summary rows (billed, outstanding)
+        self.statement_col_widths = [
+            1.8 * inch,
+            1.1 * inch,
+            1.1 * inch,
+            inch,
+            1.4 * inch,
+        ]
+        self.statement_table_style = TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+                ("FONTSIZE", (0, 0), (-1, 0), 12),
+                ("BOTTOMPADDING", (0, 0), (-1, 0), 10),
+                ("BACKGROUND", (0, -2), (-1, -1), colors.beige),
+                ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+                ("FONTSIZE", (0, 1), (-1, -1), 10),
+                ("ALIGN", (-1, 0), (-1, -1), "RIGHT"),
+                ("GRID", (0, 0), (-1, -3), 1, colors.black),
+            ]
+        )
+        # The header sits at the top of the first page and never splits, so
+        # the same parsed paragraphs can be reused by every document
+        self.header = [Paragraph(escape(config.COMPANY_NAME), self.styles["Heading1"])]
+        for line in (
+            config.COMPANY_ADDRESS,
+            f"Phone: {config.COMPANY_PHONE}",
+            config.COMPANY_EMAIL,
+            config.COMPANY_WEBSITE,
+        ):
+            self.header.append(Paragraph(escape(line), self.styles["Normal"]))
+        self.header.append(Spacer(1, 20))
+
+    def paragraph(self, text, style="Normal"):
+        return Paragraph(escape(str(text)), self.styles[style])
+
+
+@lru_cache(maxsize=None)
+def get_template():
+    """Return the process-wide InvoiceTemplate, building it on first use."""
+    return InvoiceTemplate()
 
 
 class PDFGenerator:
-    def __init__(self, filename):
+    def __init__(self, filename, template=None):
+        """``filename`` may be a path or a writable binary file object."""
         self.filename = filename
         self.doc = SimpleDocTemplate(
             filename,
@@ -14,33 +107,61 @@ class PDFGenerator:
             topMargin=72,
             bottomMargin=72,
         )
-        self.styles = getSampleStyleSheet()
+        self.template = template or get_template()
+        self.styles = self.template.styles
 
     def generate_invoice(self, invoice, customer):
+        with metrics.timed("pdf_elements"):
+            elements = self.invoice_elements(invoice, customer)
+        # Platypus lays out and writes the file in the same pass
+        with metrics.timed("pdf_build"):
+            self.doc.build(elements)
+
+    def generate_invoices(self, invoices):
+        """Render ``(invoice, customer)`` pairs into one document, a page each."""
+        self.doc.build(
+            self._join_pages(self.invoice_elements(*pair) for pair in invoices)
+        )
+
+    def generate_statement(self, customer, invoices, date_from=None, date_to=None):
+        """Render a statement: a summary page, then every invoice in full."""
+        pages = [self.statement_elements(customer, invoices, date_from, date_to)]
+        pages += [self.invoice_elements(invoice, customer) for invoice in invoices]
+        self.doc.build(self._join_pages(pages))
+
+    @staticmethod
+    def _join_pages(pages):
         elements = []
+        for page in pages:
+            if elements:
+                elements.append(PageBreak())
+            elements.extend(page)
+        return elements
 
-        # Add company header
-        elements.append(Paragraph("Your Company Name", self.styles["Heading1"]))
-        elements.append(Paragraph("123 Business Street", self.styles["Normal"]))
-        elements.append(Paragraph("Phone: (555) 555-5555", self.styles["Normal"]))
+    def _bill_to(self, customer):
+        template = self.template
+        elements = [template.paragraph("Bill To:", "Heading3")]
+        for line in (customer.name, customer.address, customer.email):
+            if line:
+                elements.append(template.paragraph(line))
         elements.append(Spacer(1, 20))
+        return elements
+
+    def invoice_elements(self, invoice, customer):
+        """Return the flowables for one invoice."""
+        template = self.template
+        elements = list(template.header)
 
         # Add invoice information
         elements.append(
-            Paragraph(f"Invoice #{invoice.invoice_number}", self.styles["Heading2"])
-        )
-        elements.append(Paragraph(f"Date: {invoice.date}", self.styles["Normal"]))
-        elements.append(
-            Paragraph(f"Due Date: {invoice.due_date}", self.styles["Normal"])
+            template.paragraph(f"Invoice #{invoice.invoice_number}", "Heading2")
         )
+        elements.append(template.paragraph(f"Date: {invoice.date}"))
+        elements.append(template.paragraph(f"Due Date: {invoice.due_date}"))
         elements.append(Spacer(1, 20))
 
         # Add customer information
-        elements.append(Paragraph("Bill To:", self.styles["Heading3"]))
-        elements.append(Paragraph(customer.name, self.styles["Normal"]))
-        elements.append(Paragraph(customer.address, self.styles["Normal"]))
-        elements.append(Paragraph(customer.email, self.styles["Normal"]))
-        elements.append(Spacer(1, 20))
+        elements.extend(self._bill_to(customer))
 
         # Create items table
         items_data = [["Description", "Quantity", "Unit Price", "Total"]]
@@ -57,27 +178,259 @@ class PDFGenerator:
         # Add total row
         items_data.append(["", "", "Total:", f"${invoice.total_amount:.2f}"])
 
-        table = Table(items_data, colWidths=[4 * inch, inch, 1.2 * inch, 1.2 * inch])
-        table.setStyle(
-            TableStyle(
+        table = Table(items_data, colWidths=template.col_widths)
+        table.setStyle(template.table_style)
+        elements.append(table)
+        return elements
+
+    def statement_elements(self, customer, invoices, date_from=None, date_to=None):
+        """Return the flowables for a statement's summary page."""
+        template = self.template
+        elements = list(template.header)
+        elements.append(template.paragraph("Statement", "Heading2"))
+        if date_from or date_to:
+            period = f"{date_from or 'start'} to {date_to or 'today'}"
+            elements.append(template.paragraph(f"Period: {period}"))
+        elements.append(Spacer(1, 20))
+        elements.extend(self._bill_to(customer))
+
+        rows = [["Invoice", "Date", "Due Date", "Status", "Amount"]]
+        billed = outstanding = 0
+        for invoice in invoices:
+            rows.append(
                 [
-                    ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                    ("FONTSIZE", (0, 0), (-1, 0), 14),
-                    ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-                    ("BACKGROUND", (0, -1), (-1, -1), colors.beige),
-                    ("TEXTCOLOR", (0, 1), (-1, -1), colors.black),
-                    ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-                    ("FONTSIZE", (0, 1), (-1, -1), 12),
-                    ("ALIGN", (-1, 0), (-1, -1), "RIGHT"),
-                    ("GRID", (0, 0), (-1, -2), 1, colors.black),
+                    invoice.invoice_number,
+                    str(invoice.date),
+                    str(invoice.due_date or ""),
+                    invoice.status,
+                    f"${invoice.total_amount:.2f}",
                 ]
             )
-        )
+            # Drafts and cancelled invoices are listed but not billed
+            if invoice.status in config.REVENUE_STATUSES:
+                billed += invoice.total_amount
+            if invoice.status in config.OUTSTANDING_STATUSES:
+                outstanding += invoice.total_amount
+        rows.append(["", "", "", "Billed:", f"${billed:.2f}"])
+        rows.append(["", "", "", "Outstanding:", f"${outstanding:.2f}"])
 
+        table = Table(rows, colWidths=template.statement_col_widths, repeatRows=1)
+        table.setStyle(template.statement_table_style)
         elements.append(table)
+        return elements
+
+
+class CanvasPDFGenerator:
+    """Draw an invoice straight onto a canvas using a fixed one-page layout.
+
+    Produces the same layout as :class:`PDFGenerator` (same styles, table
+    geometry and colours) without platypus flow layout, which makes it much
+    cheaper for short invoices. Use :meth:`fits` first; invoices that need
+    line wrapping or a second page must go through PDFGenerator.
+    """
+
+    PAGE_WIDTH, PAGE_HEIGHT = letter
+    MARGIN = 72
+    FRAME_PADDING = 6
+    HEADER_ROW_HEIGHT = 27
+    ROW_HEIGHT = 18
+
+    def __init__(self, filename, template=None):
+        self.filename = filename
+        self.template = template or get_template()
+        self.styles = self.template.styles
+        self.left = self.MARGIN + self.FRAME_PADDING
+        self.width = self.PAGE_WIDTH - 2 * (self.MARGIN + self.FRAME_PADDING)
+        self.top = self.PAGE_HEIGHT - self.MARGIN - self.FRAME_PADDING
+        self.bottom = self.MARGIN + self.FRAME_PADDING
+
+    def _blocks(self, invoice, customer):
+        """Return the text blocks above the table as (text, style) or (None, space)."""
+        blocks = [(config.COMPANY_NAME, "Heading1")]
+        for line in (
+            config.COMPANY_ADDRESS,
+            f"Phone: {config.COMPANY_PHONE}",
+            config.COMPANY_EMAIL,
+            config.COMPANY_WEBSITE,
+        ):
+            blocks.append((line, "Normal"))
+        blocks += [
+            (None, 20),
+            (f"Invoice #{invoice.invoice_number}", "Heading2"),
+            (f"Date: {invoice.date}", "Normal"),
+            (f"Due Date: {invoice.due_date}", "Normal"),
+            (None, 20),
+            ("Bill To:", "Heading3"),
+        ]
+        for line in (customer.name, customer.address, customer.email):
+            if line:
+                blocks.append((str(line), "Normal"))
+        blocks.append((None, 20))
+        return blocks
+
+    def _table_rows(self, invoice):
+        rows = [["Description", "Quantity", "Unit Price", "Total"]]
+        for item in invoice.items:
+            rows.append(
+                [
+                    str(item.description),
+                    str(item.quantity),
+                    f"${item.unit_price:.2f}",
+                    f"${item.total:.2f}",
+                ]
+            )
+        rows.append(["", "", "Total:", f"${invoice.total_amount:.2f}"])
+        return rows
+
+    def _blocks_height(self, blocks):
+        height = 0
+        for text, style in blocks:
+            if text is None:
+                height += style
+                continue
+            s = self.styles[style]
+            # spaceBefore is dropped at the top of the frame, as platypus does
+            height += (s.spaceBefore if height else 0) + s.leading + s.spaceAfter
+        return height
+
+    def fits(self, invoice, customer):
+        """Whether the invoice fits on one page without wrapping any text."""
+        blocks = self._blocks(invoice, customer)
+        for text, style in blocks:
+            if text is not None:
+                s = self.styles[style]
+                if stringWidth(text, s.fontName, s.fontSize) > self.width:
+                    return False
+        table_height = self.HEADER_ROW_HEIGHT + self.ROW_HEIGHT * (
+            len(invoice.items) + 1
+        )
+        used = self._blocks_height(blocks) + table_height
+        return used <= self.top - self.bottom
+
+    def generate_invoice(self, invoice, customer):
+        with metrics.timed("pdf_draw"):
+            c = self._draw(invoice, customer)
+        with metrics.timed("pdf_write"):
+            c.save()
+
+    def _draw(self, invoice, customer):
+        c = Canvas(self.filename, pagesize=letter)
+        y = self.top
+        at_top = True
+        for text, style in self._blocks(invoice, customer):
+            if text is None:
+                y -= style
+                at_top = False
+                continue
+            s = self.styles[style]
+            if not at_top:
+                y -= s.spaceBefore
+            at_top = False
+            c.setFont(s.fontName, s.fontSize)
+            c.setFillColor(s.textColor)
+            c.drawString(self.left, y - s.fontSize, text)
+            y -= s.leading + s.spaceAfter
+
+        self._draw_table(c, self._table_rows(invoice), y)
+        c.showPage()
+        return c
+
+    def _draw_table(self, c, rows, top):
+        widths = self.template.col_widths
+        table_width = sum(widths)
+        x0 = self.left + (self.width - table_width) / 2  # centred like platypus
+        col_x = [x0]
+        for width in widths:
+            col_x.append(col_x[-1] + width)
+        heights = [self.HEADER_ROW_HEIGHT] + [self.ROW_HEIGHT] * (len(rows) - 1)
+        row_y = [top]
+        for height in heights:
+            row_y.append(row_y[-1] - height)
+
+        # Backgrounds: grey header row, beige total row
+        c.setFillColor(colors.grey)
+        c.rect(x0, row_y[1], table_width, heights[0], stroke=0, fill=1)
+        c.setFillColor(colors.beige)
+        c.rect(x0, row_y[-1], table_width, heights[-1], stroke=0, fill=1)
+
+        # Cell text, bottom aligned: baseline = bottom + padding + leading - size
+        for r, row in enumerate(rows):
+            if r == 0:
+                font, size, padding, color = "Helvetica-Bold", 14, 12, colors.whitesmoke
+            else:
+                font, size, padding, color = "Helvetica", 12, 3, colors.black
+            c.setFont(font, size)
+            c.setFillColor(color)
+            baseline = row_y[r + 1] + padding + 12 - size
+            for col, text in enumerate(row):
+                if not text:
+                    continue
+                if col == len(row) - 1:
+                    c.drawRightString(col_x[col + 1] - 6, baseline, text)
+                else:
+                    c.drawCentredString(
+                        (col_x[col] + col_x[col + 1]) / 2, baseline, text
+                    )
+
+        # Grid around every row except the total row
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(1)
+        grid_bottom = row_y[-2]
+        for y in row_y[:-1]:
+            c.line(x0, y, col_x[-1], y)
+        for x in col_x:
+            c.line(x, top, x, grid_bottom)
+
+
+def render_invoice(output, invoice, customer, renderer=None):
+    """Render an invoice to ``output`` (a path or binary file object).
+
+    ``renderer`` is "canvas" or "platypus" and defaults to
+    ``config.PDF_RENDERER``. The canvas renderer is only used when the
+    invoice fits on one page; otherwise the platypus layout is used.
+    """
+    renderer = renderer or config.PDF_RENDERER
+    if renderer not in ("canvas", "platypus"):
+        raise ValueError(f"Unknown PDF renderer: {renderer}")
+    if renderer == "canvas":
+        generator = CanvasPDFGenerator(output)
+        if generator.fits(invoice, customer):
+            generator.generate_invoice(invoice, customer)
+            return
+    PDFGenerator(output).generate_invoice(invoice, customer)
+
+
+def render_invoice_file(invoice, customer, filename, renderer=None):
+    """Render an invoice to ``filename``.
+
+    Module-level so it can be shipped to worker processes; ``invoice`` and
+    ``customer`` may be plain snapshot objects rather than ORM instances.
+    """
+    render_invoice(filename, invoice, customer, renderer)
+    return filename
+
+
+def render_invoice_bytes(invoice, customer, renderer=None):
+    """Render an invoice in memory and return the PDF bytes."""
+    buffer = BytesIO()
+    render_invoice(buffer, invoice, customer, renderer)
+    return buffer.getvalue()
+
+
+def render_invoices(output, invoices):
+    """Render ``(invoice, customer)`` pairs into one PDF at ``output``."""
+    PDFGenerator(output).generate_invoices(invoices)
+    return output
+
+
+def render_statement(output, customer, invoices, date_from=None, date_to=None):
+    """Render a customer statement to ``output`` (a path or binary file object)."""
+    PDFGenerator(output).generate_statement(customer, invoices, date_from, date_to)
+    return output
+
 
-        # Build PDF
-        self.doc.build(elements)
+def render_statement_bytes(customer, invoices, date_from=None, date_to=None):
+    """Render a customer statement in memory and return the PDF bytes."""
+    buffer = BytesIO()
+    render_statement(buffer, customer, invoices, date_from, date_to)
+    return buffer.getvalue()
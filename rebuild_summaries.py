@@ -0,0 +1,8 @@
+from customer_summary import rebuild
+from database import init_db
+
+if __name__ == "__main__":
+    init_db()
+    print("Rebuilding customer summaries...")
+    count = rebuild()
+    print(f"Rebuilt summaries for {count} customers.")
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Optional, Tuple
+
+import config
+
+
+@dataclass(frozen=True, slots=True)
+class CustomerRecord:
+    """Read-only copy of a customer, safe to share between threads."""
+
+    id: int
+    name: str
+    email: Optional[str]
+    address: Optional[str]
+    phone: Optional[str]
+    created_at: date
+
+    @classmethod
+    def from_model(cls, customer):
+        return cls(
+            id=customer.id,
+            name=customer.name,
+            email=customer.email,
+            address=customer.address,
+            phone=customer.phone,
+            created_at=customer.created_at,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class InvoiceItemRecord:
+    description: str
+    quantity: int
+    unit_price: Decimal
+    total: Decimal
+
+
+@dataclass(frozen=True, slots=True)
+class InvoiceRecord:
+    """Read-only copy of an invoice and its items."""
+
+    id: int
+    invoice_number: str
+    customer_id: int
+    date: date
+    due_date: Optional[date]
+    total_amount: Decimal
+    status: str
+    notes: Optional[str]
+    items: Tuple[InvoiceItemRecord, ...]
+
+    @classmethod
+    def from_model(cls, invoice):
+        return cls(
+            id=invoice.id,
+            invoice_number=invoice.invoice_number,
+            customer_id=invoice.customer_id,
+            date=invoice.date,
+            due_date=invoice.due_date,
+            total_amount=invoice.total_amount,
+            status=invoice.status,
+            notes=invoice.notes,
+            items=tuple(
+                InvoiceItemRecord(
+                    description=item.description,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price,
+                    total=item.total,
+                )
+                for item in invoice.items
+            ),
+        )
+
+
+class RecordCache:
+    """In-process LRU cache of records with a time-to-live.
+
+    Entries are dropped explicitly by the code that writes the underlying
+    rows (see InvoiceGenerator); the TTL bounds how stale an entry can get
+    when rows are changed elsewhere, e.g. by another process.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = (
+            config.RECORD_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        )
+        self.ttl = config.RECORD_CACHE_TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, record)
+        # Bumped by every invalidation, so a load that raced with a write is
+        # returned to its caller but not cached
+        self._generation = 0
+
+    def get(self, key, load):
+        """Return the record for ``key``, calling ``load()`` on a miss.
+
+        Exceptions from ``load`` propagate and nothing is cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        record = load()
+        with self._lock:
+            if self._generation != generation or self.max_entries <= 0:
+                return record
+            self._entries[key] = (now + self.ttl, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return record
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+# Shared by every InvoiceGenerator in the process, so a write through any of
+# them invalidates the entries the others read
+default_cache = RecordCache()
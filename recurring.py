@@ -0,0 +1,326 @@
+"""Recurring invoices for subscription billing.
+
+A template holds a customer, invoice items and a cadence. :func:`run_due`
+selects the active templates whose next run is due with one indexed query
+per batch and bills them through InvoiceGenerator.create_invoices_bulk,
+advancing the templates in the same transaction as their invoices. A
+template that missed several periods, e.g. while the scheduler was down,
+gets one invoice per missed period, each dated on its period. Templates
+another run billed first are skipped.
+"""
+
+import argparse
+import logging
+import sys
+from collections import Counter
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import bindparam, select, update
+
+from config import RECURRING_BATCH_SIZE, RECURRING_MAX_CATCH_UP
+from database import Session, Customer, RecurringInvoice, init_db
+from invoice_generator import InvoiceGenerator
+from money import to_decimal
+
+logger = logging.getLogger(__name__)
+
+# Cadence -> length of one period
+CADENCES = {
+    "weekly": relativedelta(weeks=1),
+    "monthly": relativedelta(months=1),
+    "quarterly": relativedelta(months=3),
+    "yearly": relativedelta(years=1),
+}
+
+
+class BilledConcurrently(RuntimeError):
+    """Raised when another run advanced a template first."""
+
+
+def period_date(start_date, cadence, period):
+    """Return the run date of the ``period``-th period (0 is ``start_date``)."""
+    return start_date + CADENCES[cadence] * period
+
+
+def _template_items(items):
+    """Validate items and store prices as strings, so JSON keeps them exact."""
+    if not items:
+        raise ValueError("A recurring invoice needs at least one item")
+    try:
+        return [
+            {
+                "description": item["description"],
+                "quantity": int(item["quantity"]),
+                "unit_price": str(to_decimal(item["unit_price"])),
+            }
+            for item in items
+        ]
+    except (KeyError, TypeError, ArithmeticError) as e:
+        raise ValueError(f"Invalid item data: {e}")
+
+
+def create_template(customer_id, items, cadence, start_date=None, end_date=None):
+    """Create a recurring invoice first billed on ``start_date`` (today)."""
+    if cadence not in CADENCES:
+        raise ValueError(f"Invalid cadence: {cadence}")
+    start_date = start_date or date.today()
+    if end_date is not None and end_date < start_date:
+        raise ValueError("end_date must not be before start_date")
+    items = _template_items(items)
+
+    session = Session()
+    try:
+        if not session.get(Customer, customer_id):
+            raise ValueError("Customer not found")
+        template = RecurringInvoice(
+            customer_id=customer_id,
+            items=items,
+            cadence=cadence,
+            start_date=start_date,
+            end_date=end_date,
+            next_run=start_date,
+        )
+        session.add(template)
+        session.commit()
+        return template.id
+    finally:
+        session.close()
+
+
+def get_template(template_id):
+    """Return a recurring invoice as a dict."""
+    session = Session()
+    try:
+        template = session.get(RecurringInvoice, template_id)
+        if not template:
+            raise ValueError("Recurring invoice not found")
+        return {
+            "id": template.id,
+            "customer_id": template.customer_id,
+            "items": template.items,
+            "cadence": template.cadence,
+            "start_date": template.start_date,
+            "end_date": template.end_date,
+            "next_run": template.next_run,
+            "periods_billed": template.periods_billed,
+            "active": template.active,
+        }
+    finally:
+        session.close()
+
+
+def deactivate(template_id):
+    """Stop billing a recurring invoice."""
+    session = Session()
+    try:
+        template = session.get(RecurringInvoice, template_id)
+        if not template:
+            raise ValueError("Recurring invoice not found")
+        template.active = False
+        session.commit()
+    finally:
+        session.close()
+
+
+def _due(today, batch_size, skip):
+    query = (
+        select(
+            RecurringInvoice.id,
+            RecurringInvoice.customer_id,
+            RecurringInvoice.items,
+            RecurringInvoice.cadence,
+            RecurringInvoice.start_date,
+            RecurringInvoice.end_date,
+            RecurringInvoice.periods_billed,
+            RecurringInvoice.next_run,
+        )
+        .where(RecurringInvoice.active.is_(True), RecurringInvoice.next_run <= today)
+        .order_by(RecurringInvoice.next_run, RecurringInvoice.id)
+        .limit(batch_size)
+    )
+    if skip:
+        query = query.where(RecurringInvoice.id.not_in(skip))
+    session = Session()
+    try:
+        return session.execute(query).all()
+    finally:
+        session.close()
+
+
+def _plan(templates, today, max_catch_up):
+    """Return the invoices due for ``templates`` and the template updates."""
+    invoices = []
+    updates = []
+    for template in templates:
+        period = template.periods_billed
+        run = template.next_run
+        billed = 0
+        while (
+            run <= today
+            and (template.end_date is None or run <= template.end_date)
+            and billed < max_catch_up
+        ):
+            invoices.append(
+                {
+                    "customer_id": template.customer_id,
+                    "items": template.items,
+                    "date": run,
+                    "template_id": template.id,
+                }
+            )
+            billed += 1
+            period += 1
+            run = period_date(template.start_date, template.cadence, period)
+        updates.append(
+            {
+                "template_id": template.id,
+                "scheduled": template.next_run,
+                "next_run": run,
+                "periods_billed": period,
+                "active": template.end_date is None or run <= template.end_date,
+            }
+        )
+    return invoices, updates
+
+
+def _advance(session, updates):
+    """Move templates on to their next run, unless another run already did."""
+    if not updates:
+        return
+    table = RecurringInvoice.__table__
+    stmt = (
+        update(table)
+        .where(
+            table.c.id == bindparam("template_id"),
+            table.c.next_run == bindparam("scheduled"),
+        )
+        .values(
+            next_run=bindparam("next_run"),
+            periods_billed=bindparam("periods_billed"),
+            active=bindparam("active"),
+        )
+    )
+    result = session.connection().execute(stmt, updates)
+    if (
+        session.get_bind().dialect.supports_sane_multi_rowcount
+        and result.rowcount != len(updates)
+    ):
+        raise BilledConcurrently("Recurring invoices were billed concurrently")
+
+
+def _billed(invoices, updates, indexes):
+    """Return the updates of templates whose invoices are all being created.
+
+    ``indexes`` are the positions in ``invoices`` of the rows being inserted.
+    Raises RuntimeError if only some of a template's invoices are, so none
+    of them is created.
+    """
+    planned = Counter(invoice["template_id"] for invoice in invoices)
+    inserted = Counter(invoices[index]["template_id"] for index in indexes)
+    if any(0 < inserted[t] < count for t, count in planned.items()):
+        raise RuntimeError("Recurring invoices were only partly created")
+    return [
+        u for u in updates if inserted[u["template_id"]] == planned[u["template_id"]]
+    ]
+
+
+def run_due(
+    today=None,
+    generator=None,
+    batch_size=RECURRING_BATCH_SIZE,
+    max_catch_up=RECURRING_MAX_CATCH_UP,
+    on_created=None,
+):
+    """Bill every recurring invoice due on or before ``today``.
+
+    Templates are billed ``batch_size`` at a time, each batch in one
+    transaction; a batch that fails is rolled back and its templates are
+    left for the next run, as are templates whose invoices could not be
+    created. A batch another run billed first is skipped. ``on_created
+    (invoice_ids)``, if given, is called with the IDs of each batch's new
+    invoices, e.g. to queue their PDFs. Returns counts of the templates
+    billed and skipped and of the invoices created and failed.
+    """
+    today = today or date.today()
+    generator = generator or InvoiceGenerator()
+    summary = {"templates": 0, "invoices": 0, "failed": 0, "skipped": 0}
+    skip = set()
+    while True:
+        templates = _due(today, batch_size, skip)
+        if not templates:
+            return summary
+        invoices, updates = _plan(templates, today, max_catch_up)
+        lost = []
+
+        def before_commit(session, indexes):
+            try:
+                _advance(session, _billed(invoices, updates, indexes))
+            except BilledConcurrently:
+                lost.append(True)
+                raise
+
+        if not invoices:
+            # Only templates past their end date; just deactivate them
+            session = Session()
+            try:
+                before_commit(session, [])
+                session.commit()
+            except BilledConcurrently:
+                session.rollback()
+            finally:
+                session.close()
+        else:
+            results = generator.create_invoices_bulk(
+                invoices, chunk_size=len(invoices), before_commit=before_commit
+            )
+        if lost:
+            skip.update(template.id for template in templates)
+            summary["skipped"] += len(templates)
+            logger.info(
+                f"Skipped {len(templates)} recurring invoices billed by another run"
+            )
+            continue
+        if not invoices:
+            continue
+
+        created = [r["id"] for r in results if "id" in r]
+        if not created:
+            skip.update(template.id for template in templates)
+            summary["failed"] += len(invoices)
+            continue
+
+        failed = set()
+        for invoice, result in zip(invoices, results):
+            if "error" in result:
+                failed.add(invoice["template_id"])
+                summary["failed"] += 1
+                logger.error(
+                    f"Recurring invoice {invoice['template_id']} for "
+                    f"{invoice['date']} failed: {result['error']}"
+                )
+        # Failed templates were not advanced; leave them for the next run
+        skip.update(failed)
+        summary["templates"] += len(templates) - len(failed)
+        summary["invoices"] += len(created)
+        if on_created is not None:
+            on_created(created)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bill due recurring invoices.")
+    parser.add_argument("--date", type=date.fromisoformat, help="bill as of this day")
+    args = parser.parse_args(argv)
+
+    init_db()
+    summary = run_due(args.date)
+    print(
+        f"Billed {summary['templates']} recurring invoices: "
+        f"{summary['invoices']} invoices created, {summary['failed']} failed, "
+        f"{summary['skipped']} skipped"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func
+
+from archive import all_invoices
+from config import OUTSTANDING_STATUSES, REVENUE_STATUSES
+from database import Session, Customer, Invoice
+from money import from_cents
+
+# Upper bounds (days past due) of the aging buckets; anything later is "91+"
+AGING_BUCKETS = (30, 60, 90)
+
+
+def _month(session, column):
+    if session.get_bind().dialect.name == "sqlite":
+        return func.strftime("%Y-%m", column)
+    return func.to_char(column, "YYYY-MM")
+
+
+def revenue_by_month(year=None, customer_id=None, statuses=REVENUE_STATUSES):
+    """Return invoice count and revenue per ``YYYY-MM`` month."""
+    invoices = all_invoices().c
+    session = Session()
+    try:
+        month = _month(session, invoices.date).label("month")
+        query = (
+            session.query(
+                month,
+                func.count(invoices.id),
+                func.sum(invoices.total_amount),
+            )
+            .filter(invoices.status.in_(statuses))
+            .group_by(month)
+            .order_by(month)
+        )
+        if customer_id is not None:
+            query = query.filter(invoices.customer_id == customer_id)
+        if year is not None:
+            query = query.filter(
+                invoices.date >= datetime(year, 1, 1).date(),
+                invoices.date < datetime(year + 1, 1, 1).date(),
+            )
+        return [
+            {"month": m, "invoice_count": count, "revenue": revenue}
+            for m, count, revenue in query
+        ]
+    finally:
+        session.close()
+
+
+def revenue_by_customer(
+    date_from=None, date_to=None, limit=100, statuses=REVENUE_STATUSES
+):
+    """Return the customers with the highest revenue, largest first."""
+    invoices = all_invoices().c
+    session = Session()
+    try:
+        revenue = func.sum(invoices.total_amount).label("revenue")
+        query = (
+            session.query(
+                invoices.customer_id,
+                Customer.name,
+                func.count(invoices.id),
+                revenue,
+            )
+            .join(Customer, invoices.customer_id == Customer.id)
+            .filter(invoices.status.in_(statuses))
+            .group_by(invoices.customer_id, Customer.name)
+            .order_by(revenue.desc())
+            .limit(limit)
+        )
+        if date_from is not None:
+            query = query.filter(invoices.date >= date_from)
+        if date_to is not None:
+            query = query.filter(invoices.date <= date_to)
+        return [
+            {
+                "customer_id": customer_id,
+                "customer_name": name,
+                "invoice_count": count,
+                "revenue": total,
+            }
+            for customer_id, name, count, total in query
+        ]
+    finally:
+        session.close()
+
+
+def totals_by_status():
+    """Return invoice count and total amount for every status."""
+    invoices = all_invoices().c
+    session = Session()
+    try:
+        query = (
+            session.query(
+                invoices.status,
+                func.count(invoices.id),
+                func.sum(invoices.total_amount),
+            )
+            .group_by(invoices.status)
+            .order_by(invoices.status)
+        )
+        return [
+            {"status": status, "invoice_count": count, "total_amount": total}
+            for status, count, total in query
+        ]
+    finally:
+        session.close()
+
+
+def aging(as_of=None, statuses=OUTSTANDING_STATUSES):
+    """Bucket outstanding invoices by how many days past ``due_date`` they are.
+
+    Only live invoices are read; outstanding invoices are never archived.
+
+    Bucket boundaries are turned into dates up front so the database only
+    compares ``due_date`` values and can use the (status, due_date) index.
+    """
+    as_of = as_of or datetime.now().date()
+    labels = ["current"]
+    whens = [(Invoice.due_date >= as_of, "current")]
+    lower = 1
+    for upper in AGING_BUCKETS:
+        label = f"{lower}-{upper}"
+        whens.append((Invoice.due_date >= as_of - timedelta(days=upper), label))
+        labels.append(label)
+        lower = upper + 1
+    overflow = f"{lower}+"
+    labels.append(overflow)
+    bucket = case(*whens, else_=overflow).label("bucket")
+
+    session = Session()
+    try:
+        rows = {
+            label: (count, total)
+            for label, count, total in session.query(
+                bucket, func.count(Invoice.id), func.sum(Invoice.total_amount)
+            )
+            .filter(Invoice.status.in_(statuses), Invoice.due_date.isnot(None))
+            .group_by(bucket)
+        }
+        return [
+            {
+                "bucket": label,
+                "invoice_count": rows.get(label, (0, None))[0],
+                "total_amount": rows.get(label, (0, None))[1] or from_cents(0),
+            }
+            for label in labels
+        ]
+    finally:
+        session.close()
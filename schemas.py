@@ -0,0 +1,124 @@
+import os
+from datetime import date
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    EmailStr,
+    constr,
+    confloat,
+    conint,
+    field_validator,
+    model_validator,
+)
+from typing import Any, Dict, List, Literal, Optional
+
+
+class CustomerCreate(BaseModel):
+    name: constr(min_length=1, max_length=100)
+    email: EmailStr
+    address: Optional[str]
+    phone: Optional[str]
+
+
+class InvoiceItemCreate(BaseModel):
+    description: constr(min_length=1, max_length=255)
+    quantity: conint(gt=0)
+    unit_price: confloat(gt=0)
+
+
+class InvoiceCreate(BaseModel):
+    customer_id: int
+    items: List[InvoiceItemCreate]
+
+
+class InvoiceStatusUpdate(BaseModel):
+    status: str
+
+
+class InvoiceBulkCreate(BaseModel):
+    invoices: List[InvoiceCreate]
+
+
+class PDFBatchCreate(BaseModel):
+    invoice_ids: List[int]
+    # Renders in flight for this batch; they also share the API render gate
+    workers: Optional[conint(gt=0, le=os.cpu_count() or 1)] = None
+
+    @field_validator("invoice_ids")
+    @classmethod
+    def unique_ids(cls, invoice_ids):
+        return list(dict.fromkeys(invoice_ids))
+
+
+class EmailBatchCreate(BaseModel):
+    invoice_ids: List[int]
+
+
+class RecurringInvoiceCreate(BaseModel):
+    customer_id: int
+    items: List[InvoiceItemCreate]
+    cadence: str
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+# Parameters accepted for each kind of job submitted through POST /jobs.
+# Imports are only queued by POST /jobs/import, which saves the upload itself;
+# no kind takes a server path.
+class JobParams(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class PDFJobParams(JobParams):
+    invoice_id: int
+
+
+class PDFsJobParams(JobParams):
+    invoice_ids: List[int]
+
+
+class StatementJobParams(JobParams):
+    customer_id: int
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+class EmailJobParams(JobParams):
+    invoice_ids: List[int]
+
+
+class ExportJobParams(JobParams):
+    format: Literal["csv", "jsonl"] = "csv"
+    after_id: Optional[int] = None
+
+
+class ArchiveJobParams(JobParams):
+    older_than_days: Optional[conint(ge=0)] = None
+
+
+class RecurringJobParams(JobParams):
+    as_of: Optional[date] = None
+    queue_pdfs: Optional[bool] = None
+
+
+JOB_PARAMS = {
+    "pdf": PDFJobParams,
+    "pdfs": PDFsJobParams,
+    "statement": StatementJobParams,
+    "email": EmailJobParams,
+    "export": ExportJobParams,
+    "archive": ArchiveJobParams,
+    "recurring": RecurringJobParams,
+}
+
+
+class JobCreate(BaseModel):
+    kind: Literal[tuple(JOB_PARAMS)]
+    params: Dict[str, Any] = {}
+
+    @model_validator(mode="after")
+    def check_params(self):
+        params = JOB_PARAMS[self.kind].model_validate(self.params)
+        self.params = params.model_dump(mode="json", exclude_none=True)
+        return self
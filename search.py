@@ -0,0 +1,244 @@
+import re
+
+from sqlalchemy import column, func, literal_column, or_, select, table
+
+from database import Session, Customer, Invoice, InvoiceItem, sync_search_index
+
+SEARCH_TYPES = ("customers", "invoices")
+MAX_SEARCH_RESULTS = 100
+
+# Matches ranked per search and kind, newest first. Full bm25 ranking has to
+# count every row containing each term, which takes over a second for common
+# prefixes on a million rows; ranking a bounded candidate set keeps every
+# query in the low milliseconds.
+SEARCH_CANDIDATES = 500
+
+# Rows indexed per transaction when catching up with writes
+SEARCH_SYNC_BATCH_SIZE = 10000
+
+# Rows a search indexes before running, so recent writes are found. Larger
+# backlogs, e.g. after a bulk load, are left to the job workers' sync.
+SEARCH_INLINE_SYNC_SIZE = 1000
+
+customers_fts = table("customers_fts", column("rowid"))
+invoices_fts = table("invoices_fts", column("rowid"))
+invoice_items_fts = table("invoice_items_fts", column("rowid"), column("invoice_id"))
+
+# Score for a term found in each field; a whole-word match scores double
+CUSTOMER_WEIGHTS = (("name", 10), ("email", 5), ("address", 1))
+INVOICE_WEIGHTS = (("invoice_number", 10), ("items", 2))
+
+_word = re.compile(r"\w+")
+
+
+def search_terms(q):
+    """Split a user query into lower-case word terms."""
+    terms = _word.findall(q.lower())
+    if not terms:
+        raise ValueError("Search query must contain a letter or digit")
+    return terms
+
+
+def fts_query(terms):
+    """Build an FTS5 query matching every term.
+
+    Terms of two or more characters match as prefixes, which the tables'
+    prefix indexes serve directly; single characters must match a whole
+    word. Terms are quoted, so FTS5 syntax in user input is matched literally.
+    """
+    return " ".join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+
+
+def matchers(terms):
+    """Return ``(whole_word, prefix)`` patterns for each term."""
+    return [
+        (
+            re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE),
+            re.compile(rf"\b{re.escape(term)}", re.IGNORECASE),
+        )
+        for term in terms
+    ]
+
+
+def score(term_matchers, fields, weights):
+    """Score a candidate by where each term matches; higher is better."""
+    total = 0
+    for whole, prefix in term_matchers:
+        best = 0
+        for name, weight in weights:
+            value = fields[name]
+            if not value or 2 * weight <= best:
+                continue
+            if whole.search(value):
+                best = 2 * weight
+            elif weight > best and prefix.search(value):
+                best = weight
+        total += best
+    return total
+
+
+def _candidates(fts_table, terms, id_column="rowid"):
+    """Select the IDs of the newest matches, read straight off the index."""
+    match = literal_column(fts_table.name).op("MATCH")(fts_query(terms))
+    return (
+        select(fts_table.c[id_column])
+        .where(match)
+        .order_by(fts_table.c.rowid.desc())
+        .limit(SEARCH_CANDIDATES)
+    )
+
+
+def _search_customers(session, terms, term_matchers):
+    query = session.query(Customer.id, Customer.name, Customer.email, Customer.address)
+    if session.get_bind().dialect.name == "sqlite":
+        query = query.filter(Customer.id.in_(_candidates(customers_fts, terms)))
+    else:
+        for term in terms:
+            pattern = f"%{term}%"
+            query = query.filter(
+                or_(
+                    Customer.name.ilike(pattern),
+                    Customer.email.ilike(pattern),
+                    Customer.address.ilike(pattern),
+                )
+            )
+        query = query.order_by(Customer.id.desc()).limit(SEARCH_CANDIDATES)
+    return [
+        (score(term_matchers, row._mapping, CUSTOMER_WEIGHTS), row.id, _customer, row)
+        for row in query
+    ]
+
+
+def _customer(row, row_score):
+    return {
+        "type": "customer",
+        "id": row.id,
+        "name": row.name,
+        "email": row.email,
+        "score": row_score,
+    }
+
+
+def _search_invoices(session, terms, term_matchers):
+    columns = [
+        Invoice.id,
+        Invoice.invoice_number,
+        Invoice.customer_id,
+        Customer.name.label("customer_name"),
+        Invoice.status,
+        Invoice.total_amount,
+    ]
+    if session.get_bind().dialect.name == "sqlite":
+        # All terms must match the invoice number or a single item
+        items = (
+            select(func.group_concat(InvoiceItem.description, " "))
+            .where(InvoiceItem.invoice_id == Invoice.id)
+            .scalar_subquery()
+        )
+        query = (
+            session.query(*columns, items.label("items"))
+            .join(Customer, Customer.id == Invoice.customer_id)
+            .filter(
+                or_(
+                    Invoice.id.in_(_candidates(invoices_fts, terms)),
+                    Invoice.id.in_(_candidates(invoice_items_fts, terms, "invoice_id")),
+                )
+            )
+        )
+    else:
+        query = session.query(*columns, literal_column("''").label("items")).join(
+            Customer, Customer.id == Invoice.customer_id
+        )
+        for term in terms:
+            pattern = f"%{term}%"
+            has_item = (
+                session.query(InvoiceItem.id)
+                .filter(
+                    InvoiceItem.invoice_id == Invoice.id,
+                    InvoiceItem.description.ilike(pattern),
+                )
+                .exists()
+            )
+            query = query.filter(or_(Invoice.invoice_number.ilike(pattern), has_item))
+        query = query.order_by(Invoice.id.desc()).limit(SEARCH_CANDIDATES)
+    return [
+        (score(term_matchers, row._mapping, INVOICE_WEIGHTS), row.id, _invoice, row)
+        for row in query
+    ]
+
+
+def _invoice(row, row_score):
+    return {
+        "type": "invoice",
+        "id": row.id,
+        "invoice_number": row.invoice_number,
+        "customer_id": row.customer_id,
+        "customer_name": row.customer_name,
+        "status": row.status,
+        "total_amount": row.total_amount,
+        "score": row_score,
+    }
+
+
+def sync(batch_size=SEARCH_SYNC_BATCH_SIZE, max_batches=None):
+    """Bring the search index up to date and return the number of rows indexed.
+
+    Rows are indexed ``batch_size`` at a time, one transaction per batch,
+    stopping after ``max_batches`` batches if given.
+    """
+    total = 0
+    batches = 0
+    session = Session()
+    try:
+        while max_batches is None or batches < max_batches:
+            synced = sync_search_index(session.connection(), batch_size)
+            session.commit()
+            if not synced:
+                break
+            total += synced
+            batches += 1
+        return total
+    finally:
+        session.close()
+
+
+def search(q, type=None, limit=20, offset=0):
+    """Search customers and invoices, best matches first.
+
+    Every word in ``q`` must match, as a prefix, a customer's name, email or
+    address, an invoice's number or one of its items' descriptions. On
+    SQLite the FTS5 indexes maintained by database.py find the newest
+    ``SEARCH_CANDIDATES`` matches of each kind, which are then ranked by
+    :func:`score`, newest first among equal scores. Other databases fall
+    back to substring matching.
+
+    Up to ``SEARCH_INLINE_SYNC_SIZE`` rows written since the index was last
+    synced are indexed first; the job workers index any larger backlog.
+    """
+    if type is not None and type not in SEARCH_TYPES:
+        raise ValueError(f"Invalid search type: {type}")
+    if not 0 < limit <= MAX_SEARCH_RESULTS:
+        raise ValueError(f"limit must be between 1 and {MAX_SEARCH_RESULTS}")
+    terms = search_terms(q)
+    term_matchers = matchers(terms)
+    sync(SEARCH_INLINE_SYNC_SIZE, max_batches=1)
+
+    session = Session()
+    try:
+        # (score, id, formatter, row); only the requested page is formatted
+        ranked = []
+        if type in (None, "customers"):
+            ranked += _search_customers(session, terms, term_matchers)
+        if type in (None, "invoices"):
+            ranked += _search_invoices(session, terms, term_matchers)
+    finally:
+        session.close()
+
+    ranked.sort(key=lambda r: (r[0], r[1]), reverse=True)
+    return {
+        "query": q,
+        "results": [
+            format_row(row, row_score)
+            for row_score, _, format_row, row in ranked[offset : offset + limit]
+        ],
+    }
@@ -0,0 +1,608 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import false
+
+import api
+import concurrency
+import idempotency
+import importer
+import jobs
+import metrics
+import search
+from database import Base, Customer, engine, Invoice, Job, Session, clear_database
+from pdf_cache import PDFCache
+from record_cache import RecordCache
+
+
+class TestAPI(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        Base.metadata.drop_all(engine)
+
+    def setUp(self):
+        clear_database()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        api.generator.pdf_cache = PDFCache(self.cache_dir.name)
+        api.generator.records = RecordCache()
+        self.client = TestClient(api.app)
+
+    def tearDown(self):
+        Session.remove()
+        self.cache_dir.cleanup()
+
+    def create_customer(self, email="test@example.com"):
+        response = self.client.post(
+            "/customers/",
+            json={
+                "name": "Test Customer",
+                "email": email,
+                "address": "123 Test St",
+                "phone": "555-555-5555",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["id"]
+
+    def create_invoice(self, customer_id, quantity=2, unit_price=10.00):
+        response = self.client.post(
+            "/invoices/",
+            json={
+                "customer_id": customer_id,
+                "items": [
+                    {
+                        "description": "Test Item",
+                        "quantity": quantity,
+                        "unit_price": unit_price,
+                    }
+                ],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["id"]
+
+    def test_create_invoice_idempotency_key(self):
+        customer_id = self.create_customer()
+        body = {
+            "customer_id": customer_id,
+            "items": [{"description": "Test Item", "quantity": 1, "unit_price": 5}],
+        }
+        headers = {"Idempotency-Key": "order-42"}
+        first = self.client.post("/invoices/", json=body, headers=headers)
+        retry = self.client.post("/invoices/", json=body, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.json()["id"], first.json()["id"])
+
+        other = self.client.post(
+            "/invoices/", json=body, headers={"Idempotency-Key": "order-43"}
+        )
+        self.assertNotEqual(other.json()["id"], first.json()["id"])
+
+        body["items"][0]["quantity"] = 2
+        response = self.client.post("/invoices/", json=body, headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+        session = Session()
+        try:
+            self.assertEqual(session.query(Invoice).count(), 2)
+        finally:
+            session.close()
+
+        # Expired keys are purged and no longer match
+        self.assertEqual(idempotency.purge(older_than=0), 2)
+        body["items"][0]["quantity"] = 1
+        response = self.client.post("/invoices/", json=body, headers=headers)
+        self.assertNotEqual(response.json()["id"], first.json()["id"])
+
+    def test_recurring_invoices(self):
+        customer_id = self.create_customer()
+        response = self.client.post(
+            "/recurring-invoices/",
+            json={
+                "customer_id": customer_id,
+                "items": [{"description": "Plan", "quantity": 1, "unit_price": 5}],
+                "cadence": "monthly",
+                "start_date": "2026-01-15",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        template_id = response.json()["id"]
+
+        template = self.client.get(f"/recurring-invoices/{template_id}").json()
+        self.assertEqual(template["next_run"], "2026-01-15")
+        self.assertTrue(template["active"])
+
+        response = self.client.post(
+            "/recurring-invoices/",
+            json={
+                "customer_id": customer_id,
+                "items": [{"description": "Plan", "quantity": 1, "unit_price": 5}],
+                "cadence": "hourly",
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.delete(f"/recurring-invoices/{template_id}")
+        self.assertEqual(response.json(), {"id": template_id, "active": False})
+        response = self.client.get("/recurring-invoices/999999")
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_invoices_keyset_pagination(self):
+        customer_id = self.create_customer()
+        ids = [self.create_invoice(customer_id) for _ in range(3)]
+
+        first = self.client.get("/invoices/", params={"limit": 2}).json()
+        rest = self.client.get(
+            "/invoices/", params={"after_id": first[-1]["id"], "limit": 2}
+        ).json()
+        self.assertEqual([i["id"] for i in first + rest], ids)
+        self.assertEqual(first[0]["customer_name"], "Test Customer")
+
+        response = self.client.get("/invoices/", params={"limit": 0})
+        self.assertEqual(response.status_code, 422)
+
+    def set_invoice(self, invoice_id, **fields):
+        session = Session()
+        try:
+            invoice = session.get(Invoice, invoice_id)
+            for name, value in fields.items():
+                setattr(invoice, name, value)
+            session.commit()
+        finally:
+            session.close()
+
+    def test_reports(self):
+        customer_id = self.create_customer()
+        other_id = self.create_customer("other@example.com")
+        today = date.today()
+        paid = self.create_invoice(customer_id, quantity=3)
+        overdue = self.create_invoice(other_id, quantity=1)
+        self.create_invoice(customer_id)  # draft, not revenue
+        self.set_invoice(paid, status="paid")
+        self.set_invoice(overdue, status="sent", due_date=today - timedelta(days=45))
+
+        monthly = self.client.get("/reports/revenue/monthly").json()
+        self.assertEqual(
+            monthly,
+            [{"month": today.strftime("%Y-%m"), "invoice_count": 2, "revenue": 40.0}],
+        )
+
+        by_customer = self.client.get("/reports/revenue/customers").json()
+        self.assertEqual(
+            [(c["customer_id"], c["revenue"]) for c in by_customer],
+            [(customer_id, 30.0), (other_id, 10.0)],
+        )
+
+        by_status = self.client.get("/reports/status").json()
+        self.assertEqual(
+            {s["status"]: s["invoice_count"] for s in by_status},
+            {"draft": 1, "paid": 1, "sent": 1},
+        )
+
+        aging = {b["bucket"]: b for b in self.client.get("/reports/aging").json()}
+        self.assertEqual(list(aging), ["current", "1-30", "31-60", "61-90", "91+"])
+        self.assertEqual(aging["31-60"]["invoice_count"], 1)
+        self.assertEqual(aging["31-60"]["total_amount"], 10.0)
+        self.assertEqual(aging["current"]["invoice_count"], 0)
+
+        # Day 90 is the last day of "61-90"
+        for days in (90, 91):
+            invoice_id = self.create_invoice(other_id)
+            self.set_invoice(
+                invoice_id, status="sent", due_date=today - timedelta(days=days)
+            )
+        aging = {b["bucket"]: b for b in self.client.get("/reports/aging").json()}
+        self.assertEqual(aging["61-90"]["invoice_count"], 1)
+        self.assertEqual(aging["91+"]["invoice_count"], 1)
+
+    def test_export_invoices(self):
+        customer_id = self.create_customer()
+        first = self.create_invoice(customer_id)
+        second = self.create_invoice(customer_id, quantity=3)
+
+        response = self.client.get("/export/invoices", params={"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual([int(r["invoice_id"]) for r in rows], [first, second])
+        self.assertEqual(rows[1]["total"], "30.00")
+
+        response = self.client.get(
+            "/export/invoices", params={"format": "jsonl", "after_id": first}
+        )
+        records = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([r["invoice_id"] for r in records], [second])
+        self.assertEqual(records[0]["items"][0]["quantity"], 3)
+
+    def test_import_customers_csv(self):
+        self.create_customer("taken@example.com")
+        data = (
+            "name,email,address,phone\n"
+            "Alice,alice@example.com,1 A St,555\n"
+            ",noname@example.com,,\n"
+            "Taken,taken@example.com,,\n"
+            "Bob,bob@example.com,,\n"
+            "Bob Again,bob@example.com,,\n"
+        )
+        response = self.client.post(
+            "/import",
+            params={"kind": "customers", "format": "csv", "chunk_size": 2},
+            files={"file": ("customers.csv", data)},
+        )
+        report = response.json()
+        self.assertEqual((report["imported"], report["rejected"]), (2, 3))
+        with open(report["rejects_file"]) as f:
+            rejects = [json.loads(line) for line in f]
+        os.remove(report["rejects_file"])
+        self.assertEqual([r["line"] for r in rejects], [3, 4, 6])
+        self.assertEqual(rejects[1]["error"], "Email already exists")
+        emails = {c["email"] for c in self.client.get("/customers/").json()}
+        self.assertEqual(
+            emails, {"taken@example.com", "alice@example.com", "bob@example.com"}
+        )
+
+    def test_import_customers_chunk_conflict(self):
+        self.create_customer("taken@example.com")
+        data = (
+            "name,email,address,phone\n"
+            "Alice,alice@example.com,,\n"
+            "Taken,taken@example.com,,\n"
+            "Bob,bob@example.com,,\n"
+        )
+        # Miss the existing email, as if another writer added it after the
+        # check; the chunk falls back to row-by-row inserts
+        select = importer.select
+        with mock.patch.object(
+            importer, "select", lambda *columns: select(*columns).where(false())
+        ):
+            report = importer.import_customers(io.StringIO(data), chunk_size=2)
+        self.assertEqual(report, {"imported": 2, "rejected": 1})
+        emails = {c["email"] for c in self.client.get("/customers/").json()}
+        self.assertEqual(
+            emails, {"taken@example.com", "alice@example.com", "bob@example.com"}
+        )
+
+    def test_import_invoices(self):
+        customer_id = self.create_customer()
+        csv_data = (
+            "customer_id,invoice_ref,description,quantity,unit_price\n"
+            f"{customer_id},A,Item 1,2,10.00\n"
+            f"{customer_id},A,Item 2,1,5.00\n"
+            f"{customer_id},,Item 3,1,1.00\n"
+            "9999,,Item 4,1,1.00\n"
+        )
+        response = self.client.post(
+            "/import",
+            params={"kind": "invoices", "format": "csv"},
+            files={"file": ("invoices.csv", csv_data)},
+        )
+        self.assertEqual(response.json()["imported"], 2)
+        self.assertEqual(response.json()["rejected"], 1)
+        os.remove(response.json()["rejects_file"])
+        totals = [i["total_amount"] for i in self.client.get("/invoices/").json()]
+        self.assertEqual(totals, [25.0, 1.0])
+
+        jsonl_data = (
+            json.dumps({"customer_id": customer_id, "items": []}) + "\nnot json\n"
+        )
+        response = self.client.post(
+            "/import",
+            params={"kind": "invoices", "format": "jsonl"},
+            files={"file": ("invoices.jsonl", jsonl_data)},
+        )
+        self.assertEqual(response.json()["imported"], 1)
+        self.assertEqual(response.json()["rejected"], 1)
+        os.remove(response.json()["rejects_file"])
+
+    def test_invoice_pdf_download(self):
+        invoice_id = self.create_invoice(self.create_customer())
+
+        response = self.client.get(f"/invoices/{invoice_id}/pdf")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+        # A cached copy is served even while the render queue is full
+        gate = concurrency.render_gate
+        with mock.patch.object(gate, "pending", gate.concurrency + gate.queue_limit):
+            response = self.client.get(f"/invoices/{invoice_id}/pdf")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content[:4], b"%PDF")
+
+    def test_invoice_pdf_not_found(self):
+        response = self.client.get("/invoices/9999/pdf")
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_customers_totals(self):
+        billed = self.create_customer("billed@example.com")
+        invoice_id = self.create_invoice(billed)
+        self.client.put(f"/invoices/{invoice_id}/status", json={"status": "sent"})
+        self.create_customer("new@example.com")
+
+        customers = {c["email"]: c for c in self.client.get("/customers/").json()}
+        self.assertEqual(customers["billed@example.com"]["total_billed"], 20.0)
+        self.assertEqual(customers["new@example.com"]["invoice_count"], 0)
+        # Customers without invoices report the same type as everyone else
+        for field in ("total_billed", "outstanding"):
+            self.assertEqual(
+                type(customers["new@example.com"][field]),
+                type(customers["billed@example.com"][field]),
+            )
+
+    def test_get_customer_and_invoice(self):
+        customer_id = self.create_customer()
+        invoice_id = self.create_invoice(customer_id)
+
+        response = self.client.get(f"/invoices/{invoice_id}")
+        self.assertEqual(response.status_code, 200)
+        invoice = response.json()
+        self.assertEqual(invoice["customer_id"], customer_id)
+        self.assertEqual(invoice["items"][0]["description"], "Test Item")
+        self.assertEqual(invoice["status"], "draft")
+
+        self.client.put(f"/invoices/{invoice_id}/status", json={"status": "sent"})
+        self.assertEqual(
+            self.client.get(f"/invoices/{invoice_id}").json()["status"], "sent"
+        )
+
+        response = self.client.get(f"/customers/{customer_id}")
+        self.assertEqual(response.json()["email"], "test@example.com")
+        self.assertEqual(self.client.get("/customers/9999").status_code, 404)
+        self.assertEqual(self.client.get("/invoices/9999").status_code, 404)
+
+        stats = self.client.get("/record-cache/stats").json()
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertEqual(stats["invalidations"], 1)
+
+    def test_generate_pdfs_batch(self):
+        invoice_id = self.create_invoice(self.create_customer())
+
+        response = self.client.post(
+            "/invoices/pdfs", json={"invoice_ids": [invoice_id, 9999, invoice_id]}
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["generated"], body["failed"]), (1, 1))
+        self.assertEqual([r["invoice_id"] for r in body["results"]], [invoice_id, 9999])
+        os.remove(body["results"][0]["filename"])
+
+        response = self.client.post(
+            "/invoices/pdfs",
+            json={"invoice_ids": [invoice_id], "workers": (os.cpu_count() or 1) + 1},
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_customer_statement(self):
+        customer_id = self.create_customer()
+        for _ in range(2):
+            self.create_invoice(customer_id)
+
+        response = self.client.get(f"/customers/{customer_id}/statement")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+
+        response = self.client.get("/customers/9999/statement")
+        self.assertEqual(response.status_code, 404)
+
+    def test_background_jobs(self):
+        invoice_id = self.create_invoice(self.create_customer())
+
+        response = self.client.post(
+            "/jobs", json={"kind": "export", "params": {"format": "csv"}}
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        self.assertEqual(self.client.get(f"/jobs/{job_id}").json()["status"], "queued")
+        self.assertEqual(self.client.get(f"/jobs/{job_id}/result").status_code, 409)
+
+        self.assertTrue(jobs.run_once())
+        self.assertFalse(jobs.run_once())
+        job = self.client.get(f"/jobs/{job_id}").json()
+        self.assertEqual(job["status"], "done")
+        response = self.client.get(f"/jobs/{job_id}/result")
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(int(rows[0]["invoice_id"]), invoice_id)
+        os.remove(job["result"]["filename"])
+
+        job_id = jobs.submit("pdf", {"invoice_id": 9999})
+        jobs.run_once()
+        job = self.client.get(f"/jobs/{job_id}").json()
+        self.assertEqual((job["status"], job["error"]), ("failed", "Invoice not found"))
+
+        self.assertEqual(self.client.get("/jobs/9999").status_code, 404)
+
+    def test_job_submission_is_restricted(self):
+        for body in (
+            {"kind": "unknown"},
+            {"kind": "import", "params": {"kind": "customers", "path": "/etc/passwd"}},
+            {"kind": "pdfs", "params": {"invoice_ids": [1], "output_dir": "/tmp"}},
+            {"kind": "pdf", "params": {}},
+        ):
+            response = self.client.post("/jobs", json=body)
+            self.assertEqual(response.status_code, 422, body)
+
+        # A queued import may only read, and then delete, an upload
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as stream:
+            stream.write(b"name,email\n")
+        try:
+            job_id = jobs.submit("import", {"kind": "customers", "path": stream.name})
+            jobs.run_once()
+            job = self.client.get(f"/jobs/{job_id}").json()
+            self.assertEqual(job["status"], "failed")
+            self.assertEqual(job["error"], "Import file is not an upload")
+            self.assertTrue(os.path.exists(stream.name))
+        finally:
+            os.remove(stream.name)
+
+    def test_requeue_stale_jobs(self):
+        fresh_id = jobs.submit("archive")
+        stale_id = jobs.submit("archive")
+        self.assertEqual(jobs.claim()[0], fresh_id)
+        self.assertEqual(jobs.claim()[0], stale_id)
+        # The stale job's worker stopped sending heartbeats long ago
+        long_ago = datetime.now() - timedelta(hours=1)
+        Session.query(Job).filter_by(id=stale_id).update(
+            {"started_at": long_ago, "heartbeat_at": long_ago}
+        )
+        Session.query(Job).filter_by(id=fresh_id).update({"started_at": long_ago})
+        Session.commit()
+
+        self.assertEqual(jobs.requeue_stale(older_than=600), 1)
+        self.assertEqual(jobs.get_job(fresh_id)["status"], "running")
+        self.assertEqual(jobs.get_job(stale_id)["status"], "queued")
+
+    def test_stale_email_job_not_requeued(self):
+        job_id = jobs.submit("email", {"invoice_ids": [1]})
+        self.assertEqual(jobs.claim()[0], job_id)
+        Session.query(Job).filter_by(id=job_id).update(
+            {"heartbeat_at": datetime.now() - timedelta(hours=1)}
+        )
+        Session.commit()
+
+        # Rerunning it could email invoices again
+        self.assertEqual(jobs.requeue_stale(older_than=600), 0)
+        job = jobs.get_job(job_id)
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("not retried", job["error"])
+
+    def test_stale_job_attempts_exhausted(self):
+        # A job that kills its worker every time is claimed at most 3 times
+        job_id = jobs.submit("archive")
+        for attempt in range(1, 4):
+            self.assertEqual(jobs.claim()[0], job_id)
+            Session.query(Job).filter_by(id=job_id).update(
+                {"heartbeat_at": datetime.now() - timedelta(hours=1)}
+            )
+            Session.commit()
+            requeued = jobs.requeue_stale(older_than=600, max_attempts=3)
+            self.assertEqual(requeued, 1 if attempt < 3 else 0)
+
+        job = jobs.get_job(job_id)
+        self.assertEqual((job["status"], job["attempts"]), ("failed", 3))
+        self.assertIn("gave up after 3 attempts", job["error"])
+        self.assertIsNone(jobs.claim())
+
+    def test_search(self):
+        customer_id = self.create_customer()
+        other_id = self.create_customer(email="widgets@example.com")
+        Session.query(Customer).filter_by(id=other_id).update({"name": "Acme Widgets"})
+        Session.commit()
+        invoice_id = self.create_invoice(customer_id)
+
+        # Writes only queue rows for indexing; sync indexes them in batches
+        self.assertEqual(search.sync(batch_size=1), 4)
+        self.assertEqual(search.sync(), 0)
+
+        def find(q, **params):
+            response = self.client.get("/search", params={"q": q, **params})
+            self.assertEqual(response.status_code, 200)
+            return [(r["type"], r["id"]) for r in response.json()["results"]]
+
+        self.assertEqual(find("widg"), [("customer", other_id)])
+        self.assertEqual(find("test cust"), [("customer", customer_id)])
+        self.assertEqual(find("test item"), [("invoice", invoice_id)])
+        number = Session.get(Invoice, invoice_id).invoice_number
+        self.assertEqual(find(number), [("invoice", invoice_id)])
+        self.assertEqual(find("test", type="invoices"), [("invoice", invoice_id)])
+        # A name match ranks above an address or item description match
+        self.assertEqual(find("test")[0], ("customer", customer_id))
+
+        Session.query(Customer).filter_by(id=other_id).update({"name": "Renamed"})
+        Session.commit()
+        self.assertEqual(find("acme"), [])
+        self.assertEqual(find("renamed"), [("customer", other_id)])
+
+        response = self.client.get("/search", params={"q": '"*'})
+        self.assertEqual(response.status_code, 400)
+
+        # A search indexes one bounded batch; the workers index the rest
+        for n in range(3):
+            self.create_customer(email=f"later{n}@example.com")
+        with mock.patch.object(search, "SEARCH_INLINE_SYNC_SIZE", 2):
+            self.assertEqual(len(find("later")), 2)
+        self.assertEqual(search.sync(), 1)
+        self.assertEqual(len(find("later")), 3)
+
+    def test_metrics(self):
+        invoice_id = self.create_invoice(self.create_customer())
+        self.client.get(f"/invoices/{invoice_id}/pdf", params={"persist": False})
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        text = response.text
+        self.assertIn(
+            'http_request_duration_seconds_count{method="POST",route="/invoices/",'
+            'status="200"}',
+            text,
+        )
+        self.assertIn('route="/invoices/{invoice_id}/pdf"', text)
+        self.assertIn('db_query_duration_seconds_count{operation="INSERT"}', text)
+        # Render stages recorded in the render process are copied back here
+        for stage in ("invoice_number", "pdf_draw", "pdf_write"):
+            self.assertIn(f'stage_duration_seconds_count{{stage="{stage}"}}', text)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "Test", ("kind",), (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, kind="a")
+        samples = dict(histogram.samples())
+        self.assertEqual(samples['test_seconds_bucket{kind="a",le="0.1"}'], 2)
+        self.assertEqual(samples['test_seconds_bucket{kind="a",le="1.0"}'], 3)
+        self.assertEqual(samples['test_seconds_bucket{kind="a",le="+Inf"}'], 4)
+        self.assertEqual(samples['test_seconds_count{kind="a"}'], 4)
+        self.assertAlmostEqual(samples['test_seconds_sum{kind="a"}'], 2.65)
+
+    def test_collect_and_replay(self):
+        def work():
+            metrics.stage_duration.observe(0.5, stage="test")
+            return "done"
+
+        result, observations = metrics.collect(work)
+        self.assertEqual(result, "done")
+        self.assertEqual(
+            observations, [("stage_duration_seconds", {"stage": "test"}, 0.5)]
+        )
+
+
+class TestRenderGate(unittest.TestCase):
+    def test_rejects_when_queue_full(self):
+        gate = concurrency.RenderGate(concurrency=1, queue_limit=1)
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def hold():
+                async with gate.slot():
+                    await release.wait()
+
+            tasks = [asyncio.create_task(hold()) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(concurrency.ServiceOverloaded):
+                async with gate.slot():
+                    pass
+            release.set()
+            await asyncio.gather(*tasks)
+            self.assertEqual(gate.pending, 0)
+
+        # Each event loop, e.g. one per server run, gets its own semaphore
+        for _ in range(2):
+            asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
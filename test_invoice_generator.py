@@ -1,13 +1,70 @@
+import asyncio
+import io
+import os
+import re
+import socket
+import tempfile
+import time
 import unittest
+from unittest import mock
+from datetime import date
+from decimal import Decimal
+from email import message_from_bytes, policy
+import archive
+import customer_summary
+import delivery
+import recurring
+import reports
+import totals
 from database import (
     Base,
     engine,
     Customer,
+    CustomerSummary,
     Invoice,
+    RecurringInvoice,
     Session,
     clear_database,
+    engine_settings,
 )
 from invoice_generator import InvoiceGenerator
+from invoice_numbers import InvoiceNumberAllocator
+from pdf_cache import PDFCache
+from record_cache import RecordCache
+from pdf_generator import (
+    CanvasPDFGenerator,
+    PDFGenerator,
+    get_template,
+    render_invoice_bytes,
+)
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class SMTPRecorder:
+    """aiosmtpd handler keeping received messages and scripted replies."""
+
+    def __init__(self):
+        self.messages = []
+        self.replies = {}  # recipient -> replies to give before accepting
+
+    async def handle_DATA(self, server, session, envelope):
+        replies = self.replies.get(envelope.rcpt_tos[0])
+        if replies:
+            return replies.pop(0)
+        self.messages.append(
+            message_from_bytes(envelope.content, policy=policy.default)
+        )
+        return "250 Message accepted"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
 
 
 class TestInvoiceGenerator(unittest.TestCase):
@@ -21,12 +78,24 @@ class TestInvoiceGenerator(unittest.TestCase):
 
     def setUp(self):
         clear_database()
-        self.generator = InvoiceGenerator()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.generator = InvoiceGenerator(
+            pdf_cache=PDFCache(self.cache_dir.name),
+            numbers=InvoiceNumberAllocator(),
+            records=RecordCache(),
+        )
         self.session = Session()
 
     def tearDown(self):
         self.session.close()
         Session.remove()
+        self.cache_dir.cleanup()
+
+    def test_sqlite_pragmas(self):
+        settings = engine_settings()
+        self.assertEqual(settings["journal_mode"], "wal")
+        self.assertEqual(settings["foreign_keys"], 1)
+        self.assertEqual(settings["busy_timeout"], 5000)
 
     def test_create_customer(self):
         customer_id = self.generator.create_customer(
@@ -71,6 +140,335 @@ class TestInvoiceGenerator(unittest.TestCase):
         invoice = self.session.get(Invoice, invoice_id)
         self.assertEqual(invoice.total_amount, 40.00)
 
+    def test_money_is_exact(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Item", "quantity": 3, "unit_price": 0.10}] * 10
+        invoice_id = self.generator.create_invoice(customer_id, items)
+        bulk_id = self.generator.create_invoices_bulk(
+            [{"customer_id": customer_id, "items": items}]
+        )[0]["id"]
+
+        for i in (invoice_id, bulk_id):
+            invoice = self.session.get(Invoice, i)
+            self.assertEqual(invoice.total_amount, Decimal("3.00"))
+            self.assertEqual(invoice.items[0].total, Decimal("0.30"))
+
+    def test_reconcile_invoice_totals(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [
+            {"description": "Item 1", "quantity": 2, "unit_price": 10.00},
+            {"description": "Item 2", "quantity": 1, "unit_price": 0.99},
+        ]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+        self.assertEqual(
+            totals.sum_item_totals(self.session), {invoice_id: Decimal("20.99")}
+        )
+
+        self.session.get(Invoice, invoice_id).total_amount = 0
+        self.session.commit()
+        self.assertEqual(self.generator.get_invoice(invoice_id).total_amount, 0)
+
+        # Totals and summaries are written in one transaction
+        with mock.patch.object(
+            customer_summary, "rebuild", side_effect=RuntimeError("rebuild failed")
+        ):
+            with self.assertRaises(RuntimeError):
+                totals.reconcile_invoice_totals(self.session)
+        self.session.rollback()
+        self.assertEqual(self.session.get(Invoice, invoice_id).total_amount, 0)
+        self.assertEqual(
+            totals.reconcile_invoice_totals(
+                self.session, records=self.generator.records
+            ),
+            1,
+        )
+        self.session.expire_all()
+        self.assertEqual(
+            self.session.get(Invoice, invoice_id).total_amount, Decimal("20.99")
+        )
+        # The cached copy was dropped
+        self.assertEqual(
+            self.generator.get_invoice(invoice_id).total_amount, Decimal("20.99")
+        )
+
+    def summary(self, customer_id):
+        self.session.expire_all()
+        row = self.session.get(CustomerSummary, customer_id)
+        return (row.invoice_count, row.total_billed, row.outstanding)
+
+    def test_customer_summary_incremental(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        first = self.generator.create_invoice(customer_id, items)
+        second = self.generator.create_invoices_bulk(
+            [{"customer_id": customer_id, "items": items}]
+        )[0]["id"]
+        self.assertEqual(self.summary(customer_id), (2, 0, 0))
+
+        self.generator.set_invoice_status(first, "sent")
+        self.generator.set_invoice_status(second, "sent")
+        self.assertEqual(self.summary(customer_id), (2, 40, 40))
+
+        self.generator.set_invoice_status(first, "paid")
+        self.assertEqual(self.summary(customer_id), (2, 40, 20))
+
+        self.session.delete(self.session.get(Invoice, second))
+        self.session.commit()
+        expected = (1, 20, 0)
+        self.assertEqual(self.summary(customer_id), expected)
+
+        self.assertEqual(customer_summary.rebuild(), 1)
+        self.assertEqual(self.summary(customer_id), expected)
+
+        self.session.delete(self.session.get(Customer, customer_id))
+        self.session.commit()
+        self.assertIsNone(self.session.get(CustomerSummary, customer_id))
+
+    def test_record_cache(self):
+        customer_id = self.generator.create_customer("Test Customer", None, None, None)
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+
+        invoice = self.generator.get_invoice(invoice_id)
+        self.assertIs(self.generator.get_invoice(invoice_id), invoice)
+        self.assertEqual(invoice.items[0].total, Decimal("20.00"))
+        with self.assertRaises(AttributeError):
+            invoice.status = "paid"
+
+        self.generator.set_invoice_status(invoice_id, "sent")
+        self.assertEqual(self.generator.get_invoice(invoice_id).status, "sent")
+        self.assertEqual(self.generator.get_customer(customer_id).name, "Test Customer")
+        with self.assertRaises(ValueError):
+            self.generator.get_customer(9999)
+
+        stats = self.generator.records.stats()
+        # create_invoice loaded the customer; get_customer then hit the cache
+        self.assertEqual((stats["hits"], stats["invalidations"]), (2, 1))
+
+        # A customer deleted while cached fails the foreign key, not a 500
+        self.session.delete(self.session.get(Customer, customer_id))
+        self.session.commit()
+        with self.assertRaisesRegex(ValueError, "Customer not found"):
+            self.generator.create_invoice(customer_id, items)
+        with self.assertRaises(ValueError):
+            self.generator.get_customer(customer_id)
+
+    def test_record_cache_eviction(self):
+        cache = RecordCache(max_entries=2, ttl=60)
+        for key in ("a", "b", "a", "c"):
+            cache.get(key, lambda: key.upper())
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.get("a", lambda: "reloaded"), "A")
+        self.assertEqual(cache.get("b", lambda: "reloaded"), "reloaded")
+
+        expired = RecordCache(ttl=0)
+        expired.get("a", lambda: 1)
+        self.assertEqual(expired.get("a", lambda: 2), 2)
+
+    @unittest.skipUnless(Controller, "aiosmtpd is not installed")
+    def test_deliver_invoices(self):
+        recorder = SMTPRecorder()
+        controller = Controller(recorder, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        emails = ["a@example.com", "b@example.com", "c@example.com"]
+        customer_ids = [
+            self.generator.create_customer(f"Customer {n}", email, "1 St", "555")
+            for n, email in enumerate(emails)
+        ]
+        invoice_ids = [
+            self.generator.create_invoice(customer_id, items)
+            for customer_id in customer_ids
+        ]
+        recorder.replies["b@example.com"] = ["451 Try again later"]
+        recorder.replies["c@example.com"] = ["550 Mailbox unavailable"]
+        paid_id = self.generator.create_invoice(customer_ids[0], items)
+        self.generator.set_invoice_status(paid_id, "paid")
+
+        results = delivery.deliver_invoices(
+            invoice_ids + [999999, paid_id],
+            generator=self.generator,
+            connection_factory=lambda: delivery.SMTPConnection(
+                "127.0.0.1", controller.port, use_tls=False, username=""
+            ),
+            workers=2,
+            rate_limit=0,
+            retry_backoff=0,
+            batch_size=1,
+        )
+
+        self.assertEqual(results[0], {"id": invoice_ids[0], "email": emails[0]})
+        self.assertEqual(results[1], {"id": invoice_ids[1], "email": emails[1]})
+        self.assertIn("Mailbox unavailable", results[2]["error"])
+        self.assertEqual(results[3], {"id": 999999, "error": "Invoice not found"})
+        self.assertEqual(
+            results[4], {"id": paid_id, "skipped": "Invoice is already paid"}
+        )
+
+        self.assertEqual(
+            sorted(m["To"] for m in recorder.messages),
+            ["a@example.com", "b@example.com"],
+        )
+        attachment = next(recorder.messages[0].iter_attachments())
+        self.assertEqual(attachment.get_content_type(), "application/pdf")
+        self.assertTrue(attachment.get_payload(decode=True).startswith(b"%PDF"))
+
+        statuses = [self.generator.get_invoice(i).status for i in invoice_ids]
+        self.assertEqual(statuses, ["sent", "sent", "draft"])
+
+        # Sending again skips the invoices already sent
+        results = delivery.deliver_invoices(
+            invoice_ids[:1],
+            generator=self.generator,
+            connection_factory=lambda: delivery.SMTPConnection(
+                "127.0.0.1", controller.port, use_tls=False, username=""
+            ),
+        )
+        self.assertEqual(
+            results, [{"id": invoice_ids[0], "skipped": "Invoice is already sent"}]
+        )
+        self.assertEqual(len(recorder.messages), 2)
+        self.assertEqual(self.summary(customer_ids[1]), (1, 20, 20))
+        self.assertEqual(self.summary(customer_ids[2]), (1, 0, 0))
+
+    def test_rate_limiter(self):
+        async def acquire(limiter, count):
+            for _ in range(count):
+                await limiter.acquire()
+
+        limiter = delivery.RateLimiter(50)
+        start = time.monotonic()
+        asyncio.run(acquire(limiter, 6))
+        # The first token is available at once, the rest at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_recurring_invoices(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        items = [{"description": "Subscription", "quantity": 1, "unit_price": 9.99}]
+        monthly = recurring.create_template(
+            customer_id, items, "monthly", start_date=date(2026, 1, 31)
+        )
+        weekly = recurring.create_template(
+            customer_id,
+            items,
+            "weekly",
+            start_date=date(2026, 3, 1),
+            end_date=date(2026, 3, 10),
+        )
+        yearly = recurring.create_template(
+            customer_id, items, "yearly", start_date=date(2024, 6, 1)
+        )
+
+        created = []
+        summary = recurring.run_due(
+            date(2026, 4, 15),
+            generator=self.generator,
+            batch_size=2,
+            max_catch_up=2,
+            on_created=created.extend,
+        )
+        self.assertEqual(summary["invoices"], 7)
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(len(created), 7)
+
+        invoices = self.session.query(Invoice).order_by(Invoice.date).all()
+        self.assertEqual(
+            [(i.date, i.total_amount) for i in invoices],
+            [
+                (date(2024, 6, 1), Decimal("9.99")),
+                (date(2025, 6, 1), Decimal("9.99")),
+                (date(2026, 1, 31), Decimal("9.99")),
+                (date(2026, 2, 28), Decimal("9.99")),
+                (date(2026, 3, 1), Decimal("9.99")),
+                (date(2026, 3, 8), Decimal("9.99")),
+                (date(2026, 3, 31), Decimal("9.99")),
+            ],
+        )
+        # Numbered in each invoice's own year
+        self.assertTrue(invoices[0].invoice_number.startswith("INV-2024-"))
+        self.assertTrue(invoices[1].invoice_number.startswith("INV-2025-"))
+
+        template = recurring.get_template(monthly)
+        self.assertEqual(template["next_run"], date(2026, 4, 30))
+        self.assertEqual(template["periods_billed"], 3)
+        self.assertFalse(recurring.get_template(weekly)["active"])
+        self.assertEqual(recurring.get_template(yearly)["next_run"], date(2026, 6, 1))
+
+        # Nothing more is due the same day
+        summary = recurring.run_due(date(2026, 4, 15), generator=self.generator)
+        self.assertEqual(summary["invoices"], 0)
+
+        recurring.deactivate(monthly)
+        summary = recurring.run_due(date(2026, 6, 1), generator=self.generator)
+        self.assertEqual(summary["invoices"], 1)
+
+    def test_recurring_invoice_failures(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        items = [{"description": "Subscription", "quantity": 1, "unit_price": 10}]
+        good, bad = (
+            recurring.create_template(
+                customer_id, items, "monthly", start_date=date(2026, 1, 1)
+            )
+            for _ in range(2)
+        )
+        self.session.query(RecurringInvoice).filter_by(id=bad).update(
+            {"items": [{"description": "Broken", "quantity": "1", "unit_price": "1"}]}
+        )
+        self.session.commit()
+
+        # Only the template whose invoices were created moves on
+        summary = recurring.run_due(date(2026, 2, 1), generator=self.generator)
+        self.assertEqual((summary["templates"], summary["invoices"]), (1, 2))
+        self.assertEqual(summary["failed"], 2)
+        self.assertEqual(recurring.get_template(good)["next_run"], date(2026, 3, 1))
+        self.assertEqual(recurring.get_template(bad)["next_run"], date(2026, 1, 1))
+
+        # A batch that another run bills first is skipped, not failed
+        generator = self.generator
+
+        class RacingGenerator(InvoiceGenerator):
+            def create_invoices_bulk(self, invoices, **kwargs):
+                recurring.run_due(date(2026, 3, 1), generator=generator)
+                return super().create_invoices_bulk(invoices, **kwargs)
+
+        self.session.query(RecurringInvoice).filter_by(id=bad).update({"active": False})
+        self.session.commit()
+        summary = recurring.run_due(date(2026, 3, 1), generator=RacingGenerator())
+        self.assertEqual((summary["skipped"], summary["failed"]), (1, 0))
+        self.assertEqual(self.session.query(Invoice).count(), 3)
+        self.assertEqual(recurring.get_template(good)["next_run"], date(2026, 4, 1))
+
+    def test_recurring_invoice_invalid(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        items = [{"description": "Subscription", "quantity": 1, "unit_price": 10}]
+        with self.assertRaises(ValueError):
+            recurring.create_template(customer_id, items, "daily")
+        with self.assertRaises(ValueError):
+            recurring.create_template(customer_id, [], "monthly")
+        with self.assertRaises(ValueError):
+            recurring.create_template(999999, items, "monthly")
+
+    def test_set_invoice_status_invalid(self):
+        with self.assertRaises(ValueError):
+            self.generator.set_invoice_status(1, "archived")
+
     def test_invoice_number_uniqueness(self):
         customer_id = self.generator.create_customer(
             "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
@@ -85,6 +483,32 @@ class TestInvoiceGenerator(unittest.TestCase):
         invoice2 = self.session.get(Invoice, invoice2_id)
         self.assertNotEqual(invoice1.invoice_number, invoice2.invoice_number)
 
+    def test_invoice_numbers_sequential(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Test Item", "quantity": 1, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+        results = self.generator.create_invoices_bulk(
+            [{"customer_id": customer_id, "items": items}] * 2
+        )
+
+        year = self.session.get(Invoice, invoice_id).date.year
+        numbers = [
+            self.session.get(Invoice, i).invoice_number
+            for i in [invoice_id] + [r["id"] for r in results]
+        ]
+        self.assertEqual(numbers, [f"INV-{year}-{n:06d}" for n in range(1, 4)])
+
+    def test_invoice_number_blocks_do_not_overlap(self):
+        first = InvoiceNumberAllocator(block_size=3)
+        second = InvoiceNumberAllocator(block_size=3)
+
+        numbers = first.take(2) + second.take(2) + first.take(4) + second.take(1)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers[2], numbers[0][:-6] + "000004")
+
     def test_customer_invoice_relationship(self):
         customer_id = self.generator.create_customer(
             "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
@@ -113,6 +537,147 @@ class TestInvoiceGenerator(unittest.TestCase):
         self.assertEqual(invoice.items[0].total, 20.00)
         self.assertEqual(invoice.items[1].total, 20.00)
 
+    def test_create_invoices_bulk(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        invoices = [
+            {
+                "customer_id": customer_id,
+                "items": [{"description": "Item", "quantity": n, "unit_price": 5.00}],
+            }
+            for n in range(1, 6)
+        ]
+        invoices.insert(2, {"customer_id": 9999, "items": []})
+
+        results = self.generator.create_invoices_bulk(invoices, chunk_size=2)
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[2], {"index": 2, "error": "Customer not found"})
+        created = [r["id"] for r in results if "id" in r]
+        self.assertEqual(len(created), 5)
+        totals = [self.session.get(Invoice, i).total_amount for i in created]
+        self.assertEqual(totals, [5.00, 10.00, 15.00, 20.00, 25.00])
+        self.assertEqual(len(self.session.get(Invoice, created[0]).items), 1)
+
+    def test_create_invoices_bulk_invalid_items(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        results = self.generator.create_invoices_bulk(
+            [{"customer_id": customer_id, "items": [{"description": "No qty"}]}]
+        )
+        self.assertIn("error", results[0])
+
+    def test_list_invoices_pagination(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        other_id = self.generator.create_customer(
+            "Other Customer", "other@example.com", "1 Other St", "555-555-0000"
+        )
+
+        items = [{"description": "Test Item", "quantity": 1, "unit_price": 10.00}]
+        ids = [self.generator.create_invoice(customer_id, items) for _ in range(5)]
+        self.generator.create_invoice(other_id, items)
+
+        first = self.generator.list_invoices(limit=2, customer_id=customer_id)
+        second = self.generator.list_invoices(
+            after_id=first[-1]["id"], limit=10, customer_id=customer_id
+        )
+        self.assertEqual([i["id"] for i in first + second], ids)
+        self.assertEqual(first[0]["customer_name"], "Test Customer")
+        self.assertNotIn("items", first[0])
+
+        with_items = self.generator.list_invoices(limit=1, include_items=True)
+        self.assertEqual(with_items[0]["items"][0]["description"], "Test Item")
+
+        self.assertEqual(len(list(self.generator.iter_invoices(page_size=2))), 6)
+        self.assertEqual(self.generator.list_invoices(status="paid"), [])
+
+    def test_archive_invoices(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        ids = [self.generator.create_invoice(customer_id, items) for _ in range(4)]
+        for invoice_id, status in zip(ids, ("paid", "cancelled", "sent", "paid")):
+            self.generator.set_invoice_status(invoice_id, status)
+        # Only the first three are old enough to archive
+        for invoice in self.session.query(Invoice).filter(Invoice.id.in_(ids[:3])):
+            invoice.date = date(2020, 1, 1)
+        self.session.commit()
+        cached = self.generator.get_invoice(ids[0])
+        summary = self.summary(customer_id)
+        revenue = reports.revenue_by_customer()
+
+        archived = archive.archive_invoices(
+            older_than_days=365, batch_size=1, records=self.generator.records
+        )
+        self.assertEqual(archived, 2)
+        self.session.expire_all()
+        self.assertEqual(
+            [i.id for i in self.session.query(Invoice).order_by(Invoice.id)], ids[2:]
+        )
+
+        record = self.generator.get_invoice(ids[0])
+        self.assertIsNot(record, cached)
+        self.assertEqual(record, cached)
+        self.assertEqual(self.generator.get_invoice(ids[1]).status, "cancelled")
+
+        listed = self.generator.list_invoices(include_items=True)
+        self.assertEqual([i["id"] for i in listed], ids)
+        self.assertEqual(listed[1]["items"][0]["description"], "Test Item")
+        page = self.generator.list_invoices(after_id=ids[0], limit=2)
+        self.assertEqual([i["id"] for i in page], ids[1:3])
+        paid = self.generator.list_invoices(status="paid")
+        self.assertEqual([i["id"] for i in paid], [ids[0], ids[3]])
+        live = self.generator.list_invoices(include_archived=False)
+        self.assertEqual([i["id"] for i in live], ids[2:])
+
+        # Archived invoices still render
+        filename, data = self.generator.generate_pdf_bytes(ids[0], persist=False)
+        self.assertTrue(data.startswith(b"%PDF"))
+        self.assertTrue(self.generator.generate_pdf(ids[1]).endswith(".pdf"))
+
+        # Customer figures and reports still count archived invoices
+        self.assertEqual(self.summary(customer_id), summary)
+        customer_summary.rebuild()
+        self.assertEqual(self.summary(customer_id), summary)
+        self.assertEqual(reports.revenue_by_customer(), revenue)
+
+    def test_archive_newest_invoice(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        ids = [self.generator.create_invoice(customer_id, items) for _ in range(2)]
+        for invoice_id in ids:
+            self.generator.set_invoice_status(invoice_id, "paid")
+        self.session.query(Invoice).update({"date": date(2020, 1, 1)})
+        self.session.commit()
+
+        # The newest invoice holds the highest IDs, so it stays live
+        self.assertEqual(archive.archive_invoices(older_than_days=365), 1)
+        new_id = self.generator.create_invoice(customer_id, items)
+        self.assertGreater(new_id, ids[-1])
+
+        # Once a newer invoice exists it can be archived without ID reuse
+        self.assertEqual(archive.archive_invoices(older_than_days=365), 1)
+        newer_id = self.generator.create_invoice(customer_id, items)
+        self.assertGreater(newer_id, new_id)
+        listed = [i["id"] for i in self.generator.list_invoices()]
+        self.assertEqual(listed, [*ids, new_id, newer_id])
+        self.assertEqual(self.generator.get_invoice(newer_id).status, "draft")
+
+        # Deleting the newest invoices frees no IDs either
+        self.session.query(Invoice).delete()
+        self.session.commit()
+        latest_id = self.generator.create_invoice(customer_id, items)
+        self.assertGreater(latest_id, newer_id)
+
     def test_generate_pdf(self):
         customer_id = self.generator.create_customer(
             "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
@@ -124,6 +689,180 @@ class TestInvoiceGenerator(unittest.TestCase):
         filename = self.generator.generate_pdf(invoice_id)
         self.assertTrue(filename.endswith(".pdf"))
 
+    def test_generate_pdfs_batch(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_ids = [
+            self.generator.create_invoice(customer_id, items) for _ in range(3)
+        ]
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = self.generator.generate_pdfs(
+                invoice_ids + [9999], workers=2, output_dir=output_dir
+            )
+
+            self.assertEqual([r["invoice_id"] for r in results], invoice_ids + [9999])
+            for result in results[:3]:
+                self.assertTrue(os.path.exists(result["filename"]))
+            self.assertEqual(results[3]["error"], "Invoice not found")
+
+            # Duplicates are rendered once; any iterable of IDs works
+            results = self.generator.generate_pdfs(
+                (i for i in invoice_ids + invoice_ids[:1]),
+                workers=1,
+                output_dir=output_dir,
+            )
+            self.assertEqual([r["invoice_id"] for r in results], invoice_ids)
+
+    def test_pdf_template_shared(self):
+        customer_id = self.generator.create_customer("Test & Co", None, None, None)
+
+        items = [{"description": "Test <Item>", "quantity": 1, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+        _, _, _, snapshot = self.generator.prepare_pdf(invoice_id)
+
+        template = get_template()
+        self.assertTrue(render_invoice_bytes(*snapshot).startswith(b"%PDF"))
+        self.assertIs(get_template(), template)
+
+    def test_canvas_renderer(self):
+        customer_id = self.generator.create_customer("Test Customer", None, None, None)
+
+        items = [{"description": "Test Item", "quantity": 1, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+        _, _, _, (invoice, customer) = self.generator.prepare_pdf(invoice_id)
+
+        self.assertTrue(CanvasPDFGenerator(None).fits(invoice, customer))
+        canvas = render_invoice_bytes(invoice, customer, renderer="canvas")
+        platypus = render_invoice_bytes(invoice, customer, renderer="platypus")
+        self.assertTrue(canvas.startswith(b"%PDF"))
+        self.assertTrue(platypus.startswith(b"%PDF"))
+        with self.assertRaises(ValueError):
+            render_invoice_bytes(invoice, customer, renderer="unknown")
+
+        # Too many rows for one page: falls back to the platypus layout
+        invoice.items = invoice.items * 40
+        self.assertFalse(CanvasPDFGenerator(None).fits(invoice, customer))
+        self.assertTrue(render_invoice_bytes(invoice, customer).startswith(b"%PDF"))
+
+    def test_generate_statement(self):
+        customer_id = self.generator.create_customer("Test Customer", None, None, None)
+        other_id = self.generator.create_customer("Other Customer", None, None, None)
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_ids = [
+            self.generator.create_invoice(customer_id, items) for _ in range(3)
+        ]
+        self.generator.create_invoice(other_id, items)
+        self.generator.set_invoice_status(invoice_ids[0], "sent")
+
+        _, customer, invoices = self.generator.prepare_statement(customer_id)
+        self.assertEqual(customer.name, "Test Customer")
+        self.assertEqual([i.id for i in invoices], invoice_ids)
+        # Only the sent invoice is billed; the drafts are listed
+        table = PDFGenerator(io.BytesIO()).statement_elements(customer, invoices)[-1]
+        self.assertEqual(table._cellvalues[-2][-2:], ["Billed:", "$20.00"])
+        self.assertEqual(table._cellvalues[-1][-2:], ["Outstanding:", "$20.00"])
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            filename = self.generator.generate_statement(
+                customer_id, output_dir=output_dir
+            )
+            with open(filename, "rb") as f:
+                data = f.read()
+        # A summary page plus one page per invoice
+        self.assertEqual(len(re.findall(rb"/Type /Page\b", data)), 4)
+
+        with self.assertRaises(ValueError):
+            self.generator.prepare_statement(9999)
+
+    def test_generate_combined_pdf(self):
+        customer_id = self.generator.create_customer("Test Customer", None, None, None)
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_ids = [
+            self.generator.create_invoice(customer_id, items) for _ in range(3)
+        ]
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            path = os.path.join(output_dir, "combined.pdf")
+            self.generator.generate_combined_pdf(invoice_ids, path)
+            with open(path, "rb") as f:
+                self.assertEqual(len(re.findall(rb"/Type /Page\b", f.read())), 3)
+            with self.assertRaises(ValueError):
+                self.generator.generate_combined_pdf(invoice_ids + [9999], path)
+
+    def test_generate_pdf_cache_hit(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+
+        first = self.generator.generate_pdf(invoice_id)
+        second = self.generator.generate_pdf(invoice_id)
+        self.assertEqual(first, second)
+        stats = self.generator.pdf_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        # The status is not drawn, so changing it keeps the cached PDF
+        self.generator.set_invoice_status(invoice_id, "sent")
+        self.assertEqual(self.generator.generate_pdf(invoice_id), first)
+
+        customer = self.session.get(Customer, customer_id)
+        customer.address = "456 New St"
+        self.session.commit()
+        self.assertNotEqual(self.generator.generate_pdf(invoice_id), first)
+
+    def test_generate_pdf_bytes(self):
+        customer_id = self.generator.create_customer(
+            "Test Customer", "test@example.com", "123 Test St", "555-555-5555"
+        )
+
+        items = [{"description": "Test Item", "quantity": 2, "unit_price": 10.00}]
+        invoice_id = self.generator.create_invoice(customer_id, items)
+
+        filename, data = self.generator.generate_pdf_bytes(invoice_id, persist=False)
+        self.assertTrue(filename.endswith(".pdf"))
+        self.assertTrue(data.startswith(b"%PDF"))
+        self.assertEqual(self.generator.pdf_cache.stats()["entries"], 0)
+
+        self.generator.generate_pdf_bytes(invoice_id)
+        self.assertEqual(self.generator.pdf_cache.stats()["entries"], 1)
+
+    def test_pdf_cache_eviction(self):
+        cache = PDFCache(self.cache_dir.name, max_bytes=10)
+
+        def render(filename):
+            with open(filename, "wb") as f:
+                f.write(b"x" * 8)
+
+        first = cache.put("a", render)
+        second = cache.put("b", render)
+        self.assertFalse(first.exists())
+        self.assertTrue(second.exists())
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_pdf_cache_file_removed_is_miss(self):
+        cache = PDFCache(self.cache_dir.name)
+
+        def render(filename):
+            with open(filename, "wb") as f:
+                f.write(b"x")
+
+        path = cache.put("a", render)
+        # Simulate another process evicting the file between lookup and touch
+        with mock.patch("pdf_cache.os.utime", side_effect=FileNotFoundError):
+            self.assertIsNone(cache.get("a"))
+        self.assertFalse(path.exists())
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["entries"], 0)
+
 
 if __name__ == "__main__":
     unittest.main()
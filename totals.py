@@ -0,0 +1,71 @@
+"""Batch money arithmetic for invoices, done in integer cents.
+
+Totals for a whole batch are computed over flat arrays of quantities and unit
+prices rather than item by item, and the SQL helpers aggregate in the
+database so reports never load invoice rows into Python.
+"""
+
+from array import array
+from itertools import accumulate
+from operator import mul
+
+from sqlalchemy import func, select, update
+
+import customer_summary
+from database import Invoice, InvoiceItem
+from record_cache import default_cache
+
+
+def line_totals(quantities, unit_prices_cents):
+    """Multiply two equal-length arrays of quantities and unit prices in cents."""
+    return array("q", map(mul, quantities, unit_prices_cents))
+
+
+def invoice_totals(line_totals_cents, line_counts):
+    """Sum consecutive runs of ``line_counts`` line totals into invoice totals."""
+    ends = list(accumulate(line_counts))
+    starts = [0] + ends[:-1]
+    return [sum(line_totals_cents[s:e]) for s, e in zip(starts, ends)]
+
+
+def sum_item_totals(session, invoice_ids=None):
+    """Return ``{invoice_id: Decimal total}`` summed from items in SQL."""
+    query = select(InvoiceItem.invoice_id, func.sum(InvoiceItem.total)).group_by(
+        InvoiceItem.invoice_id
+    )
+    if invoice_ids is not None:
+        query = query.where(InvoiceItem.invoice_id.in_(invoice_ids))
+    return dict(session.execute(query).all())
+
+
+def reconcile_invoice_totals(session, records=None):
+    """Reset every invoice total to the sum of its items in one UPDATE.
+
+    Customer summaries are rebuilt in the same transaction, and corrected
+    invoices are dropped from ``records`` (the shared record cache by
+    default). Returns the number of invoices whose stored total was wrong.
+    """
+    records = default_cache if records is None else records
+    items_total = (
+        select(func.coalesce(func.sum(InvoiceItem.total), 0))
+        .where(InvoiceItem.invoice_id == Invoice.id)
+        .scalar_subquery()
+    )
+    corrected = (
+        session.execute(
+            update(Invoice)
+            .where(Invoice.total_amount != items_total)
+            .values(total_amount=items_total)
+            .returning(Invoice.id)
+            .execution_options(synchronize_session=False)
+        )
+        .scalars()
+        .all()
+    )
+    if corrected:
+        # The bulk UPDATE bypasses the flush hook that keeps summaries
+        # current; rebuild them in the same transaction
+        customer_summary.rebuild(session)
+    session.commit()
+    records.invalidate(*(("invoice", invoice_id) for invoice_id in corrected))
+    return len(corrected)